@@ -1,11 +1,14 @@
 import numpy as np
 import gym
 import heapq
+from collections import deque
 import argparse
 import json
 import os
+import time
 import torch
 import scipy.stats as stats
+from scipy.optimize import nnls
 
 class CEM():
     def __init__(self, env, args, my_dx, my_cost, num_elites, num_trajs, alpha):
@@ -28,6 +31,78 @@ class CEM():
         # used for mpc update
         self.soln_dim = self.action_shape * self.plan_hor
         self.pre_means = np.zeros(self.action_shape * self.plan_hor)
+        # anytime mode: wall-clock budget per control step in ms (None keeps the fixed max_iters loop)
+        self.budget_ms = getattr(args, 'plan_budget_ms', None)
+        self.min_trajs = min(2 * self.num_elites, self.num_trajs)
+        self.iter_costs = deque(maxlen=20)  # recent (num_trajs, plan_hor, ms per iteration) measurements
+        self.plan_info = {}
+        # (initial state, first-step plan) of recent episodes, for warm-starting reset()
+        self.warm_starts = deque(maxlen=getattr(args, 'warm_start_size', 5))
+        self.next_init = None
+        self.t = 0
+        self.pre_means_batch = None  # per-instance warm starts for hori_planning_batch
+        # optional termination_fn(obs, act, next_obs) -> [rows, 1] done flags for model rollouts
+        self.termination_fn = env.termination_fn if getattr(args, 'terminate_rollouts', False) else None
+        # optional terminal_value(states, horizon) -> [rows] value, seen from the start of the plan, of the states
+        # reached at the end of a horizon-step rollout
+        self.terminal_value = None
+        self.rollout_steps = 0  # horizon steps done by the last rollout cut short by a deadline
+
+    def reset(self, warm_start=None, init_state=None):
+        '''start a new episode; warm_start is None/'zeros', 'mean' (average first-step plan of the library),
+        'nearest' (plan of the episode whose initial state is closest to init_state) or an explicit plan'''
+        self.t = 0
+        self.pre_means = np.zeros(self.soln_dim)
+        self.pre_means_batch = None
+        self.next_init = None
+        if isinstance(warm_start, str):
+            if len(self.warm_starts) == 0 or warm_start == 'zeros':
+                return
+            if warm_start == 'mean':
+                self.next_init = np.mean([plan for _, plan in self.warm_starts], axis=0)
+            elif warm_start == 'nearest':
+                s = init_state.numpy() if torch.is_tensor(init_state) else np.asarray(init_state)
+                dists = [np.linalg.norm(s.ravel() - s0) for s0, _ in self.warm_starts]
+                self.next_init = self.warm_starts[int(np.argmin(dists))][1].copy()
+            else:
+                raise ValueError('unknown warm start: {}'.format(warm_start))
+        elif warm_start is not None:
+            self.next_init = np.array(warm_start, dtype=float).reshape(self.soln_dim)
+
+    def state_dict(self):
+        '''warm-start state carried across control steps and episodes, for checkpointing'''
+        return {'pre_means': self.pre_means, 'pre_means_batch': self.pre_means_batch, 'next_init': self.next_init,
+                't': self.t, 'warm_starts': list(self.warm_starts), 'iter_costs': list(self.iter_costs)}
+
+    def load_state_dict(self, state):
+        self.pre_means, self.pre_means_batch = state['pre_means'], state['pre_means_batch']
+        self.next_init, self.t = state['next_init'], state['t']
+        self.warm_starts.clear()
+        self.warm_starts.extend(state['warm_starts'])
+        self.iter_costs.clear()
+        self.iter_costs.extend(state['iter_costs'])
+
+    def get_init_means(self):
+        if self.next_init is not None:
+            init_means, self.next_init = self.next_init, None
+            return init_means
+        # Better warm-start: repeat last action instead of zeros for smoother planning
+        return np.concatenate((self.pre_means[self.action_shape:], self.pre_means[-self.action_shape:]))
+
+    def remember_plan(self, cur_s, means):
+        self.pre_means = means
+        if self.t == 0:
+            s = cur_s.numpy() if torch.is_tensor(cur_s) else np.asarray(cur_s)
+            self.warm_starts.append((s.ravel().copy(), means.copy()))
+        self.t += 1
+
+    def advance(self, cur_s, plan=None):
+        '''step the planner state on without planning, when an action chosen elsewhere is executed at cur_s;
+        plan, by default the warm start hori_planning would have searched from, is recorded as this step's plan'''
+        if plan is None:
+            plan = self.get_init_means()
+        self.next_init = None
+        self.remember_plan(cur_s, plan)
 
     def sample_hori_actions(self, means, vars, samples, elite_indices):
         '''get mean, var of horizon'''
@@ -47,13 +122,102 @@ class CEM():
         return solution, means, vars
 
 
+    def sample_solutions(self, means, vars, num_trajs):
+        '''sample num_trajs action sequences from the truncated normal, shape [len(means), num_trajs]'''
+        # standard truncated normal drawn without freezing per-element loc/scale arrays (same samples, less overhead)
+        lb_dist, ub_dist = means - self.lb, self.ub - means
+        constrained_var = np.minimum(np.minimum(np.square(lb_dist / 2), np.square(ub_dist / 2)), vars)
+        samples = stats.truncnorm.rvs(-2, 2, size=[num_trajs, len(means)]) * np.sqrt(constrained_var) + means
+        return samples.T
+
+    def iteration_cost(self):
+        '''(fixed, per_step, per_traj_step) ms of one iteration, fitted to recent iterations as
+        fixed + plan_hor * (per_step + per_traj_step * num_trajs) with non-negative terms'''
+        n, h, ms = (np.array(c, dtype=float) for c in zip(*self.iter_costs))
+        if len(set(zip(n, h))) < 2:
+            # a single shape so far: assume all of the cost scales with the work, which overestimates
+            # larger shapes; the rollout deadline bounds the smaller ones
+            return 0., 0., (ms / (h * n)).max()
+        return tuple(nnls(np.stack([np.ones_like(h), h, h * n], axis=1), ms)[0])
+
+    def fit_to_budget(self, remaining_ms):
+        '''shrink population first, then horizon, so one iteration fits in remaining_ms; (0, 0) if nothing fits'''
+        num_trajs, plan_hor = self.num_trajs, self.plan_hor
+        if remaining_ms <= 0:
+            return 0, 0
+        if len(self.iter_costs) == 0:
+            # no measurements yet: probe with the smallest population; the deadline bounds it
+            return self.min_trajs, plan_hor
+        fixed, per_step, per_traj = self.iteration_cost()
+        if fixed + plan_hor * (per_step + per_traj * num_trajs) > remaining_ms:
+            num_trajs = self.min_trajs
+            if per_traj > 0:
+                num_trajs = int(((remaining_ms - fixed) / plan_hor - per_step) / per_traj)
+                num_trajs = min(max(num_trajs, self.min_trajs), self.num_trajs)
+        step_ms = per_step + per_traj * num_trajs
+        if fixed + plan_hor * step_ms > remaining_ms:
+            plan_hor = int((remaining_ms - fixed) / step_ms) if step_ms > 0 else 0
+        if plan_hor < 1:
+            return 0, 0
+        return num_trajs, plan_hor
+
+    def hori_planning_budget(self, cur_s, budget_ms=None):
+        '''anytime CEM: iterate until the wall-clock budget is spent, always holding a valid best action'''
+        start = time.time()
+        budget_ms = self.budget_ms if budget_ms is None else budget_ms
+        deadline = start + budget_ms / 1000.
+        cur_s = cur_s.squeeze()
+
+        means = self.get_init_means()
+        vars = self.args.var * np.ones(self.soln_dim)
+        # warm-start plan is the fallback if not even one iteration fits
+        best_action = means[0:self.action_shape].copy()
+        used_trajs, used_hor = 0, 0
+        iter = 0
+
+        while np.max(vars) > self.epsilon and time.time() < deadline:
+            # 10% headroom so that timing noise does not cut the rollout off at its last steps
+            num_trajs, plan_hor = self.fit_to_budget(0.9 * (deadline - time.time()) * 1000.)
+            if num_trajs == 0:
+                if iter == 0 and self.iter_costs:
+                    # nothing fits the whole budget: let the oldest measurement age out, so that an
+                    # estimate from a slow spell cannot stop the planner for good
+                    self.iter_costs.popleft()
+                break
+            iter_start = time.time()
+            hor_dim = plan_hor * self.action_shape
+            solutions = self.sample_solutions(means[:hor_dim], vars[:hor_dim], num_trajs)
+            sample_ms = (time.time() - iter_start) * 1000.
+            pre_rewards, elite_indices, best_indice = self.get_elites(cur_s, solutions, plan_hor, deadline)
+            if pre_rewards is None:
+                # the deadline cut the rollout short: keep the last complete iteration, and record the cost
+                # of this one with its rollout extrapolated to the whole horizon
+                rollout_ms = (time.time() - iter_start) * 1000. - sample_ms
+                self.iter_costs.append((num_trajs, plan_hor,
+                                        sample_ms + rollout_ms * plan_hor / max(self.rollout_steps, 1)))
+                break
+            means[:hor_dim] = self.alpha * means[:hor_dim] + (1 - self.alpha) * solutions[:, elite_indices].mean(axis=1)
+            vars[:hor_dim] = self.alpha * vars[:hor_dim] + (1 - self.alpha) * solutions[:, elite_indices].var(axis=1)
+            best_action = means[0:self.action_shape].copy()
+            used_trajs, used_hor = num_trajs, plan_hor
+            iter += 1
+            self.iter_costs.append((num_trajs, plan_hor, (time.time() - iter_start) * 1000.))
+
+        self.remember_plan(cur_s, means)
+        elapsed_ms = (time.time() - start) * 1000.
+        self.plan_info = {'iterations': iter, 'elapsed_ms': elapsed_ms, 'budget_ms': budget_ms,
+                          'budget_used': elapsed_ms / budget_ms, 'num_trajs': used_trajs, 'plan_hor': used_hor}
+
+        return best_action, self.plan_info
+
     def hori_planning(self, cur_s):
+        if self.budget_ms is not None:
+            return self.hori_planning_budget(cur_s)[0]
+        start = time.time()
         cur_s = cur_s.squeeze()
         '''choose elite actions from simulation trajectorys from current timestep t'''
         action_shape = len([self.env.action_space.sample()])
-        # Better warm-start: repeat last action instead of zeros for smoother planning
-        init_means = np.concatenate((self.pre_means[self.action_shape:], 
-                                      self.pre_means[-self.action_shape:]))
+        init_means = self.get_init_means()
 
         init_vars = self.args.var * np.ones(self.action_shape * self.plan_hor)
 
@@ -77,27 +241,102 @@ class CEM():
         # print("final cumulative rewards", pre_rewards[best_indice])
 
         best_action = means[0:self.action_shape]
-        self.pre_means = means
+        self.remember_plan(cur_s, means)
+        self.plan_info = {'iterations': iter, 'elapsed_ms': (time.time() - start) * 1000., 'budget_ms': None,
+                          'budget_used': None, 'num_trajs': self.num_trajs, 'plan_hor': self.plan_hor}
 
         return best_action
 
-    def get_elites(self, cur_s, sample_hori_actions):
-        # compute total costs for each trajs and select the top ones
-        pre_cum_hori_rewards = np.zeros([self.num_trajs, 1])
-        pre_s = cur_s.numpy().copy()
-        # concat all trajs started with current state
-        pre_ss = [pre_s for i in range(self.num_trajs)]
-        pre_ss = np.array(pre_ss)
-        for t in range(self.plan_hor):
-            action_s = sample_hori_actions[t * self.action_shape:(t + 1) * self.action_shape].T.copy()
+    def sample_solutions_batch(self, means, vars, rngs=None):
+        '''sample num_trajs action sequences per row of means, [N, soln_dim] -> [N, num_trajs, soln_dim];
+        row i is drawn from rngs[i] when given, from the global numpy RNG otherwise'''
+        lb_dist, ub_dist = means - self.lb, self.ub - means
+        constrained_var = np.minimum(np.minimum(np.square(lb_dist / 2), np.square(ub_dist / 2)), vars)
+        if rngs is None:
+            samples = stats.truncnorm.rvs(-2, 2, size=[means.shape[0], self.num_trajs, self.soln_dim])
+        else:
+            samples = np.stack([stats.truncnorm.rvs(-2, 2, size=[self.num_trajs, self.soln_dim], random_state=rng)
+                                for rng in rngs])
+        return samples * np.sqrt(constrained_var)[:, None, :] + means[:, None, :]
+
+    def hori_planning_batch(self, cur_ss, rngs=None):
+        '''plan for N env instances at once, [N, obs_dim] -> [N, action_dim]; each instance keeps its own
+        action-sequence distribution, and all N x num_trajs candidates share one model call per horizon step.
+        rngs, one np.random.RandomState per instance, makes each instance's candidates independent of the others'''
+        cur_ss = cur_ss.numpy() if torch.is_tensor(cur_ss) else np.asarray(cur_ss)
+        cur_ss = cur_ss.reshape(-1, self.obs_shape).astype(np.float64)
+        n = cur_ss.shape[0]
+        if self.pre_means_batch is None or self.pre_means_batch.shape[0] != n:
+            self.pre_means_batch = np.zeros([n, self.soln_dim])
+
+        means = np.concatenate((self.pre_means_batch[:, self.action_shape:],
+                                self.pre_means_batch[:, -self.action_shape:]), axis=1)
+        vars = self.args.var * np.ones([n, self.soln_dim])
+        rows = np.arange(n)[:, None]
+        iter = 0
 
-            xu = np.concatenate((pre_ss.squeeze(), action_s), 1)
+        while iter < self.max_iters and np.max(vars) > self.epsilon:
+            solutions = self.sample_solutions_batch(means, vars, rngs)
+            rewards = self.get_rewards_batch(cur_ss, solutions)
+            elites = solutions[rows, np.argsort(-rewards, axis=1)[:, :self.num_elites]]
+            means = self.alpha * means + (1 - self.alpha) * elites.mean(axis=1)
+            vars = self.alpha * vars + (1 - self.alpha) * elites.var(axis=1)
+            iter += 1
+
+        self.pre_means_batch = means
+        return means[:, 0:self.action_shape]
+
+    def get_cost(self, xu, pre_ss, action_s):
+        '''learned reward of one horizon step for every trajectory, as a flat numpy array'''
+        return np.asarray(self.cost.predict(torch.Tensor(xu))).reshape(-1)
+
+    def get_rewards_batch(self, cur_ss, solutions):
+        '''cumulative predicted rewards of [N, num_trajs, soln_dim] action sequences from N start states'''
+        n, num_trajs, _ = solutions.shape
+        pre_ss = np.repeat(cur_ss, num_trajs, axis=0)
+        pre_cum_hori_rewards = self.rollout_rewards(pre_ss, solutions.reshape(n * num_trajs, self.soln_dim), self.plan_hor)
+        return pre_cum_hori_rewards.reshape(n, num_trajs)
+
+    def rollout_rewards(self, pre_ss, actions, plan_hor, deadline=None):
+        '''cumulative predicted rewards of action sequences [rows, soln_dim] from states [rows, obs_dim];
+        with a termination_fn, trajectories that end are dropped from later model calls; with a terminal_value,
+        the value of the final state is added to every trajectory still alive at the end of the horizon;
+        None if the next horizon step would not finish by the wall-clock deadline'''
+        pre_cum_hori_rewards = np.zeros(actions.shape[0])
+        alive = np.arange(actions.shape[0])
+        rollout_start = time.time()
+        for t in range(plan_hor):
+            if deadline is not None:
+                now = time.time()
+                if now > deadline or (t > 0 and now + (now - rollout_start) / t > deadline):
+                    self.rollout_steps = t
+                    return None
+            action_s = actions[alive, t * self.action_shape:(t + 1) * self.action_shape]
+            xu = np.concatenate((pre_ss, action_s), 1)
             new_pre_ss = self.my_dx.predict(xu)
-            pre_r = self.cost.predict(torch.Tensor(xu))
+            pre_cum_hori_rewards[alive] += self.get_cost(xu, pre_ss, action_s)
+            if self.termination_fn is not None:
+                live = self.termination_fn(pre_ss, action_s, new_pre_ss).reshape(-1) == 0
+                alive, new_pre_ss = alive[live], new_pre_ss[live]
+                if len(alive) == 0:
+                    break
             pre_ss = new_pre_ss
-            pre_cum_hori_rewards += pre_r
+        if self.terminal_value is not None and len(alive) > 0:
+            pre_cum_hori_rewards[alive] += self.terminal_value(pre_ss, plan_hor)
+        return np.nan_to_num(pre_cum_hori_rewards)
+
+    def get_elites(self, cur_s, sample_hori_actions, plan_hor=None, deadline=None):
+        plan_hor = self.plan_hor if plan_hor is None else plan_hor
+        num_trajs = sample_hori_actions.shape[1]
+        # compute total costs for each trajs and select the top ones
+        pre_s = cur_s.numpy().copy()
+        # concat all trajs started with current state
+        pre_ss = np.tile(pre_s.reshape(1, -1), (num_trajs, 1))
+        pre_cum_hori_rewards = self.rollout_rewards(pre_ss, sample_hori_actions.T, plan_hor, deadline)
+        if pre_cum_hori_rewards is None:
+            return None, None, None
+        pre_cum_hori_rewards = pre_cum_hori_rewards.reshape(-1, 1)
 
-        pre_cum_hori_rewards = np.nan_to_num(pre_cum_hori_rewards)
         elite_indices = list(
             map(pre_cum_hori_rewards.tolist().index, heapq.nlargest(self.num_elites, pre_cum_hori_rewards.tolist())))
         best_indice = pre_cum_hori_rewards.tolist().index(max(pre_cum_hori_rewards.tolist()))
@@ -12,10 +12,42 @@ import pickle
 
 import warnings
 
+from tf_models.model_io import ModelFile
+
 warnings.filterwarnings("ignore")
 
 
-class neural_bays_dx_tf(object):
+class _bays_posterior(object):
+    """BLR posterior on top of a feature network: Thompson samples of the last layer and the
+    predictive std, shared by neural_bays_dx_tf and numpy_bays_dx. Needs output_shape, sigma_n2,
+    mu_w, cov_w and get_representation() from the class it is mixed into."""
+
+    def sample(self, parallelize=False):
+        d = self.mu_w[0].shape[0]  # hidden_dim
+        beta_s = []
+        try:
+
+            for i in range(self.output_shape):
+                mus = self.mu_w[i]
+                covs = self.cov_w[i][np.newaxis, :, :]
+                multivariates = np.random.multivariate_normal(mus, covs[0])
+                beta_s.append(multivariates)
+
+        except np.linalg.LinAlgError as e:
+            # Sampling could fail if covariance is not positive definite
+            print('Details: {} | {}.'.format(e.message, e.args))
+            multivariates = np.random.multivariate_normal(np.zeros((d)), np.eye(d))
+            beta_s.append(multivariates)
+        self.beta_s = np.array(beta_s)
+
+    def predictive_std(self, x):
+        # BLR posterior predictive std of every output, sqrt(sigma_n2 + z^T cov_w z), [rows, output_shape]
+        z = np.atleast_2d(self.get_representation(x))
+        var = np.einsum('nh,ohk,nk->no', z, self.cov_w, z)
+        return np.sqrt(self.sigma_n2 + var)
+
+
+class neural_bays_dx_tf(_bays_posterior):
     def __init__(self, args, model, model_type, output_shape, device=None, train_x=None, train_y=None, sigma_n2=0.1,
                  sigma2=0.1):
         self.model = model
@@ -74,24 +106,6 @@ class neural_bays_dx_tf(object):
         print("cov dim: ", np.array(self.cov).shape)
 
 
-    def sample(self, parallelize=False):
-        d = self.mu_w[0].shape[0]  # hidden_dim
-        beta_s = []
-        try:
-
-            for i in range(self.output_shape):
-                mus = self.mu_w[i]
-                covs = self.cov_w[i][np.newaxis, :, :]
-                multivariates = np.random.multivariate_normal(mus, covs[0])
-                beta_s.append(multivariates)
-
-        except np.linalg.LinAlgError as e:
-            # Sampling could fail if covariance is not positive definite
-            print('Details: {} | {}.'.format(e.message, e.args))
-            multivariates = np.random.multivariate_normal(np.zeros((d)), np.eye(d))
-            beta_s.append(multivariates)
-        self.beta_s = np.array(beta_s)
-
     def predict(self, x):
         # Compute last-layer representation for the current context
         z_context = self.get_representation(x)
@@ -104,7 +118,26 @@ class neural_bays_dx_tf(object):
             return vals.T + state+ self.model.layers[len(self.model.layers)-1].biases.eval(session =self.model.sess).squeeze()[:self.output_shape]+np.random.normal(loc=0, scale=np.sqrt(self.sigma_n2),size = vals.T.shape)
         return vals.T + self.model.layers[len(self.model.layers)-1].biases.eval(session =self.model.sess).squeeze()[:self.output_shape]+np.random.normal(loc=0, scale=np.sqrt(self.sigma_n2),size = vals.T.shape)
 
+    def state_dict(self):
+        # dataset, network weights and BLR posterior, for checkpointing
+        return {'train_x': self.train_x, 'train_y': self.train_y, 'latent_z': self.latent_z,
+                'mu_w': self.mu_w, 'cov_w': self.cov_w, 'beta_s': self.beta_s,
+                'model': self.model.get_checkpoint_state()}
+
+    def load_state_dict(self, state):
+        self.train_x, self.train_y, self.latent_z = state['train_x'], state['train_y'], state['latent_z']
+        self.mu_w, self.cov_w, self.beta_s = state['mu_w'], state['cov_w'], state['beta_s']
+        self.model.load_checkpoint_state(state['model'])
+
+    def save(self, savedir, timestep):
+        # network and BLR posterior in one binary file, savedir/<model name>_<timestep>.npz
+        self.model.save(savedir, timestep, blr={'mu_w': self.mu_w, 'cov_w': self.cov_w, 'beta_s': self.beta_s})
 
+    def load_posterior(self, path):
+        # the network itself is loaded by BNN (load_model=True); only the posterior is read here
+        with ModelFile(path, lazy=True) as f:
+            blr = f.blr()
+        self.mu_w, self.cov_w, self.beta_s = blr['mu_w'], blr['cov_w'], blr.get('beta_s')
 
     def update_bays_reg(self):
 
@@ -134,3 +167,183 @@ class neural_bays_dx_tf(object):
                     self.cov_w[i] = inv
                     break
 
+
+class numpy_bays_dx(_bays_posterior):
+    """TensorFlow-free copy of a trained neural_bays_dx_tf, for planning with a posterior that must
+    not change under the planner (actor_learner workers, background training). load() reads a file
+    written by neural_bays_dx_tf.save() and copy_from() takes a live neural_bays_dx_tf: the feature
+    network of ensemble member 0 is evaluated in NumPy, and sample(), predict() and
+    predictive_std() behave as in neural_bays_dx_tf, whose posterior sampling it shares; it has none
+    of the training or checkpointing methods.
+    """
+    _activations = {
+        None: lambda x: x,
+        "ReLU": lambda x: np.maximum(x, 0),
+        "tanh": np.tanh,
+        "sigmoid": lambda x: 1 / (1 + np.exp(-x)),
+        "swish": lambda x: x / (1 + np.exp(-x)),
+    }
+
+    def __init__(self, model_type, output_shape, sigma_n2=0.1):
+        self.model_type = model_type
+        self.output_shape = output_shape
+        self.sigma_n2 = sigma_n2  # noise variacne
+        self.layers = None
+        self.mu_w, self.cov_w, self.beta_s = None, None, None
+
+    def load(self, path):
+        with ModelFile(path) as f:
+            structure, variables, blr = f.structure, f.variables(), f.blr()
+        self._set(structure, variables, blr['mu_w'], blr['cov_w'])
+
+    def copy_from(self, bays):
+        model = bays.model
+        self._set(model.get_structure(), model.sess.run(model.nonoptvars + model.optvars),
+                  bays.mu_w.copy(), bays.cov_w.copy())
+
+    def _set(self, structure, variables, mu_w, cov_w):
+        # variables: scaler mean and std, then weights and biases of every layer ([ensemble, ...])
+        # member 0's scaler, whether the scaler is shared ([1, in]) or per member ([ensemble, 1, in])
+        self.scaler_mu, self.scaler_sigma = [v.reshape(-1, v.shape[-1])[:1] for v in variables[:2]]
+        self.layers = [(variables[2 + 2 * i][0], variables[3 + 2 * i][0], self._activations[layer['activation']])
+                       for i, layer in enumerate(structure)]
+        self.bias = self.layers[-1][1].squeeze()[:self.output_shape]
+        self.mu_w, self.cov_w = mu_w, cov_w
+
+    def get_representation(self, input):
+        z = (np.asarray(input, dtype=np.float64) - self.scaler_mu) / self.scaler_sigma
+        for weights, biases, activation in self.layers[:-1]:
+            z = activation(np.dot(z, weights) + biases)
+        return z.squeeze()
+
+    def predict(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        vals = (self.beta_s.dot(self.get_representation(x).T))
+        noise = np.random.normal(loc=0, scale=np.sqrt(self.sigma_n2), size=vals.T.shape)
+        if self.model_type == "dx":
+            state = x[:vals.shape[0]] if len(x.shape) == 1 else x[:, :vals.shape[0]]
+            return vals.T + state + self.bias + noise
+        return vals.T + self.bias + noise
+
+
+class multi_seed_bays_dx_tf(object):
+    """S independent seeds sharing one BNN graph: ensemble member s is seed s's feature network,
+    trained only on seed s's data, with its own BLR posterior (mu_w[s], cov_w[s]) on top.
+
+    predict takes [S, rows, in_dim] inputs, one slab per seed, or 2D inputs whose rows are grouped
+    by seed in equal blocks (the layout of CEM.hori_planning_batch with one instance per seed),
+    and evaluates all seeds in one session call. rngs, one np.random.RandomState per seed, draws
+    seed s's prior, posterior samples, predictive noise and the bootstrap and shuffles of its member's
+    training. With construct_shallow_model(independent_members=True), which gives every member its own
+    input scaler and log-variance bounds, a seed's results do not depend on the seeds beside it as long
+    as all seeds hold the same number of rows (train_members steps through the largest dataset).
+    """
+    def __init__(self, args, model, model_type, output_shape, sigma_n2=0.1, sigma2=0.1, rngs=None):
+        self.model = model
+        self.model_type = model_type
+        self.args = args
+        self.num_seeds = model.num_nets
+        self.rngs = rngs if rngs is not None else [np.random.RandomState(s) for s in range(self.num_seeds)]
+        if len(self.rngs) != self.num_seeds:
+            raise ValueError('{} rngs given for {} seeds'.format(len(self.rngs), self.num_seeds))
+        self.output_shape = output_shape
+        self.hidden_dim = 2*model.layers[0].get_input_dim()
+        self.sigma2 = sigma2  # W prior variance
+        self.sigma_n2 = sigma_n2  # noise variacne
+        self.eye = np.eye(self.hidden_dim)
+        self.train_x = [None] * self.num_seeds
+        self.train_y = [None] * self.num_seeds
+        self.latent_z = [None] * self.num_seeds
+        self.mu_w = np.stack([rng.normal(loc=0, scale=.01, size=(output_shape, self.hidden_dim)) for rng in self.rngs])
+        self.cov_w = np.tile(self.sigma2 * self.eye, (self.num_seeds, output_shape, 1, 1))
+        self.beta_s = None
+
+    def add_data(self, seed_idx, new_x, new_y):
+        new_x, new_y = np.atleast_2d(new_x), np.reshape(new_y, (-1, self.output_shape))
+        if self.train_x[seed_idx] is None:
+            self.train_x[seed_idx], self.train_y[seed_idx] = new_x, new_y
+        else:
+            self.train_x[seed_idx] = np.vstack((self.train_x[seed_idx], new_x))
+            self.train_y[seed_idx] = np.vstack((self.train_y[seed_idx], new_y))
+
+    def biases(self):
+        # [S, output_shape] mean part of the last layer bias of every member
+        return self.model.layers[len(self.model.layers)-1].biases.eval(session=self.model.sess)[:, 0, :self.output_shape]
+
+    def generate_latent_z(self):
+        # one padded [S, max_rows, in_dim] pass for every seed's data
+        num_rows = max(x.shape[0] for x in self.train_x)
+        padded = np.zeros((self.num_seeds, num_rows, self.train_x[0].shape[1]))
+        for s, x in enumerate(self.train_x):
+            padded[s, :x.shape[0]] = x
+        z = self.model.predict(padded, layer=True)
+        self.latent_z = [z[s, :x.shape[0]] for s, x in enumerate(self.train_x)]
+
+    def train(self, epochs=5):
+        self.model.train_members(self.train_x, self.train_y, epochs=epochs, hide_progress=True, rngs=self.rngs)
+        self.generate_latent_z()
+
+    def sample(self):
+        self.beta_s = np.zeros((self.num_seeds, self.output_shape, self.hidden_dim))
+        for s, rng in enumerate(self.rngs):
+            for i in range(self.output_shape):
+                try:
+                    self.beta_s[s, i] = rng.multivariate_normal(self.mu_w[s, i], self.cov_w[s, i])
+                except np.linalg.LinAlgError:
+                    # Sampling could fail if covariance is not positive definite
+                    self.beta_s[s, i] = rng.multivariate_normal(np.zeros(self.hidden_dim), self.eye)
+
+    def predict(self, x):
+        x = np.asarray(x)
+        flat = x.ndim == 2
+        if flat:
+            if x.shape[0] % self.num_seeds != 0:
+                raise ValueError('{} rows cannot be split into {} seed blocks'.format(x.shape[0], self.num_seeds))
+            x = x.reshape(self.num_seeds, -1, x.shape[-1])
+        z = self.model.predict(x, layer=True)
+        vals = np.einsum('soh,srh->sro', self.beta_s, z) + self.biases()[:, None, :]
+        if self.model_type == "dx":
+            vals += x[:, :, :self.output_shape]
+        vals += np.stack([rng.normal(loc=0, scale=np.sqrt(self.sigma_n2), size=vals.shape[1:]) for rng in self.rngs])
+        return vals.reshape(-1, self.output_shape) if flat else vals
+
+    def state_dict(self):
+        return {'train_x': self.train_x, 'train_y': self.train_y, 'latent_z': self.latent_z,
+                'mu_w': self.mu_w, 'cov_w': self.cov_w, 'beta_s': self.beta_s,
+                'model': self.model.get_checkpoint_state()}
+
+    def load_state_dict(self, state):
+        self.train_x, self.train_y, self.latent_z = state['train_x'], state['train_y'], state['latent_z']
+        self.mu_w, self.cov_w, self.beta_s = state['mu_w'], state['cov_w'], state['beta_s']
+        self.model.load_checkpoint_state(state['model'])
+
+    def save(self, savedir, timestep):
+        # network and BLR posterior in one binary file, savedir/<model name>_<timestep>.npz
+        self.model.save(savedir, timestep, blr={'mu_w': self.mu_w, 'cov_w': self.cov_w, 'beta_s': self.beta_s})
+
+    def load_posterior(self, path):
+        # the network itself is loaded by BNN (load_model=True); only the posterior is read here
+        with ModelFile(path, lazy=True) as f:
+            blr = f.blr()
+        self.mu_w, self.cov_w, self.beta_s = blr['mu_w'], blr['cov_w'], blr.get('beta_s')
+
+    def update_bays_reg(self):
+        biases = self.biases()
+        for s in range(self.num_seeds):
+            z = self.latent_z[s]
+            A = np.dot(z.T, z) / self.sigma_n2 + 1 / self.sigma2 * self.eye
+            for i in range(self.output_shape):
+                # \beta | z,y ~ N(mu_q, cov_q), as in neural_bays_dx_tf.update_bays_reg
+                y = self.train_y[s][:, i] - biases[s, i]
+                B = np.dot(z.T, y) / self.sigma_n2
+                reg_coeff = 0
+                for _ in range(10):
+                    try:
+                        inv = np.linalg.inv(A + reg_coeff * self.eye)
+                    except np.linalg.LinAlgError as e:
+                        print(e)
+                        reg_coeff += 10
+                    else:
+                        self.mu_w[s, i] = inv.dot(B)
+                        self.cov_w[s, i] = inv
+                        break
@@ -0,0 +1,140 @@
+# actor-learner PSRL: worker processes collect episodes with the latest posterior while one learner trains
+import os
+
+import numpy as np
+import torch
+
+from cartpole_continuous import ContinuousCartPoleEnv
+from pendulum_gym import PendulumEnv
+from NB_dx_tf import numpy_bays_dx
+
+
+def make_env(env_name, seed):
+    if 'CartPole-continuous' in env_name:
+        env = ContinuousCartPoleEnv()
+        env.seed(seed)
+    else:
+        env = PendulumEnv()
+        env._seed(seed)
+    return env
+
+
+def snapshot_path(snapshot_dir, name, version):
+    # the file neural_bays_dx_tf.save(snapshot_dir, version) writes for a BNN called name
+    return os.path.join(snapshot_dir, '{}_{}.npz'.format(name, version))
+
+
+class TransitionRing(object):
+    """Single-writer, single-reader ring of float64 transition rows in shared memory.
+
+    A row is [state, action, reward, next_state]. The worker writes rows with append() and then
+    advances the shared row counter; the learner's read() copies every row between its own
+    position and the counter. The slot of the row being written holds the row capacity behind it,
+    so at most capacity - 1 unread rows are intact; if the reader falls further behind, or the
+    writer laps rows while they are being copied (checked against the counter after the copy),
+    the oldest unread rows are lost and counted in self.dropped. The rows live in a ctx.RawArray,
+    so a ring passed as a Process argument attaches the child to the same memory.
+    """
+
+    def __init__(self, capacity, obs_dim, action_dim, ctx):
+        self.capacity, self.obs_dim, self.action_dim = capacity, obs_dim, action_dim
+        self.width = 2 * obs_dim + action_dim + 1
+        self.buf = ctx.RawArray('d', capacity * self.width)
+        self.written = ctx.Value('q', 0)  # rows ever appended
+        self.read_pos = 0
+        self.dropped = 0
+        self._attach()
+
+    def _attach(self):
+        self.rows = np.frombuffer(self.buf, dtype=np.float64).reshape(self.capacity, self.width)
+
+    def __getstate__(self):
+        return {'buf': self.buf, 'capacity': self.capacity, 'obs_dim': self.obs_dim,
+                'action_dim': self.action_dim, 'width': self.width, 'written': self.written}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.read_pos, self.dropped = 0, 0
+        self._attach()
+
+    def append(self, state, action, reward, next_state):
+        n = self.written.value
+        row = self.rows[n % self.capacity]
+        row[:self.obs_dim] = state
+        row[self.obs_dim:self.obs_dim + self.action_dim] = action
+        row[self.obs_dim + self.action_dim] = reward
+        row[self.obs_dim + self.action_dim + 1:] = next_state
+        with self.written.get_lock():
+            self.written.value = n + 1
+
+    def read(self):
+        """(states, actions, rewards [rows, 1], next_states) appended since the last read"""
+        end = self.written.value
+        start = max(self.read_pos, end - self.capacity + 1)
+        rows = self.rows[np.arange(start, end) % self.capacity].copy()
+        # rows the writer may have overwritten during the copy, now or still in progress, are torn;
+        # rows from end on were not copied and are left to the next read
+        intact = min(max(start, self.written.value - self.capacity + 1), end)
+        rows = rows[intact - start:]
+        self.dropped += intact - self.read_pos
+        self.read_pos = end
+        o, a = self.obs_dim, self.action_dim
+        return rows[:, :o], rows[:, o:o + a], rows[:, o + a:o + a + 1], rows[:, o + a + 1:]
+
+    def close(self):
+        # the memory is freed once no process holds the RawArray
+        self.rows, self.buf = None, None
+
+
+def run_worker(worker_id, args, ring, param_version, snapshot_dir, episode_queue, stop):
+    """Worker process: runs episodes until stop is set, planning with CEM on a posterior sample of the
+    newest snapshot (random actions before the first one), and streams every transition into ring.
+    Each finished episode is reported on episode_queue as (worker_id, param_version, reward, steps).
+    """
+    seed = args.seed + 1000 * (worker_id + 1)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    env = make_env(args.env, seed)
+    obs_dim = env.observation_space.shape[0]
+    my_dx = numpy_bays_dx('dx', obs_dim, sigma_n2=args.sigma_n**2)
+    if args.with_reward:
+        from CEM_with import CEM
+        cem = CEM(env, args, my_dx, num_elites=args.num_elites, num_trajs=args.num_trajs, alpha=args.alpha)
+    else:
+        my_cost = numpy_bays_dx('cost', 1, sigma_n2=args.sigma_n**2)
+        from CEM_without import CEM
+        cem = CEM(env, args, my_dx, my_cost, num_elites=args.num_elites, num_trajs=args.num_trajs, alpha=args.alpha)
+
+    version = 0
+    while not stop.is_set():
+        latest = param_version.value
+        if latest != version:
+            try:
+                my_dx.load(snapshot_path(snapshot_dir, 'BNN', latest))
+                if not args.with_reward:
+                    my_cost.load(snapshot_path(snapshot_dir, 'BNN_cost', latest))
+                version = latest
+            except FileNotFoundError:
+                # the learner already replaced this snapshot; take the newer one
+                continue
+        if version > 0:
+            my_dx.sample()
+            if not args.with_reward:
+                my_cost.sample()
+        state = np.asarray(env.reset(), dtype=np.float64).ravel()
+        cem.reset()
+        cum_reward = 0.
+        for _ in range(args.episode_length):
+            if stop.is_set():
+                return
+            if version == 0:
+                action = np.asarray(env.action_space.sample(), dtype=np.float64).ravel()
+            else:
+                action = np.asarray(cem.hori_planning(torch.tensor(state)), dtype=np.float64).ravel()
+            new_state, r, _, _ = env.step(action[0] if 'CartPole-continuous' in args.env else action)
+            new_state = np.asarray(new_state, dtype=np.float64).ravel()
+            r = float(np.asarray(r).ravel()[0])
+            ring.append(state, action, r, new_state)
+            cum_reward += r
+            state = new_state
+        episode_queue.put((worker_id, version, cum_reward, args.episode_length))
@@ -0,0 +1,82 @@
+# pipelined MPC: plan for the model-predicted next state while the real env steps
+import copy
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+
+class AsyncPlanner(object):
+    """Wraps a CEM planner with a single worker thread.
+
+    After an action is chosen, speculate() predicts the next state with the dynamics model's
+    one-step prediction and starts planning for it in the background while env.step runs.
+    act() then accepts the speculative plan if the real observation is within tol of the
+    prediction (max abs difference), otherwise restores the planner state from before the
+    speculation (warm starts, step counter, telemetry) and replans synchronously for the real state.
+
+    The model and planner are shared with the worker, so training, add_data side effects on the
+    posterior and my_dx.sample() must only happen after drain(). Runs are not bit-reproducible,
+    since both threads draw from the global numpy RNG.
+    """
+
+    def __init__(self, cem, tol=0.05):
+        self.cem = cem
+        self.tol = tol
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None  # (predicted state, planner state before speculation, future)
+        self.wait_ms = 0.
+        self.stats = {'accepted': 0, 'rejected': 0, 'sync': 0}
+
+    @staticmethod
+    def _to_numpy(x):
+        return x.numpy() if torch.is_tensor(x) else np.asarray(x)
+
+    def speculate(self, state, action):
+        """Start planning for the predicted successor of (state, action)."""
+        self.drain()
+        s = self._to_numpy(state).astype(np.float64).ravel()
+        a = self._to_numpy(action).astype(np.float64).ravel()
+        pred = np.asarray(self.cem.my_dx.predict(np.concatenate((s, a))[None])).reshape(s.shape)
+        # deep copy: the speculative plan updates the warm-start arrays in place
+        snapshot = (copy.deepcopy(self.cem.state_dict()), self.cem.plan_info)
+        future = self.executor.submit(self.cem.hori_planning, torch.tensor(pred))
+        self.pending = (pred, snapshot, future)
+
+    def act(self, state):
+        """Return the action for the real state, using the speculative plan when it matches."""
+        start = time.time()
+        s = self._to_numpy(state).astype(np.float64).ravel()
+        if self.pending is not None:
+            pred, snapshot, future = self.pending
+            self.pending = None
+            action = future.result()
+            if np.max(np.abs(s - pred)) <= self.tol:
+                self.stats['accepted'] += 1
+                self.wait_ms = (time.time() - start) * 1000.
+                return action
+            self.stats['rejected'] += 1
+            self._restore(snapshot)
+        else:
+            self.stats['sync'] += 1
+        action = self.cem.hori_planning(torch.tensor(s))
+        self.wait_ms = (time.time() - start) * 1000.
+        return action
+
+    def _restore(self, snapshot):
+        state, plan_info = snapshot
+        self.cem.load_state_dict(state)
+        self.cem.plan_info = plan_info
+
+    def drain(self):
+        """Wait for and discard any in-flight speculation, restoring the planner state."""
+        if self.pending is not None:
+            _, snapshot, future = self.pending
+            self.pending = None
+            future.result()
+            self._restore(snapshot)
+
+    def close(self):
+        self.drain()
+        self.executor.shutdown(wait=True)
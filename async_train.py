@@ -0,0 +1,103 @@
+# background model training: train the BNN/BLR models on a worker thread while the next episode runs
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from NB_dx_tf import numpy_bays_dx
+
+
+class BackgroundTrainer(object):
+    """Trains the planner's models on a single worker thread, overlapping the next episode.
+
+    models is a list of (neural_bays_dx_tf, training epochs), the dynamics model first and then,
+    without oracle rewards, the cost model. The planner never sees the models being trained: it
+    plans with numpy_bays_dx copies frozen at each episode boundary, so an episode runs on the
+    posterior trained through the episode before last while training on the last one runs in
+    the background. Per-episode wall time is then max(train, rollout) instead of their sum.
+
+    That is one episode more posterior lag than the synchronous loop, where episode k samples
+    from the posterior trained through episode k-1, so it is a change to PSRL and not only to
+    its speed: the drivers enable it only with --async-train and log its results separately.
+
+    Transitions given to add_data() are buffered and only reach the models in finish_episode(),
+    once the training in flight is done, so the worker always trains on a fixed dataset. The
+    first boundary trains synchronously, since there is no earlier posterior to plan with.
+    Call order per episode: sample(), add_data() per step, finish_episode(), checkpoint, start().
+    """
+
+    def __init__(self, cem, models):
+        self.cem = cem
+        self.models = models
+        self.frozen = None
+        self.buffers = [([], []) for _ in models]
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+        self.trained = False  # the models have been trained at least once
+        self.stale = False  # the models hold data they were not trained on
+        self.train_s = 0.
+        self.wait_s = 0.
+
+    def add_data(self, model, new_x, new_y):
+        xs, ys = self.buffers[[m for m, _ in self.models].index(model)]
+        xs.append(np.atleast_2d(np.asarray(new_x, dtype=np.float64)))
+        ys.append(np.atleast_2d(np.asarray(new_y, dtype=np.float64)))
+
+    def sample(self):
+        """draw the episode's posterior sample, from the frozen copies once there are any"""
+        for model in self.frozen if self.frozen is not None else [m for m, _ in self.models]:
+            model.sample()
+
+    def _train(self):
+        start = time.time()
+        for model, epochs in self.models:
+            model.train(epochs=epochs)
+            model.update_bays_reg()
+        self.train_s = time.time() - start
+
+    def _wait(self):
+        start = time.time()
+        if self.pending is not None:
+            future, self.pending = self.pending, None
+            future.result()
+        self.wait_s = time.time() - start
+
+    def _freeze(self):
+        if self.frozen is None:
+            self.frozen = [numpy_bays_dx(m.model_type, m.output_shape, sigma_n2=m.sigma_n2) for m, _ in self.models]
+        for copy, (model, _) in zip(self.frozen, self.models):
+            copy.copy_from(model)
+        self.cem.my_dx = self.frozen[0]
+        if len(self.frozen) > 1:
+            self.cem.cost = self.frozen[1]
+
+    def finish_episode(self):
+        """Wait for the training in flight, hand it the episode's data and freeze the posterior the
+        next episode plans with. The models are idle until start(), so they can be checkpointed.
+        """
+        self._wait()
+        for (model, _), (xs, ys) in zip(self.models, self.buffers):
+            if xs:
+                model.add_data(new_x=np.vstack(xs), new_y=np.vstack(ys))
+                del xs[:], ys[:]
+                self.stale = True
+        if not self.trained:
+            self._train()
+            self.trained, self.stale = True, False
+        self._freeze()
+
+    def start(self):
+        """train on the data added by finish_episode() in the background"""
+        if self.stale:
+            self.stale = False
+            self.pending = self.executor.submit(self._train)
+
+    def resume(self):
+        """after loading checkpointed models: freeze their posterior and retrain on the last episode"""
+        self.trained, self.stale = True, True
+        self._freeze()
+        self.start()
+
+    def close(self):
+        self._wait()
+        self.executor.shutdown(wait=True)
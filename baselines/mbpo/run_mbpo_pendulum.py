@@ -17,7 +17,11 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 from pendulum_gym import PendulumEnv
 from NB_dx_tf import neural_bays_dx_tf
 from tf_models.constructor import construct_model
-from simple_mbpo import SimplifiedMBPO
+from tf_models.fake_env import FakeEnv
+from rewards import make_reward
+from simple_mbpo import SimplifiedMBPO, RolloutSchedule, PosteriorModelEnv, EnsembleModelEnv
+from checkpoint import save_checkpoint, load_checkpoint, rng_state, set_rng_state
+from results_log import ResultsWriter
 
 os.environ["CUDA_VISIBLE_DEVICES"] = "0"
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
@@ -29,9 +33,13 @@ def run_mbpo_pendulum(args):
     # Set random seeds
     np.random.seed(args.seed)
     torch.manual_seed(args.seed)
+    if args.torch_threads is not None:
+        torch.set_num_threads(args.torch_threads)
     
     # Create environment
     env = PendulumEnv()
+    # Pendulum never terminates
+    env.termination_fn = lambda obs, act, next_obs: np.zeros((len(next_obs), 1), dtype=np.float32)
     obs_shape = env.observation_space.shape[0]
     action_shape = env.action_space.shape[0]
     action_low = env.action_space.low
@@ -46,29 +54,47 @@ def run_mbpo_pendulum(args):
     print("Episodes: {}".format(args.num_episodes))
     print("="*70)
     
-    # Create dynamics model
+    # Create dynamics model: one network with a BLR posterior, or an ensemble stepped through FakeEnv
+    num_networks = args.num_networks if args.model_backend == 'ensemble' else 1
     dx_model = construct_model(obs_dim=obs_shape, act_dim=action_shape, 
-                               hidden_dim=200, num_networks=1, num_elites=1)
+                               hidden_dim=200, num_networks=num_networks, num_elites=num_networks)
     
     my_dx = neural_bays_dx_tf(args, dx_model, "dx", obs_shape, 
                               sigma_n2=args.sigma_n**2, sigma2=args.sigma**2)
     
+    # Batched model env the policy rollouts step through
+    if args.model_backend == 'ensemble':
+        fake_env = FakeEnv(dx_model, env, reward_fn=make_reward('pendulum').fake_env_fn())
+        model_env = EnsembleModelEnv(fake_env, propagation=args.propagation, batch_size=args.model_batch_size)
+    else:
+        model_env = PosteriorModelEnv(my_dx, reward_fn=make_reward('pendulum'), termination_fn=env.termination_fn,
+                                      batch_size=args.model_batch_size)
+    
     # Create MBPO agent
     mbpo = SimplifiedMBPO(
         state_dim=obs_shape,
         action_dim=action_shape,
         action_low=action_low,
         action_high=action_high,
-        dynamics_model=my_dx,
+        dynamics_model=model_env,
         hidden_dim=args.policy_hidden_dim,
         lr=args.policy_lr,
         gamma=args.gamma,
-        env_name='pendulum'
+        env_name='pendulum',
+        rollout_schedule=RolloutSchedule(
+            budget=args.model_steps_budget or args.num_model_rollouts * args.rollout_length,
+            min_length=args.rollout_length,
+            max_length=args.max_rollout_length or args.rollout_length,
+            start=args.rollout_length_episodes[0],
+            end=args.rollout_length_episodes[1]
+        ),
+        model_retain=args.model_retain_versions,
+        tau=args.tau,
+        grad_steps=args.grad_steps_per_batch
     )
     
     # Logging
     episode_rewards = []
-    timestep_rewards = []
     cumulative_reward = 0
     total_timesteps = 0
     
@@ -79,8 +105,26 @@ def run_mbpo_pendulum(args):
     log_file = os.path.join(output_dir, 'mbpo_pendulum_log' + seed_suffix + '.txt')
     timestep_file = os.path.join(output_dir, 'mbpo_pendulum_timestep_rewards' + seed_suffix + '.txt')
     
+    ckpt_path = os.path.join(args.checkpoint_dir, 'mbpo_pendulum' + seed_suffix + '.ckpt')
+    start_episode = 0
+    ckpt = load_checkpoint(ckpt_path) if args.resume else None
+    if ckpt is not None:
+        my_dx.load_state_dict(ckpt['dx'])
+        mbpo.load_state_dict(ckpt['mbpo'])
+        episode_rewards = ckpt['episode_rewards']
+        cumulative_reward, total_timesteps = ckpt['cumulative_reward'], ckpt['total_timesteps']
+        set_rng_state(ckpt['rng'], env)
+        start_episode = ckpt['episode'] + 1
+        print("Resuming from {} at episode {}".format(ckpt_path, start_episode))
+    
+    # Logs are appended as rows are produced; a resumed run keeps the rows up to its checkpoint
+    log_rows = ckpt['log_rows'] if ckpt is not None else {}
+    episode_log = ResultsWriter(log_file, ['episode', 'reward'], fmt='%d %.6f', keep_rows=log_rows.get('episode', 0))
+    timestep_log = ResultsWriter(timestep_file, ['timestep', 'cumulative_reward'], fmt='%d %.18e',
+                                 keep_rows=log_rows.get('timestep', 0))
+    
     # Training loop
-    for episode in range(args.num_episodes):
+    for episode in range(start_episode, args.num_episodes):
         state = env.reset()
         state = state.squeeze() if hasattr(state, 'squeeze') else state
         episode_reward = 0
@@ -115,7 +159,7 @@ def run_mbpo_pendulum(args):
             episode_length += 1
             
             # Log timestep reward
-            timestep_rewards.append([total_timesteps, cumulative_reward])
+            timestep_log.append(total_timesteps, cumulative_reward)
             
             state = next_state
             
@@ -124,19 +168,27 @@ def run_mbpo_pendulum(args):
         
         # Train dynamics model after episode
         if episode > 0:
-            my_dx.train(epochs=args.training_iter_dx)
-            my_dx.update_bays_reg()
+            if args.model_backend == 'ensemble':
+                # my_dx only collects the data; the ensemble is trained directly
+                dx_model.train(my_dx.train_x, my_dx.train_y, epochs=args.training_iter_dx, hide_progress=True)
+            else:
+                my_dx.train(epochs=args.training_iter_dx)
+                my_dx.update_bays_reg()
+            mbpo.new_model_version()
         
         # Generate model rollouts and train policy (after episode 1)
         if episode >= 1:
-            # Generate synthetic data
+            # Generate synthetic data, count and length from the per-episode budget
+            num_rollouts, rollout_length = mbpo.rollout_schedule(episode)
             mbpo.generate_model_rollouts(
-                num_rollouts=args.num_model_rollouts,
-                rollout_length=args.rollout_length
+                num_rollouts=num_rollouts,
+                rollout_length=rollout_length
             )
             
             # Train policy on real + synthetic data
-            mbpo.train_policy(num_updates=args.policy_updates_per_episode)
+            updates_per_sec = mbpo.train_policy(num_updates=args.policy_updates_per_episode)
+            if updates_per_sec:
+                print("  policy updates/sec: {:.1f}".format(updates_per_sec))
             
             # Decay exploration noise
             mbpo.decrease_noise(factor=0.98)
@@ -147,8 +199,16 @@ def run_mbpo_pendulum(args):
             episode, episode_reward, episode_length, total_timesteps))
         
         # Save logs
-        np.savetxt(log_file, episode_rewards, fmt='%d %.6f')
-        np.savetxt(timestep_file, timestep_rewards, fmt='%d %.18e')
+        episode_log.append(episode, episode_reward)
+        for log in (episode_log, timestep_log):
+            log.flush(sync=True)
+        save_checkpoint(ckpt_path, {
+            'episode': episode, 'dx': my_dx.state_dict(), 'mbpo': mbpo.state_dict(),
+            'episode_rewards': episode_rewards, 'log_rows': {'episode': episode_log.rows, 'timestep': timestep_log.rows},
+            'cumulative_reward': cumulative_reward, 'total_timesteps': total_timesteps, 'rng': rng_state(env)})
+    
+    for log in (episode_log, timestep_log):
+        log.close()
     
     print("\n" + "="*70)
     print("Training Complete!")
@@ -156,7 +216,7 @@ def run_mbpo_pendulum(args):
     print("Final 5 episode mean: {:.2f}".format(np.mean([r[1] for r in episode_rewards[-5:]])))
     print("="*70)
     
-    return episode_rewards, timestep_rewards
+    return episode_rewards
 
 
 if __name__ == '__main__':
@@ -167,6 +227,9 @@ if __name__ == '__main__':
     parser.add_argument('--num-episodes', type=int, default=15, help='Number of episodes')
     parser.add_argument('--max-steps', type=int, default=200, help='Max steps per episode')
     parser.add_argument('--output-dir', type=str, default='seeds_data', help='Output directory')
+    parser.add_argument('--resume', type=lambda x: x.lower() == 'true', default=False,
+                        help='Continue from the last episode checkpoint in --checkpoint-dir')
+    parser.add_argument('--checkpoint-dir', type=str, default='checkpoints', help='Per-episode checkpoint directory')
     
     # Dynamics model
     parser.add_argument('--sigma', type=float, default=10.0, help='BLR prior variance')
@@ -174,6 +237,13 @@ if __name__ == '__main__':
     parser.add_argument('--training-iter-dx', type=int, default=100, help='Dynamics training iterations')
     parser.add_argument('--hidden-dim-dx', type=int, default=200, help='Dynamics hidden dim')
     parser.add_argument('--predict_with_bias', type=bool, default=True, help='Use bias in BLR')
+    parser.add_argument('--model-backend', type=str, default='posterior', choices=['posterior', 'ensemble'],
+                        help='Roll out through the BLR posterior sample or a BNN ensemble (FakeEnv)')
+    parser.add_argument('--num-networks', type=int, default=5, help='Ensemble size for --model-backend ensemble')
+    parser.add_argument('--propagation', type=str, default='ts1', choices=['ts1', 'mean'],
+                        help='Ensemble propagation: random elite per row with noise, or its mean')
+    parser.add_argument('--model-batch-size', type=int, default=None,
+                        help='Max rows per model call in rollouts (default: all rollouts at once)')
     
     # Policy
     parser.add_argument('--policy-hidden-dim', type=int, default=256, help='Policy network hidden dim')
@@ -183,7 +253,20 @@ if __name__ == '__main__':
     # MBPO specific
     parser.add_argument('--num-model-rollouts', type=int, default=400, help='Synthetic rollouts per episode')
     parser.add_argument('--rollout-length', type=int, default=5, help='Length of each rollout')
+    parser.add_argument('--max-rollout-length', type=int, default=None,
+                        help='Grow the rollout length linearly up to this (default: fixed --rollout-length)')
+    parser.add_argument('--rollout-length-episodes', type=int, nargs=2, default=[1, 10],
+                        help='Episodes over which the rollout length grows')
+    parser.add_argument('--model-steps-budget', type=int, default=None,
+                        help='Model steps per episode (default: num-model-rollouts x rollout-length)')
+    parser.add_argument('--model-retain-versions', type=int, default=5,
+                        help='Keep rollouts of this many most recent model versions')
     parser.add_argument('--policy-updates-per-episode', type=int, default=40, help='Policy updates per episode')
+    parser.add_argument('--grad-steps-per-batch', type=int, default=1,
+                        help='Policy gradient steps per sampled super-batch')
+    parser.add_argument('--tau', type=float, default=0.005, help='Polyak averaging rate of the target networks')
+    parser.add_argument('--torch-threads', type=int, default=None,
+                        help='Threads torch uses for policy training (default: torch default)')
     
     args = parser.parse_args()
     
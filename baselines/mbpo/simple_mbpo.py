@@ -9,12 +9,15 @@ This is a lightweight MBPO implementation that:
 Simplified from full MBPO by using a basic policy gradient instead of full SAC.
 """
 
+import copy
+import time
+
 import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from collections import deque
-import random
+
+from rewards import make_reward
 
 
 class SimpleActor(nn.Module):
@@ -52,10 +55,13 @@ class SimpleActor(nn.Module):
         return action
     
     def get_action(self, state, deterministic=False, noise_scale=0.1):
-        """Get action from policy with optional exploration noise"""
+        """Get action from policy with optional exploration noise; state is [state_dim] or a [batch, state_dim] batch"""
         with torch.no_grad():
             if not isinstance(state, torch.Tensor):
-                state = torch.FloatTensor(state).unsqueeze(0)
+                state = torch.FloatTensor(np.asarray(state))
+            batched = state.dim() > 1
+            if not batched:
+                state = state.unsqueeze(0)
             action = self.forward(state)
             
             if not deterministic:
@@ -65,7 +71,30 @@ class SimpleActor(nn.Module):
                 # Clip to bounds
                 action = torch.max(torch.min(action, self.action_high), self.action_low)
             
-            return action.squeeze(0).numpy()
+            return action.numpy() if batched else action.squeeze(0).numpy()
+    
+    def export_numpy(self):
+        """Snapshot the weights as NumPy arrays for act_numpy; call again after every update"""
+        linears = [layer for layer in self.net if isinstance(layer, nn.Linear)]
+        self._np_layers = [(layer.weight.detach().numpy().T.copy(), layer.bias.detach().numpy().copy())
+                           for layer in linears]
+        self._np_low = self.action_low.numpy().copy()
+        self._np_high = self.action_high.numpy().copy()
+        self._np_half_range = 0.5 * (self._np_high - self._np_low)
+    
+    def act_numpy(self, state, deterministic=False, noise_scale=0.1):
+        """get_action on the exported NumPy weights: NumPy in, NumPy out, no torch dispatch
+        
+        state is [state_dim] or [batch, state_dim]; uses the weights of the last export_numpy().
+        """
+        (w1, b1), (w2, b2), (w3, b3) = self._np_layers
+        h = np.maximum(np.dot(np.asarray(state, dtype=np.float32), w1) + b1, 0.0)
+        h = np.maximum(np.dot(h, w2) + b2, 0.0)
+        action = self._np_low + (np.tanh(np.dot(h, w3) + b3) + 1.0) * self._np_half_range
+        if not deterministic:
+            action = action + np.random.standard_normal(action.shape).astype(np.float32) * noise_scale
+            np.clip(action, self._np_low, self._np_high, out=action)
+        return action
 
 
 class SimpleCritic(nn.Module):
@@ -89,30 +118,244 @@ class SimpleCritic(nn.Module):
 
 
 class ReplayBuffer:
-    """Experience replay buffer for storing transitions"""
-    
+    """Experience replay buffer for storing transitions
+
+    A preallocated NumPy ring buffer with one float32 column per field. Columns are allocated on
+    the first push, with shapes taken from that transition; once full, the oldest rows are overwritten.
+    """
+
+    FIELDS = ('states', 'actions', 'rewards', 'next_states', 'dones')
+
     def __init__(self, capacity=100000):
-        self.buffer = deque(maxlen=capacity)
-    
+        self.capacity = capacity
+        self.columns = None
+        self.ptr = 0  # next row to write
+        self.size = 0
+
+    def _allocate(self, state, action):
+        state_dim, action_dim = np.size(state), np.size(action)
+        self.columns = {
+            'states': np.zeros((self.capacity, state_dim), dtype=np.float32),
+            'actions': np.zeros((self.capacity, action_dim), dtype=np.float32),
+            'rewards': np.zeros((self.capacity, 1), dtype=np.float32),
+            'next_states': np.zeros((self.capacity, state_dim), dtype=np.float32),
+            'dones': np.zeros((self.capacity, 1), dtype=np.float32),
+        }
+
     def push(self, state, action, reward, next_state, done):
         """Add transition to buffer"""
-        self.buffer.append((state, action, reward, next_state, done))
-    
+        self.push_batch(np.reshape(state, (1, -1)), np.reshape(action, (1, -1)), np.reshape(reward, (1,)),
+                        np.reshape(next_state, (1, -1)), np.reshape(done, (1,)))
+
+    def push_batch(self, states, actions, rewards, next_states, dones):
+        """Add a batch of transitions, one row per transition"""
+        if self.columns is None:
+            self._allocate(states[0], actions[0])
+        n = len(states)
+        if n > self.capacity:
+            # only the newest capacity rows would survive
+            states, actions, rewards, next_states, dones = [
+                np.asarray(x)[-self.capacity:] for x in (states, actions, rewards, next_states, dones)]
+            n = self.capacity
+        rows = (self.ptr + np.arange(n)) % self.capacity
+        for name, values in zip(self.FIELDS, (states, actions, rewards, next_states, dones)):
+            column = self.columns[name]
+            column[rows] = np.reshape(values, (n, column.shape[1]))
+        self.ptr = (self.ptr + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def sample_into(self, out, start, n):
+        """Fill rows start:start+n of the preallocated batch out (dict of arrays) with random transitions
+
+        The arrays in out are [rows, width] or [blocks, rows, width]; in the second case rows
+        start:start+n of every block are filled.
+        """
+        if n == 0:
+            return
+        for name in self.FIELDS:
+            target = out[name][..., start:start + n, :]
+            if name == self.FIELDS[0]:
+                idx = np.random.randint(0, self.size, size=target.shape[:-1])
+            np.take(self.columns[name], idx, axis=0, out=target)
+
     def sample(self, batch_size):
-        """Sample random batch from buffer"""
-        batch = random.sample(self.buffer, batch_size)
-        states, actions, rewards, next_states, dones = zip(*batch)
-        
-        return (
-            np.array(states),
-            np.array(actions),
-            np.array(rewards).reshape(-1, 1),
-            np.array(next_states),
-            np.array(dones).reshape(-1, 1)
-        )
-    
+        """Sample random batch from buffer (with replacement)"""
+        idx = np.random.randint(0, self.size, size=batch_size)
+        return tuple(self.columns[name][idx] for name in self.FIELDS)
+
+    def state_dict(self):
+        return {'columns': None if self.columns is None else {k: v[:self.size].copy() for k, v in self.columns.items()},
+                'ptr': self.ptr, 'size': self.size}
+
+    def load_state_dict(self, state):
+        self.ptr, self.size = state['ptr'], state['size']
+        self.columns = None
+        if state['columns'] is not None:
+            self._allocate(state['columns']['states'][0], state['columns']['actions'][0])
+            for name, values in state['columns'].items():
+                self.columns[name][:self.size] = values
+
     def __len__(self):
-        return len(self.buffer)
+        return self.size
+
+
+class ModelReplayBuffer(ReplayBuffer):
+    """ReplayBuffer for synthetic transitions, each tagged with the version of the model that generated it
+    
+    When full, the oldest rows are overwritten, and these are also the ones from the oldest models.
+    evict_older_than() drops whole stale model versions before that happens.
+    """
+    
+    def _allocate(self, state, action):
+        super(ModelReplayBuffer, self)._allocate(state, action)
+        self.columns['versions'] = np.zeros((self.capacity, 1), dtype=np.int64)
+    
+    def push_batch(self, states, actions, rewards, next_states, dones, version=0):
+        """Add a batch of transitions generated by model version"""
+        n = min(len(states), self.capacity)
+        rows = (self.ptr + np.arange(n)) % self.capacity
+        super(ModelReplayBuffer, self).push_batch(states, actions, rewards, next_states, dones)
+        self.columns['versions'][rows] = version
+    
+    def evict_older_than(self, min_version):
+        """Drop transitions from model versions below min_version, keeping the rest in insertion order"""
+        if self.size == 0:
+            return
+        # rows from oldest to newest
+        order = (self.ptr + np.arange(self.size)) % self.capacity if self.size == self.capacity else np.arange(self.size)
+        keep = order[self.columns['versions'][order, 0] >= min_version]
+        for column in self.columns.values():
+            column[:len(keep)] = column[keep]
+        self.size = len(keep)
+        self.ptr = self.size % self.capacity
+
+
+class RolloutSchedule:
+    """Rollout count and length for each episode from a fixed budget of model steps
+    
+    The rollout length grows linearly from min_length to max_length between episodes start and
+    end (as in MBPO), and the count is budget // length, so every episode spends the same number
+    of model steps however long the rollouts get.
+    """
+    
+    def __init__(self, budget=2000, min_length=5, max_length=5, start=1, end=10):
+        self.budget = budget
+        self.min_length, self.max_length = min_length, max_length
+        self.start, self.end = start, end
+    
+    def __call__(self, episode):
+        """(num_rollouts, rollout_length) for episode"""
+        frac = np.clip((episode - self.start) / max(self.end - self.start, 1), 0.0, 1.0)
+        length = int(round(self.min_length + frac * (self.max_length - self.min_length)))
+        return max(1, self.budget // length), length
+
+
+class MixedSampler:
+    """Samples training batches mixing real and model transitions into one preallocated batch
+    
+    Each sample() fills num_batches minibatches at once (a super-batch), each with real_ratio of its
+    rows from the real buffer and the rest from the model buffer, in place. It returns torch tensors
+    of shape [num_batches, rows, width] that share memory with the batch (pinned for fast
+    host-to-device copies with pin_memory=True). The tensors are overwritten by the next sample().
+    """
+    
+    def __init__(self, real_buffer, model_buffer, batch_size, state_dim, action_dim, real_ratio=0.5,
+                 pin_memory=False, num_batches=1):
+        self.real_buffer = real_buffer
+        self.model_buffer = model_buffer
+        self.batch_size = batch_size
+        self.num_batches = num_batches
+        self.real_batch_size = int(batch_size * real_ratio)
+        widths = {'states': state_dim, 'actions': action_dim, 'rewards': 1, 'next_states': state_dim, 'dones': 1}
+        pin_memory = pin_memory and torch.cuda.is_available()
+        self.tensors = {name: torch.zeros((num_batches, batch_size, widths[name]), dtype=torch.float32,
+                                          pin_memory=pin_memory)
+                        for name in ReplayBuffer.FIELDS}
+        self.batch = {name: tensor.numpy() for name, tensor in self.tensors.items()}
+    
+    def sample(self):
+        """(states, actions, rewards, next_states, dones) tensors; real data only while the model buffer is too small"""
+        real_n = min(self.real_batch_size, len(self.real_buffer))
+        model_n = self.batch_size - real_n
+        self.real_buffer.sample_into(self.batch, 0, real_n)
+        if len(self.model_buffer) >= model_n:
+            self.model_buffer.sample_into(self.batch, real_n, model_n)
+            n = self.batch_size
+        else:
+            n = real_n
+        return tuple(self.tensors[name][:, :n] for name in ReplayBuffer.FIELDS)
+
+
+class ModelEnv:
+    """Batched model environment that MBPO rollouts step through
+    
+    step(obs [n, obs_dim], act [n, act_dim]) returns (next_obs [n, obs_dim], rewards [n], dones [n] bool).
+    Rows are passed to the model in chunks of batch_size (None: all rows in one call).
+    """
+    
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size
+    
+    def step(self, obs, act):
+        if self.batch_size is None or len(obs) <= self.batch_size:
+            return self._step(obs, act)
+        chunks = [self._step(obs[i:i + self.batch_size], act[i:i + self.batch_size])
+                  for i in range(0, len(obs), self.batch_size)]
+        return tuple(np.concatenate(parts) for parts in zip(*chunks))
+    
+    def _step(self, obs, act):
+        raise NotImplementedError
+
+
+class PosteriorModelEnv(ModelEnv):
+    """Model env over a neural_bays_dx_tf (or OracleModel) dx model
+    
+    Next states come from the currently sampled posterior, rewards from the oracle reward kernel
+    (-0.1 without one) and dones from termination_fn(obs, act, next_obs), if given.
+    """
+    
+    def __init__(self, model, reward_fn=None, termination_fn=None, batch_size=None):
+        super(PosteriorModelEnv, self).__init__(batch_size)
+        self.model = model
+        self.reward_fn = reward_fn
+        self.termination_fn = termination_fn
+    
+    def _step(self, obs, act):
+        # the dx model predicts next states (current state + predicted delta)
+        inputs = np.concatenate([obs, act], axis=1).astype(np.float64)
+        next_obs = np.asarray(self.model.predict(inputs)).reshape(obs.shape)
+        if self.reward_fn is None:
+            rewards = np.full(len(obs), -0.1)
+        else:
+            # reward of the reached states (copied: the kernel reuses its output)
+            rewards = self.reward_fn(next_obs, act).copy()
+        if self.termination_fn is None:
+            dones = np.zeros(len(obs), dtype=bool)
+        else:
+            dones = np.asarray(self.termination_fn(obs, act, next_obs)).reshape(-1) > 0
+        return next_obs, rewards, dones
+
+
+class EnsembleModelEnv(ModelEnv):
+    """Model env over a tf_models FakeEnv (BNN ensemble with oracle reward_fn and termination)
+    
+    propagation 'ts1' samples each row from a random elite with the member's predicted noise,
+    'mean' uses that member's mean prediction.
+    """
+    
+    PROPAGATIONS = ('ts1', 'mean')
+    
+    def __init__(self, fake_env, propagation='ts1', batch_size=None):
+        super(EnsembleModelEnv, self).__init__(batch_size)
+        if propagation not in self.PROPAGATIONS:
+            raise ValueError('unknown propagation: {}'.format(propagation))
+        self.fake_env = fake_env
+        self.propagation = propagation
+    
+    def _step(self, obs, act):
+        next_obs, rewards, terminals, _ = self.fake_env.step(obs, act, deterministic=self.propagation == 'mean')
+        # copied: oracle reward kernels reuse their output buffer on the next call
+        return next_obs, np.array(rewards, dtype=np.float64).reshape(-1), np.reshape(terminals, -1) > 0
 
 
 class SimplifiedMBPO:
@@ -123,53 +366,98 @@ class SimplifiedMBPO:
     """
     
     def __init__(self, state_dim, action_dim, action_low, action_high, 
-                 dynamics_model, hidden_dim=256, lr=3e-4, gamma=0.99, env_name='cartpole'):
+                 dynamics_model, hidden_dim=256, lr=3e-4, gamma=0.99, env_name='cartpole',
+                 rollout_schedule=None, model_retain=5, termination_fn=None, tau=0.005, grad_steps=1):
         """
         Args:
             state_dim: Dimension of state space
             action_dim: Dimension of action space
             action_low: Lower bound of action space
             action_high: Upper bound of action space
-            dynamics_model: Learned dynamics model (NB_dx_tf)
+            dynamics_model: ModelEnv to roll out through, or a learned dynamics model (NB_dx_tf),
+                            which is wrapped in a PosteriorModelEnv
             hidden_dim: Hidden layer size for networks
             lr: Learning rate
             gamma: Discount factor
             env_name: Environment name for oracle reward function
+            rollout_schedule: RolloutSchedule giving rollout count and length per episode
+                              (default: 400 rollouts of length 5)
+            model_retain: Number of most recent model versions whose rollouts are kept
+            termination_fn: Done flags (obs, act, next_obs) for a wrapped dynamics model
+            tau: Polyak averaging rate of the target networks
+            grad_steps: Gradient steps per sampled super-batch (one minibatch per step)
         """
         self.state_dim = state_dim
         self.action_dim = action_dim
         self.gamma = gamma
         self.dynamics_model = dynamics_model
         self.env_name = env_name.lower()
+        self.reward = make_reward(self.env_name)
+        if isinstance(dynamics_model, ModelEnv):
+            self.model_env = dynamics_model
+        else:
+            self.model_env = PosteriorModelEnv(dynamics_model, reward_fn=self.reward, termination_fn=termination_fn)
         
         # Create actor and critic networks
         self.actor = SimpleActor(state_dim, action_dim, hidden_dim, action_low, action_high)
+        self.actor.export_numpy()
         self.critic = SimpleCritic(state_dim, action_dim, hidden_dim)
         
+        # Polyak-averaged target networks for the critic's bootstrap target
+        self.tau = tau
+        self.actor_target = copy.deepcopy(self.actor)
+        self.critic_target = copy.deepcopy(self.critic)
+        for param in list(self.actor_target.parameters()) + list(self.critic_target.parameters()):
+            param.requires_grad_(False)
+        self.target_pairs = list(zip(list(self.actor_target.parameters()) + list(self.critic_target.parameters()),
+                                     list(self.actor.parameters()) + list(self.critic.parameters())))
+        self.critic_loss_fn = nn.MSELoss()
+        
         # Optimizers
         self.actor_optimizer = optim.Adam(self.actor.parameters(), lr=lr)
         self.critic_optimizer = optim.Adam(self.critic.parameters(), lr=lr)
         
-        # Replay buffers (separate for real and model data)
+        # Replay buffers (separate for real and model data); the model buffer holds the rollouts
+        # of the last model_retain model versions
+        self.rollout_schedule = RolloutSchedule(budget=2000) if rollout_schedule is None else rollout_schedule
+        self.model_retain = model_retain
+        self.model_version = 0
         self.real_buffer = ReplayBuffer(capacity=50000)
-        self.model_buffer = ReplayBuffer(capacity=50000)
+        self.model_buffer = ModelReplayBuffer(capacity=model_retain * self.rollout_schedule.budget)
         
         # Training parameters
         self.batch_size = 256
         self.noise_scale = 0.1
+        self.grad_steps = grad_steps
+        self.updates_per_sec = 0.0
+        
+        # Mix 50% real, 50% model data in every policy update; grad_steps minibatches are sampled at once
+        self.sampler = MixedSampler(self.real_buffer, self.model_buffer, self.batch_size, state_dim, action_dim,
+                                    real_ratio=0.5, num_batches=grad_steps)
         
     def select_action(self, state, deterministic=False):
-        """Select action from policy"""
-        return self.actor.get_action(state, deterministic, self.noise_scale)
+        """Select action from policy (NumPy inference path, refreshed after every policy update)"""
+        return self.actor.act_numpy(state, deterministic, self.noise_scale)
     
     def add_real_transition(self, state, action, reward, next_state, done):
         """Add transition from real environment to buffer"""
         self.real_buffer.push(state, action, reward, next_state, done)
     
+    def new_model_version(self):
+        """Call after the dynamics model is retrained: later rollouts are tagged with the new
+        version, and rollouts of versions older than the last model_retain are evicted
+        """
+        self.model_version += 1
+        self.model_buffer.evict_older_than(self.model_version - self.model_retain + 1)
+    
     def generate_model_rollouts(self, num_rollouts=1000, rollout_length=5):
         """
         Generate synthetic rollouts using learned dynamics model
         
+        All live rollouts advance together as one batch through self.model_env, with one actor
+        forward pass and one model env step per step. Rollouts that reach a terminal state
+        are dropped from the batch.
+        
         Args:
             num_rollouts: Number of rollout trajectories to generate
             rollout_length: Length of each rollout
@@ -180,125 +468,93 @@ class SimplifiedMBPO:
         # Sample starting states from real buffer
         states, _, _, _, _ = self.real_buffer.sample(min(num_rollouts, len(self.real_buffer)))
         
-        for state in states:
-            current_state = state.copy()
-            
-            for _ in range(rollout_length):
-                # Get action from policy
-                action = self.select_action(current_state, deterministic=False)
-                
-                # Predict next state using dynamics model
-                state_tensor = torch.cat([
-                    torch.FloatTensor(current_state),
-                    torch.FloatTensor(action)
-                ]).double()
-                
-                # Get prediction (delta)
-                delta = self.dynamics_model.predict(state_tensor.numpy().reshape(1, -1))
-                next_state = current_state + delta.flatten()
-                
-                # Estimate reward (simple heuristic or use learned reward model)
-                reward = self._estimate_reward(current_state, action, next_state)
-                
-                # Add to model buffer
-                self.model_buffer.push(current_state, action, reward, next_state, False)
-                
-                current_state = next_state
-    
-    def _estimate_reward(self, state, action, next_state):
-        """
-        Estimate reward using oracle functions
-        This significantly improves performance by using true reward structure
-        """
-        if 'cartpole' in self.env_name:
-            # CartPole oracle reward
-            x = next_state[0]
-            x_dot = next_state[1] if len(next_state) > 1 else 0
-            theta = np.arctan2(next_state[3], next_state[2]) if len(next_state) > 3 else 0
-            theta_dot = next_state[4] if len(next_state) > 4 else 0
-            
-            reward = np.cos(theta) - 0.01 * x**2
-            # Add shaping for stability
-            reward += 0.1 * np.exp(-abs(theta)) if abs(theta) < 0.2 else 0
+        for _ in range(rollout_length):
+            # Get actions from policy
+            actions = self.select_action(states, deterministic=False)
             
-        elif 'pendulum' in self.env_name:
-            # Pendulum oracle reward
-            cos_theta = next_state[0] if len(next_state) > 0 else 0
-            sin_theta = next_state[1] if len(next_state) > 1 else 0
-            theta_dot = next_state[2] if len(next_state) > 2 else 0
+            next_states, rewards, dones = self.model_env.step(states, actions)
+            self.model_buffer.push_batch(states, actions, rewards, next_states, dones, version=self.model_version)
             
-            theta = np.arctan2(sin_theta, cos_theta)
-            reward = -(theta**2 + 0.1 * theta_dot**2 + 0.001 * action**2)
-            
-        else:
-            # Fallback to simple negative cost
-            reward = -0.1
-        
-        return reward
+            # Continue only the rollouts that have not terminated
+            states = next_states[~dones]
+            if len(states) == 0:
+                break
     
     def train_policy(self, num_updates=10):
-        """Train actor and critic using data from both buffers"""
+        """Train actor and critic using data from both buffers
+        
+        Runs num_updates gradient steps in total, sampling one super-batch of grad_steps
+        minibatches at a time. Returns the gradient steps per second (also kept in updates_per_sec).
+        """
         if len(self.real_buffer) < self.batch_size:
             return
         
-        for _ in range(num_updates):
-            # Sample from both real and model buffers
-            real_ratio = 0.5  # Mix 50% real, 50% model data
-            real_batch_size = int(self.batch_size * real_ratio)
-            model_batch_size = self.batch_size - real_batch_size
-            
-            # Get real data
-            if len(self.real_buffer) >= real_batch_size:
-                real_states, real_actions, real_rewards, real_next_states, real_dones = \
-                    self.real_buffer.sample(real_batch_size)
-            else:
-                real_states, real_actions, real_rewards, real_next_states, real_dones = \
-                    self.real_buffer.sample(len(self.real_buffer))
-            
-            # Get model data if available
-            if len(self.model_buffer) >= model_batch_size:
-                model_states, model_actions, model_rewards, model_next_states, model_dones = \
-                    self.model_buffer.sample(model_batch_size)
-                
-                # Combine batches
-                states = np.vstack([real_states, model_states])
-                actions = np.vstack([real_actions, model_actions])
-                rewards = np.vstack([real_rewards, model_rewards])
-                next_states = np.vstack([real_next_states, model_next_states])
-                dones = np.vstack([real_dones, model_dones])
-            else:
-                states = real_states
-                actions = real_actions
-                rewards = real_rewards
-                next_states = real_next_states
-                dones = real_dones
-            
-            # Convert to tensors
-            states = torch.FloatTensor(states)
-            actions = torch.FloatTensor(actions)
-            rewards = torch.FloatTensor(rewards)
-            next_states = torch.FloatTensor(next_states)
-            dones = torch.FloatTensor(dones)
-            
-            # Update critic
-            with torch.no_grad():
-                next_actions = self.actor(next_states)
-                target_q = rewards + (1 - dones) * self.gamma * self.critic(next_states, next_actions)
-            
-            current_q = self.critic(states, actions)
-            critic_loss = nn.MSELoss()(current_q, target_q)
-            
-            self.critic_optimizer.zero_grad()
-            critic_loss.backward()
-            self.critic_optimizer.step()
-            
-            # Update actor
-            new_actions = self.actor(states)
-            actor_loss = -self.critic(states, new_actions).mean()
-            
-            self.actor_optimizer.zero_grad()
-            actor_loss.backward()
-            self.actor_optimizer.step()
+        start = time.perf_counter()
+        updates = 0
+        while updates < num_updates:
+            # Sample grad_steps minibatches from both real and model buffers into the preallocated batch
+            super_batch = self.sampler.sample()
+            for step in range(min(self.grad_steps, num_updates - updates)):
+                self._update(*[tensor[step] for tensor in super_batch])
+                updates += 1
+        
+        self.actor.export_numpy()
+        self.updates_per_sec = updates / max(time.perf_counter() - start, 1e-9)
+        return self.updates_per_sec
+    
+    def _update(self, states, actions, rewards, next_states, dones):
+        """One critic and one actor gradient step on a minibatch, then a Polyak update of the targets"""
+        # Update critic against the target networks
+        with torch.no_grad():
+            next_actions = self.actor_target(next_states)
+            target_q = rewards + (1 - dones) * self.gamma * self.critic_target(next_states, next_actions)
+        
+        current_q = self.critic(states, actions)
+        critic_loss = self.critic_loss_fn(current_q, target_q)
+        
+        self.critic_optimizer.zero_grad()
+        critic_loss.backward()
+        self.critic_optimizer.step()
+        
+        # Update actor
+        new_actions = self.actor(states)
+        actor_loss = -self.critic(states, new_actions).mean()
+        
+        self.actor_optimizer.zero_grad()
+        actor_loss.backward()
+        self.actor_optimizer.step()
+        
+        with torch.no_grad():
+            for target, source in self.target_pairs:
+                target.lerp_(source, self.tau)
+    
+    def state_dict(self):
+        """Networks, optimizers, replay buffers and exploration noise, for checkpointing"""
+        return {
+            'actor': self.actor.state_dict(),
+            'critic': self.critic.state_dict(),
+            'actor_target': self.actor_target.state_dict(),
+            'critic_target': self.critic_target.state_dict(),
+            'actor_optimizer': self.actor_optimizer.state_dict(),
+            'critic_optimizer': self.critic_optimizer.state_dict(),
+            'real_buffer': self.real_buffer.state_dict(),
+            'model_buffer': self.model_buffer.state_dict(),
+            'noise_scale': self.noise_scale,
+            'model_version': self.model_version,
+        }
+    
+    def load_state_dict(self, state):
+        self.actor.load_state_dict(state['actor'])
+        self.actor.export_numpy()
+        self.critic.load_state_dict(state['critic'])
+        self.actor_target.load_state_dict(state['actor_target'])
+        self.critic_target.load_state_dict(state['critic_target'])
+        self.actor_optimizer.load_state_dict(state['actor_optimizer'])
+        self.critic_optimizer.load_state_dict(state['critic_optimizer'])
+        self.real_buffer.load_state_dict(state['real_buffer'])
+        self.model_buffer.load_state_dict(state['model_buffer'])
+        self.noise_scale = state['noise_scale']
+        self.model_version = state['model_version']
     
     def decrease_noise(self, factor=0.95):
         """Decay exploration noise over time"""
@@ -23,6 +23,10 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 from cartpole_continuous import ContinuousCartPoleEnv
 from tf_models.constructor import construct_shallow_model
 from tf_models.fake_env import FakeEnv
+from rewards import make_reward
+from oracle_model import OracleModel
+from checkpoint import save_checkpoint, load_checkpoint, rng_state, set_rng_state
+from results_log import ResultsWriter
 import scipy.stats as stats
 
 os.environ["CUDA_VISIBLE_DEVICES"] = "0"
@@ -68,14 +72,8 @@ class PETS_CEM:
             constrained_var = np.minimum(np.minimum(np.square(lb_dist / 2), np.square(ub_dist / 2)), vars)
             samples = X.rvs(size=[self.num_trajs, self.soln_dim]) * np.sqrt(constrained_var) + means
             
-            # Evaluate trajectories using Trajectory Sampling
-            rewards = []
-            for action_seq in samples:
-                # TRAJECTORY SAMPLING: Select one random model from ensemble for entire trajectory
-                traj_reward = self.evaluate_trajectory_ts(cur_s, action_seq)
-                rewards.append(traj_reward)
-            
-            rewards = np.array(rewards)
+            # Evaluate all trajectories at once using Trajectory Sampling
+            rewards = self.evaluate_trajectories_ts(cur_s, samples)
             
             # Select elites
             elite_idxs = rewards.argsort()[-self.num_elites:]
@@ -98,30 +96,28 @@ class PETS_CEM:
         # Return first action
         return means[:self.action_shape]
     
-    def evaluate_trajectory_ts(self, init_state, action_seq):
+    def evaluate_trajectories_ts(self, init_state, action_seqs):
         """
-        Evaluate trajectory using Trajectory Sampling (TS).
-        Randomly select one model from ensemble and use it for entire trajectory.
+        Evaluate all action sequences using Trajectory Sampling (TS), batched over trajectories.
+        FakeEnv picks a random ensemble member per row; trajectories that reach a terminal
+        state are compacted out of the active set, so later steps only model the survivors.
         """
-        state = init_state.copy()
-        total_reward = 0.0
-        
-        # Randomly select one model index to use for this trajectory
-        # This is done internally by FakeEnv when deterministic=False
+        num_trajs = action_seqs.shape[0]
+        states = np.tile(init_state, (num_trajs, 1))
+        total_rewards = np.zeros(num_trajs)
+        alive = np.arange(num_trajs)
         
         for t in range(self.plan_hor):
-            action = action_seq[t * self.action_shape:(t + 1) * self.action_shape]
-            
-            # Step using fake environment (with TS - random model selection)
-            next_state, reward, done, _ = self.fake_env.step(state, action, deterministic=False)
+            actions = action_seqs[alive, t * self.action_shape:(t + 1) * self.action_shape]
+            next_states, rewards, dones, _ = self.fake_env.step(states, actions, deterministic=False)
+            total_rewards[alive] += rewards.reshape(-1)
             
-            total_reward += reward
-            state = next_state
-            
-            if done:
+            live = dones.reshape(-1) == 0
+            alive, states = alive[live], next_states[live]
+            if len(alive) == 0:
                 break
         
-        return total_reward
+        return total_rewards
 
 
 def run_pets_cartpole(args):
@@ -178,19 +174,8 @@ def run_pets_cartpole(args):
     
     env.termination_fn = cartpole_termination_fn
     
-    # Add oracle reward function for CartPole
-    # In CartPole, reward is 1.0 for every step the pole stays upright
-    def cartpole_reward_fn(obs, act, next_obs):
-        """
-        CartPole gives reward of 1.0 for each timestep the pole is balanced.
-        obs, act, next_obs are arrays of shape [batch_size, dim]
-        Returns array of shape [batch_size, 1]
-        """
-        if len(next_obs.shape) == 1:
-            return np.array([[1.0]], dtype=np.float32)
-        else:
-            batch_size = next_obs.shape[0]
-            return np.ones((batch_size, 1), dtype=np.float32)
+    # Oracle reward for CartPole: 1.0 for every step the pole stays upright
+    cartpole_reward_fn = make_reward('CartPole-survival').fake_env_fn()
     
     # Initialize dynamics model ensemble
     dx_model = construct_shallow_model(
@@ -207,12 +192,32 @@ def run_pets_cartpole(args):
     dataset_next_states = []
     
     cum_rewards = []
-    cumulative_rewards_over_time = []
     total_timesteps = 0
     total_cumulative_reward = 0.0
     
+    seed_suffix = ('_oracle_model' if args.oracle_model else '') + '_seed' + str(args.seed)
+    ckpt_path = os.path.join(args.checkpoint_dir, 'pets_cartpole' + seed_suffix + '.ckpt')
+    start_episode = 0
+    ckpt = load_checkpoint(ckpt_path) if args.resume else None
+    if ckpt is not None:
+        dx_model.load_checkpoint_state(ckpt['dx_model'])
+        dataset_states, dataset_actions, dataset_next_states = ckpt['dataset']
+        cum_rewards = ckpt['cum_rewards']
+        total_timesteps, total_cumulative_reward = ckpt['total_timesteps'], ckpt['total_cumulative_reward']
+        set_rng_state(ckpt['rng'], env)
+        start_episode = ckpt['episode'] + 1
+        print("Resuming from {} at episode {}".format(ckpt_path, start_episode))
+    
+    # Results are appended as they are produced; a resumed run keeps the rows up to its checkpoint
+    log_rows = ckpt['log_rows'] if ckpt is not None else {}
+    output_dir = args.output_dir
+    episode_log = ResultsWriter(os.path.join(output_dir, 'pets_cartpole_log' + seed_suffix + '.txt'),
+                                ['episode', 'reward'], keep_rows=log_rows.get('episode', 0))
+    timestep_log = ResultsWriter(os.path.join(output_dir, 'pets_cartpole_timestep_rewards' + seed_suffix + '.txt'),
+                                 ['timestep', 'cumulative_reward'], keep_rows=log_rows.get('timestep', 0))
+    
     # Training loop
-    for episode in range(args.num_episodes):
+    for episode in range(start_episode, args.num_episodes):
         print("\n" + "=" * 60)
         print("Episode {}/{}".format(episode + 1, args.num_episodes))
         print("=" * 60)
@@ -224,7 +229,11 @@ def run_pets_cartpole(args):
         episode_steps = 0
         
         # Create fake environment (after first episode when we have data)
-        if episode > 0:
+        if episode > 0 and args.oracle_model:
+            # Zero-model-error baseline: plan with the true dynamics
+            fake_env = OracleModel('cartpole', noise=args.oracle_noise, reward_fn=cartpole_reward_fn,
+                                   termination_fn=env.termination_fn)
+        elif episode > 0:
             # Train ensemble on collected data
             print("Training dynamics ensemble...")
             states_array = np.array(dataset_states)
@@ -237,7 +246,7 @@ def run_pets_cartpole(args):
             
             # Create fake environment for planning with oracle rewards
             fake_env = FakeEnv(dx_model, env, reward_fn=cartpole_reward_fn)
-            
+        if episode > 0:
             # Initialize CEM planner with fake environment
             cem = PETS_CEM(env, fake_env, args)
         
@@ -265,7 +274,7 @@ def run_pets_cartpole(args):
             cum_reward += r.item()
             total_timesteps += 1
             total_cumulative_reward += r.item()
-            cumulative_rewards_over_time.append([total_timesteps, total_cumulative_reward])
+            timestep_log.append(total_timesteps, total_cumulative_reward)
             
             state = new_state
             episode_steps += 1
@@ -273,20 +282,18 @@ def run_pets_cartpole(args):
         print("Episode {}: reward = {:.2f}, steps = {}, total_timesteps = {}".format(
             episode, cum_reward, episode_steps, total_timesteps))
         cum_rewards.append([episode, cum_reward])
+        episode_log.append(episode, cum_reward)
+        for log in (episode_log, timestep_log):
+            log.flush(sync=True)
+        save_checkpoint(ckpt_path, {
+            'episode': episode, 'dx_model': dx_model.get_checkpoint_state(),
+            'dataset': (dataset_states, dataset_actions, dataset_next_states),
+            'cum_rewards': cum_rewards, 'log_rows': {'episode': episode_log.rows, 'timestep': timestep_log.rows},
+            'total_timesteps': total_timesteps, 'total_cumulative_reward': total_cumulative_reward,
+            'rng': rng_state(env)})
     
-    # Save results
-    seed_suffix = '_seed' + str(args.seed)
-    output_dir = args.output_dir
-    os.makedirs(output_dir, exist_ok=True)
-    
-    np.savetxt(
-        os.path.join(output_dir, 'pets_cartpole_log' + seed_suffix + '.txt'),
-        cum_rewards
-    )
-    np.savetxt(
-        os.path.join(output_dir, 'pets_cartpole_timestep_rewards' + seed_suffix + '.txt'),
-        cumulative_rewards_over_time
-    )
+    for log in (episode_log, timestep_log):
+        log.close()
     
     print("\n" + "=" * 60)
     print("PETS COMPLETE")
@@ -318,6 +325,13 @@ if __name__ == '__main__':
     parser.add_argument('--max-iters', type=int, default=5, help='CEM iterations')
     parser.add_argument('--epsilon', type=float, default=0.001, help='CEM convergence threshold')
     parser.add_argument('--var', type=float, default=1.0, help='Initial variance')
+    parser.add_argument('--oracle-model', type=lambda x: x.lower() == 'true', default=False,
+                        help='Plan with the true dynamics instead of the ensemble')
+    parser.add_argument('--oracle-noise', type=lambda x: x.lower() == 'true', default=False,
+                        help='Add the env process noise to oracle model predictions')
+    parser.add_argument('--resume', type=lambda x: x.lower() == 'true', default=False,
+                        help='Continue from the last episode checkpoint in --checkpoint-dir')
+    parser.add_argument('--checkpoint-dir', type=str, default='checkpoints', help='Per-episode checkpoint directory')
     
     args = parser.parse_args()
     
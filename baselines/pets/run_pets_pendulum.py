@@ -19,6 +19,10 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 from pendulum_gym import PendulumEnv
 from tf_models.constructor import construct_shallow_model
 from tf_models.fake_env import FakeEnv
+from rewards import make_reward
+from oracle_model import OracleModel
+from checkpoint import save_checkpoint, load_checkpoint, rng_state, set_rng_state
+from results_log import ResultsWriter
 import scipy.stats as stats
 
 os.environ["CUDA_VISIBLE_DEVICES"] = "0"
@@ -64,13 +68,8 @@ class PETS_CEM:
             constrained_var = np.minimum(np.minimum(np.square(lb_dist / 2), np.square(ub_dist / 2)), vars)
             samples = X.rvs(size=[self.num_trajs, self.soln_dim]) * np.sqrt(constrained_var) + means
             
-            # Evaluate trajectories using Trajectory Sampling
-            rewards = []
-            for action_seq in samples:
-                traj_reward = self.evaluate_trajectory_ts(cur_s, action_seq)
-                rewards.append(traj_reward)
-            
-            rewards = np.array(rewards)
+            # Evaluate all trajectories at once using Trajectory Sampling
+            rewards = self.evaluate_trajectories_ts(cur_s, samples)
             
             # Select elites
             elite_idxs = rewards.argsort()[-self.num_elites:]
@@ -93,24 +92,28 @@ class PETS_CEM:
         # Return first action
         return means[:self.action_shape]
     
-    def evaluate_trajectory_ts(self, init_state, action_seq):
-        """Evaluate trajectory using Trajectory Sampling"""
-        state = init_state.copy()
-        total_reward = 0.0
+    def evaluate_trajectories_ts(self, init_state, action_seqs):
+        """
+        Evaluate all action sequences using Trajectory Sampling (TS), batched over trajectories.
+        FakeEnv picks a random ensemble member per row; trajectories that reach a terminal
+        state are compacted out of the active set, so later steps only model the survivors.
+        """
+        num_trajs = action_seqs.shape[0]
+        states = np.tile(init_state, (num_trajs, 1))
+        total_rewards = np.zeros(num_trajs)
+        alive = np.arange(num_trajs)
         
         for t in range(self.plan_hor):
-            action = action_seq[t * self.action_shape:(t + 1) * self.action_shape]
+            actions = action_seqs[alive, t * self.action_shape:(t + 1) * self.action_shape]
+            next_states, rewards, dones, _ = self.fake_env.step(states, actions, deterministic=False)
+            total_rewards[alive] += rewards.reshape(-1)
             
-            # Step using fake environment with TS
-            next_state, reward, done, _ = self.fake_env.step(state, action, deterministic=False)
-            
-            total_reward += reward
-            state = next_state
-            
-            if done:
+            live = dones.reshape(-1) == 0
+            alive, states = alive[live], next_states[live]
+            if len(alive) == 0:
                 break
         
-        return total_reward
+        return total_rewards
 
 
 def run_pets_pendulum(args):
@@ -151,36 +154,8 @@ def run_pets_pendulum(args):
     
     env.termination_fn = pendulum_termination_fn
     
-    # Add oracle reward function for Pendulum
-    # Pendulum reward: -(theta^2 + 0.1*theta_dot^2 + 0.001*action^2)
-    def pendulum_reward_fn(obs, act, next_obs):
-        """
-        Pendulum reward based on angle and angular velocity.
-        obs, act, next_obs are arrays of shape [batch_size, dim]
-        next_obs: [cos(theta), sin(theta), theta_dot]
-        Returns array of shape [batch_size, 1]
-        """
-        if len(next_obs.shape) == 1:
-            next_obs = next_obs[None]
-            act = act[None] if len(act.shape) == 1 else act
-            return_single = True
-        else:
-            return_single = False
-        
-        cos_th = next_obs[:, 0]
-        sin_th = next_obs[:, 1]
-        thdot = next_obs[:, 2]
-        
-        # Compute angle from cos and sin
-        th = np.arctan2(sin_th, cos_th)
-        
-        # Pendulum reward: -(theta^2 + 0.1*theta_dot^2 + 0.001*action^2)
-        reward = -(th**2 + 0.1 * thdot**2 + 0.001 * (act.squeeze()**2))
-        reward = reward[:, None]  # Shape [batch_size, 1]
-        
-        if return_single:
-            return reward[0:1]
-        return reward
+    # Oracle reward for Pendulum: -(theta^2 + 0.1*theta_dot^2 + 0.001*action^2)
+    pendulum_reward_fn = make_reward('Pendulum-v0').fake_env_fn()
     
     # Initialize dynamics model ensemble
     dx_model = construct_shallow_model(
@@ -197,12 +172,32 @@ def run_pets_pendulum(args):
     dataset_next_states = []
     
     cum_rewards = []
-    cumulative_rewards_over_time = []
     total_timesteps = 0
     total_cumulative_reward = 0.0
     
+    seed_suffix = ('_oracle_model' if args.oracle_model else '') + '_seed' + str(args.seed)
+    ckpt_path = os.path.join(args.checkpoint_dir, 'pets_pendulum' + seed_suffix + '.ckpt')
+    start_episode = 0
+    ckpt = load_checkpoint(ckpt_path) if args.resume else None
+    if ckpt is not None:
+        dx_model.load_checkpoint_state(ckpt['dx_model'])
+        dataset_states, dataset_actions, dataset_next_states = ckpt['dataset']
+        cum_rewards = ckpt['cum_rewards']
+        total_timesteps, total_cumulative_reward = ckpt['total_timesteps'], ckpt['total_cumulative_reward']
+        set_rng_state(ckpt['rng'], env)
+        start_episode = ckpt['episode'] + 1
+        print("Resuming from {} at episode {}".format(ckpt_path, start_episode))
+    
+    # Results are appended as they are produced; a resumed run keeps the rows up to its checkpoint
+    log_rows = ckpt['log_rows'] if ckpt is not None else {}
+    output_dir = args.output_dir
+    episode_log = ResultsWriter(os.path.join(output_dir, 'pets_pendulum_log' + seed_suffix + '.txt'),
+                                ['episode', 'reward'], keep_rows=log_rows.get('episode', 0))
+    timestep_log = ResultsWriter(os.path.join(output_dir, 'pets_pendulum_timestep_rewards' + seed_suffix + '.txt'),
+                                 ['timestep', 'cumulative_reward'], keep_rows=log_rows.get('timestep', 0))
+    
     # Training loop
-    for episode in range(args.num_episodes):
+    for episode in range(start_episode, args.num_episodes):
         print("\n" + "=" * 60)
         print("Episode {}/{}".format(episode + 1, args.num_episodes))
         print("=" * 60)
@@ -214,7 +209,11 @@ def run_pets_pendulum(args):
         episode_steps = 0
         
         # Create fake environment (after first episode)
-        if episode > 0:
+        if episode > 0 and args.oracle_model:
+            # Zero-model-error baseline: plan with the true dynamics
+            fake_env = OracleModel('pendulum', noise=args.oracle_noise, reward_fn=pendulum_reward_fn,
+                                   termination_fn=env.termination_fn)
+        elif episode > 0:
             print("Training dynamics ensemble...")
             states_array = np.array(dataset_states)
             actions_array = np.array(dataset_actions).reshape(-1, 1)  # Ensure shape (N, 1)
@@ -226,6 +225,7 @@ def run_pets_pendulum(args):
             
             # Create fake environment for planning with oracle rewards
             fake_env = FakeEnv(dx_model, env, reward_fn=pendulum_reward_fn)
+        if episode > 0:
             cem = PETS_CEM(env, fake_env, args)
         
         # Episode rollout
@@ -252,7 +252,7 @@ def run_pets_pendulum(args):
             cum_reward += r.item()
             total_timesteps += 1
             total_cumulative_reward += r.item()
-            cumulative_rewards_over_time.append([total_timesteps, total_cumulative_reward])
+            timestep_log.append(total_timesteps, total_cumulative_reward)
             
             state = new_state
             episode_steps += 1
@@ -260,20 +260,18 @@ def run_pets_pendulum(args):
         print("Episode {}: reward = {:.2f}, steps = {}, total_timesteps = {}".format(
             episode, cum_reward, episode_steps, total_timesteps))
         cum_rewards.append([episode, cum_reward])
+        episode_log.append(episode, cum_reward)
+        for log in (episode_log, timestep_log):
+            log.flush(sync=True)
+        save_checkpoint(ckpt_path, {
+            'episode': episode, 'dx_model': dx_model.get_checkpoint_state(),
+            'dataset': (dataset_states, dataset_actions, dataset_next_states),
+            'cum_rewards': cum_rewards, 'log_rows': {'episode': episode_log.rows, 'timestep': timestep_log.rows},
+            'total_timesteps': total_timesteps, 'total_cumulative_reward': total_cumulative_reward,
+            'rng': rng_state(env)})
     
-    # Save results
-    seed_suffix = '_seed' + str(args.seed)
-    output_dir = args.output_dir
-    os.makedirs(output_dir, exist_ok=True)
-    
-    np.savetxt(
-        os.path.join(output_dir, 'pets_pendulum_log' + seed_suffix + '.txt'),
-        cum_rewards
-    )
-    np.savetxt(
-        os.path.join(output_dir, 'pets_pendulum_timestep_rewards' + seed_suffix + '.txt'),
-        cumulative_rewards_over_time
-    )
+    for log in (episode_log, timestep_log):
+        log.close()
     
     print("\n" + "=" * 60)
     print("PETS COMPLETE")
@@ -305,6 +303,13 @@ if __name__ == '__main__':
     parser.add_argument('--max-iters', type=int, default=5, help='CEM iterations')
     parser.add_argument('--epsilon', type=float, default=0.001, help='CEM convergence')
     parser.add_argument('--var', type=float, default=3.0, help='Initial variance')
+    parser.add_argument('--oracle-model', type=lambda x: x.lower() == 'true', default=False,
+                        help='Plan with the true dynamics instead of the ensemble')
+    parser.add_argument('--oracle-noise', type=lambda x: x.lower() == 'true', default=False,
+                        help='Add the env process noise to oracle model predictions')
+    parser.add_argument('--resume', type=lambda x: x.lower() == 'true', default=False,
+                        help='Continue from the last episode checkpoint in --checkpoint-dir')
+    parser.add_argument('--checkpoint-dir', type=str, default='checkpoints', help='Per-episode checkpoint directory')
     
     args = parser.parse_args()
     
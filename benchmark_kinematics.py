@@ -0,0 +1,63 @@
+# compares the batched Reacher3D kinematics against the original per-call implementation
+import argparse
+import time
+
+import numpy as np
+
+from kinematics import ReacherKinematics
+
+
+def get_ee_pos_reference(states):
+    # original Reacher3DEnv.get_EE_pos / CEM.get_ee_pos
+    theta1, theta2, theta3, theta4, theta5, theta6, theta7 = \
+        states[:, :1], states[:, 1:2], states[:, 2:3], states[:, 3:4], states[:, 4:5], states[:, 5:6], states[:, 6:]
+
+    rot_axis = np.concatenate([np.cos(theta2) * np.cos(theta1), np.cos(theta2) * np.sin(theta1), -np.sin(theta2)],
+                              axis=1)
+    rot_perp_axis = np.concatenate([-np.sin(theta1), np.cos(theta1), np.zeros(theta1.shape)], axis=1)
+    cur_end = np.concatenate([
+        0.1 * np.cos(theta1) + 0.4 * np.cos(theta1) * np.cos(theta2),
+        0.1 * np.sin(theta1) + 0.4 * np.sin(theta1) * np.cos(theta2) - 0.188,
+        -0.4 * np.sin(theta2)
+    ], axis=1)
+
+    for length, hinge, roll in [(0.321, theta4, theta3), (0.16828, theta6, theta5)]:
+        perp_all_axis = np.cross(rot_axis, rot_perp_axis)
+        x = np.cos(hinge) * rot_axis
+        y = np.sin(hinge) * np.sin(roll) * rot_perp_axis
+        z = -np.sin(hinge) * np.cos(roll) * perp_all_axis
+        new_rot_axis = x + y + z
+        new_rot_perp_axis = np.cross(new_rot_axis, rot_axis)
+        new_rot_perp_axis[np.linalg.norm(new_rot_perp_axis, axis=1) < 1e-30] = \
+            rot_perp_axis[np.linalg.norm(new_rot_perp_axis, axis=1) < 1e-30]
+        new_rot_perp_axis /= np.linalg.norm(new_rot_perp_axis, axis=1, keepdims=True)
+        rot_axis, rot_perp_axis, cur_end = new_rot_axis, new_rot_perp_axis, cur_end + length * new_rot_axis
+
+    return cur_end
+
+
+def time_calls(fn, states, repeats):
+    fn(states)
+    start = time.time()
+    for _ in range(repeats):
+        fn(states)
+    return (time.time() - start) / repeats * 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 400, 2000, 10000])
+    parser.add_argument('--repeats', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    kinematics = ReacherKinematics()
+    print('{:>8} {:>14} {:>14} {:>8} {:>10}'.format('batch', 'reference us', 'batched us', 'speedup', 'max err'))
+    for batch in args.batch:
+        states = rng.uniform(-np.pi, np.pi, size=[batch, 17])
+        states[::7, 3] = 0.  # include rows with a degenerate rotation axis
+        err = np.max(np.abs(kinematics.ee_pos(states) - get_ee_pos_reference(states)))
+        ref_us = time_calls(get_ee_pos_reference, states, args.repeats)
+        new_us = time_calls(kinematics.ee_pos, states, args.repeats)
+        print('{:>8} {:>14.1f} {:>14.1f} {:>7.2f}x {:>10.2e}'.format(batch, ref_us, new_us, ref_us / new_us, err))
@@ -55,6 +55,7 @@ class ContinuousCartPoleEnv():
         self.observation_space = spaces.Box(-high, high)
 
         self.seed()
+        self.noise_rng = np.random  # transition and reward noise; a RandomState makes it independent of the global RNG
         self.viewer = None
         self.state = None
 
@@ -72,10 +73,10 @@ class ContinuousCartPoleEnv():
         thetaacc = (self.gravity * sintheta - costheta * temp) / \
             (self.length * (4.0/3.0 - self.masspole * costheta * costheta / self.total_mass))
         xacc = temp - self.polemass_length * thetaacc * costheta / self.total_mass
-        x = x + self.tau * x_dot + np.random.normal(loc=0, scale=0.01, size=[1])
-        x_dot = x_dot + self.tau * xacc +  np.random.normal(loc=0, scale=0.01, size=[1])
-        theta = theta + self.tau * theta_dot +  np.random.normal(loc=0, scale=0.01, size=[1])
-        theta_dot = theta_dot + self.tau * thetaacc +  np.random.normal(loc=0, scale=0.01, size=[1])
+        x = x + self.tau * x_dot + self.noise_rng.normal(loc=0, scale=0.01, size=[1])
+        x_dot = x_dot + self.tau * xacc +  self.noise_rng.normal(loc=0, scale=0.01, size=[1])
+        theta = theta + self.tau * theta_dot +  self.noise_rng.normal(loc=0, scale=0.01, size=[1])
+        theta_dot = theta_dot + self.tau * thetaacc +  self.noise_rng.normal(loc=0, scale=0.01, size=[1])
         return (x[0], x_dot[0], theta[0], theta_dot[0])
 
     def step(self, action):
@@ -107,11 +108,18 @@ class ContinuousCartPoleEnv():
 #                 """)
             self.steps_beyond_done += 1
             reward = 0.0
-        reward += np.random.normal(0, 0.01)
+        reward += self.noise_rng.normal(0, 0.01)
 
         return np.array(self.state), reward, done, {}
 
 
+    def termination_fn(self, obs, act, next_obs):
+        # batched done flags [batch_size, 1] for model rollouts, same thresholds as step()
+        next_obs = np.atleast_2d(next_obs)
+        x, theta = next_obs[:, 0], next_obs[:, 2]
+        done = (np.abs(x) > self.x_threshold) | (np.abs(theta) > self.theta_threshold_radians)
+        return done.astype(np.float32)[:, None]
+
     def reset(self):
         self.state = self.np_random.uniform(low=-0.05, high=0.05, size=(4,))
         self.steps_beyond_done = None
@@ -166,4 +174,62 @@ class ContinuousCartPoleEnv():
 
     def close(self):
         if self.viewer:
-            self.viewer.close()
\ No newline at end of file
+            self.viewer.close()
+
+
+class VectorContinuousCartPoleEnv(ContinuousCartPoleEnv):
+    """num_envs independent carts stepped together as arrays.
+
+    Same dynamics, thresholds and noise as ContinuousCartPoleEnv, with the state and reward noise
+    of all carts drawn in a single np.random.normal call per step. step takes [num_envs] or
+    [num_envs, 1] actions and returns ([num_envs, 4] obs, [num_envs] rewards, [num_envs] dones, {}).
+    Finished carts are not reset automatically: call reset(indices) for the ones to restart.
+    """
+
+    def __init__(self, num_envs=1):
+        super(VectorContinuousCartPoleEnv, self).__init__()
+        self.num_envs = num_envs
+        self.state = np.zeros((num_envs, 4))
+        # -1 while a cart is still up, as steps_beyond_done = None in the single env
+        self.steps_beyond_done = -np.ones(num_envs, dtype=int)
+
+    def dynamics(self, state, force, noise=None):
+        '''one Euler step of [batch, 4] states under [batch] forces; noise is an optional [batch, 4] array'''
+        x, x_dot, theta, theta_dot = state[:, 0], state[:, 1], state[:, 2], state[:, 3]
+        costheta = np.cos(theta)
+        sintheta = np.sin(theta)
+        temp = (force + self.polemass_length * theta_dot * theta_dot * sintheta) / self.total_mass
+        thetaacc = (self.gravity * sintheta - costheta * temp) / \
+            (self.length * (4.0/3.0 - self.masspole * costheta * costheta / self.total_mass))
+        xacc = temp - self.polemass_length * thetaacc * costheta / self.total_mass
+        next_state = np.stack([x + self.tau * x_dot, x_dot + self.tau * xacc,
+                               theta + self.tau * theta_dot, theta_dot + self.tau * thetaacc], axis=1)
+        if noise is not None:
+            next_state += noise
+        return next_state
+
+    def step(self, action):
+        force = self.force_mag * np.asarray(action, dtype=np.float64).reshape(self.num_envs)
+        noise = np.random.normal(loc=0, scale=0.01, size=[self.num_envs, 5])
+        self.state = self.dynamics(self.state, force, noise[:, :4])
+        x, theta = self.state[:, 0], self.state[:, 2]
+        done = (x < -self.x_threshold) | (x > self.x_threshold) | \
+            (theta < -self.theta_threshold_radians) | (theta > self.theta_threshold_radians)
+
+        # 1 while up and on the step the pole falls, 0 afterwards
+        beyond = done & (self.steps_beyond_done >= 0)
+        reward = np.where(beyond, 0.0, 1.0) + noise[:, 4]
+        self.steps_beyond_done[beyond] += 1
+        self.steps_beyond_done[done & ~beyond] = 0
+
+        return self.state.copy(), reward, done, {}
+
+    def reset(self, indices=None):
+        '''reset all carts, or only the ones in indices; returns the [num_envs, 4] observation'''
+        indices = np.arange(self.num_envs) if indices is None else np.asarray(indices, dtype=int).reshape(-1)
+        self.state[indices] = self.np_random.uniform(low=-0.05, high=0.05, size=(len(indices), 4))
+        self.steps_beyond_done[indices] = -1
+        return self.state.copy()
+
+    def render(self, mode='human'):
+        raise NotImplementedError('render a single ContinuousCartPoleEnv instead')
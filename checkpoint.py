@@ -0,0 +1,44 @@
+# per-episode checkpoints so that long runs can resume after a crash or preemption
+import os
+import pickle
+import random
+
+import numpy as np
+import torch
+
+
+def save_checkpoint(path, state):
+    '''pickle state to path atomically: a crash mid-write leaves the previous checkpoint intact'''
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path):
+    '''the state saved at path, or None if there is no checkpoint yet'''
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def rng_state(env=None):
+    '''numpy, random and torch global RNG states, plus the env's own np_random if it has one'''
+    state = {'numpy': np.random.get_state(), 'random': random.getstate(), 'torch': torch.get_rng_state()}
+    if env is not None and hasattr(env, 'np_random'):
+        state['env'] = env.np_random
+    return state
+
+
+def set_rng_state(state, env=None):
+    np.random.set_state(state['numpy'])
+    random.setstate(state['random'])
+    torch.set_rng_state(state['torch'])
+    if env is not None and 'env' in state:
+        env.np_random = state['env']
@@ -0,0 +1,131 @@
+# planner-to-policy distillation: act with a small network trained to imitate CEM, replan when it is unsure
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+from baselines.mbpo.simple_mbpo import SimpleActor
+
+
+class DistilledPlanner(object):
+    """Wraps a CEM planner with a SimpleActor that learns to imitate it.
+
+    Every action CEM plans is recorded with its state, and fit() regresses the actor onto the
+    recorded (state, action) pairs. Once fitted (and with at least min_data pairs), act() first
+    checks the actor's action on the planner's own model: the actor is rolled out closed-loop for
+    check_hor steps next to CEM's warm-start plan (its previous plan, shifted one step), with
+    num_particles rows each in the same model calls. CEM replans for the state when
+
+      - the actor's mean predicted return is more than return_tol * |plan return| below the plan's, or
+      - the dynamics model's predictive std at (state, actor action) exceeds std_tol (skipped if
+        std_tol is None or the model has no predictive_std).
+
+    Otherwise the actor's action is used, at the cost of check_hor model calls instead of
+    CEM's max_iters x plan_hor. The warm-start plan is advanced either way. After max_policy_steps
+    actor actions in a row CEM replans regardless, which refreshes the plan the actor is compared
+    against and labels the states the actor itself visits.
+    """
+
+    def __init__(self, cem, obs_dim, action_dim, action_low, action_high, hidden_dim=64, lr=1e-3,
+                 check_hor=10, num_particles=5, return_tol=0.05, std_tol=None, min_data=400, max_policy_steps=10):
+        self.cem = cem
+        self.actor = SimpleActor(obs_dim, action_dim, hidden_dim, np.asarray(action_low, dtype=np.float32),
+                                 np.asarray(action_high, dtype=np.float32))
+        self.actor.export_numpy()
+        self.optimizer = optim.Adam(self.actor.parameters(), lr=lr)
+        self.check_hor = min(check_hor, cem.plan_hor)
+        self.num_particles = num_particles
+        self.return_tol = return_tol
+        self.std_tol = std_tol
+        self.min_data = min_data
+        self.max_policy_steps = max_policy_steps
+        self.policy_steps = 0  # actor actions since CEM last planned
+        self.states, self.actions = [], []
+        self.fitted = False
+        self.wait_ms = 0.
+        self.stats = {'policy': 0, 'cem': 0}
+
+    def warm_start_plan(self):
+        """the plan CEM would start its next search from, without consuming it"""
+        cem = self.cem
+        if cem.next_init is not None:
+            return cem.next_init.copy()
+        return np.concatenate((cem.pre_means[cem.action_shape:], cem.pre_means[-cem.action_shape:]))
+
+    def predicted_returns(self, s, plan):
+        """mean predicted check_hor-step return of the actor (closed-loop) and of plan (open-loop) from s"""
+        cem, k, a_dim = self.cem, self.num_particles, self.cem.action_shape
+        pre_ss = np.tile(s, (2 * k, 1))
+        returns = np.zeros(2 * k)
+        for t in range(self.check_hor):
+            action_s = np.empty((2 * k, a_dim))
+            action_s[:k] = self.actor.act_numpy(pre_ss[:k], deterministic=True)
+            action_s[k:] = plan[t * a_dim:(t + 1) * a_dim]
+            xu = np.concatenate((pre_ss, action_s), 1)
+            new_pre_ss = cem.my_dx.predict(xu)
+            returns += cem.get_cost(xu, pre_ss, action_s)
+            pre_ss = new_pre_ss
+        returns = np.nan_to_num(returns)
+        return returns[:k].mean(), returns[k:].mean()
+
+    def trust_policy(self, s, action, plan):
+        if self.std_tol is not None and hasattr(self.cem.my_dx, 'predictive_std'):
+            if np.max(self.cem.my_dx.predictive_std(np.concatenate((s, action))[None])) > self.std_tol:
+                return False
+        policy_return, plan_return = self.predicted_returns(s, plan)
+        return policy_return >= plan_return - self.return_tol * abs(plan_return)
+
+    def act(self, state):
+        """action for state: the actor's if the checks pass, otherwise CEM's (recorded for training)"""
+        start = time.time()
+        s = (state.numpy() if torch.is_tensor(state) else np.asarray(state)).astype(np.float64).ravel()
+        if self.fitted and len(self.states) >= self.min_data and self.policy_steps < self.max_policy_steps:
+            action = self.actor.act_numpy(s, deterministic=True)
+            plan = self.warm_start_plan()
+            if self.trust_policy(s, action, plan):
+                self.cem.advance(state, plan)
+                self.stats['policy'] += 1
+                self.policy_steps += 1
+                self.wait_ms = (time.time() - start) * 1000.
+                return action
+        action = self.cem.hori_planning(state)
+        self.policy_steps = 0
+        self.states.append(s)
+        self.actions.append(np.asarray(action, dtype=np.float64).ravel())
+        self.stats['cem'] += 1
+        self.wait_ms = (time.time() - start) * 1000.
+        return action
+
+    def fit(self, epochs=50, batch_size=256):
+        """behaviour-clone the actor on all recorded CEM actions; returns the final epoch's mean loss"""
+        if len(self.states) == 0:
+            return None
+        states = torch.as_tensor(np.array(self.states), dtype=torch.float32)
+        actions = torch.as_tensor(np.array(self.actions), dtype=torch.float32)
+        loss_fn = nn.MSELoss()
+        for _ in range(epochs):
+            perm = torch.randperm(len(states))
+            losses = []
+            for i in range(0, len(states), batch_size):
+                idx = perm[i:i + batch_size]
+                loss = loss_fn(self.actor(states[idx]), actions[idx])
+                self.optimizer.zero_grad()
+                loss.backward()
+                self.optimizer.step()
+                losses.append(loss.item())
+        self.actor.export_numpy()
+        self.fitted = True
+        return np.mean(losses)
+
+    def state_dict(self):
+        return {'actor': self.actor.state_dict(), 'optimizer': self.optimizer.state_dict(),
+                'states': self.states, 'actions': self.actions, 'fitted': self.fitted, 'stats': self.stats}
+
+    def load_state_dict(self, state):
+        self.actor.load_state_dict(state['actor'])
+        self.actor.export_numpy()
+        self.optimizer.load_state_dict(state['optimizer'])
+        self.states, self.actions = list(state['states']), list(state['actions'])
+        self.fitted, self.stats = state['fitted'], dict(state['stats'])
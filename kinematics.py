@@ -0,0 +1,106 @@
+# batched end-effector forward kinematics of the 7-dof Reacher3D arm
+import numpy as np
+
+
+class ReacherKinematics(object):
+    """End-effector positions for a batch of Reacher3D states, [batch, obs_dim] -> [batch, 3].
+
+    All intermediates live in [3, batch] / [6, batch] work buffers that are reused while the
+    batch size stays the same, and the degenerate-axis check shares one squared-norm pass with
+    the normalization. ee_pos returns a view of an internal buffer that the next call overwrites,
+    so keep one instance per caller (the env and the planner each own theirs).
+    """
+    # (link length, hinge joint, roll joint) of the two links after the shoulder
+    LINKS = ((0.321, 3, 2), (0.16828, 5, 4))
+
+    def __init__(self):
+        self.batch = None
+
+    def _alloc(self, batch):
+        self.batch = batch
+        self.cos, self.sin = np.empty((6, batch)), np.empty((6, batch))
+        self.rot, self.perp, self.perp_all = np.empty((3, batch)), np.empty((3, batch)), np.empty((3, batch))
+        self.new_rot, self.new_perp, self.end = np.empty((3, batch)), np.empty((3, batch)), np.empty((3, batch))
+        self.tmp, self.tmp2, self.cross_tmp, self.nsq = np.empty(batch), np.empty(batch), np.empty(batch), np.empty(batch)
+
+    def _cross(self, a, b, out):
+        # out = a x b over the leading axis, without np.cross temporaries
+        for i, j, k in ((0, 1, 2), (1, 2, 0), (2, 0, 1)):
+            np.multiply(a[j], b[k], out=out[i])
+            np.multiply(a[k], b[j], out=self.cross_tmp)
+            out[i] -= self.cross_tmp
+
+    def ee_pos(self, states):
+        batch = states.shape[0]
+        if self.batch != batch:
+            self._alloc(batch)
+        c, s, tmp, tmp2 = self.cos, self.sin, self.tmp, self.tmp2
+        rot, perp, perp_all, new_rot, new_perp, end = \
+            self.rot, self.perp, self.perp_all, self.new_rot, self.new_perp, self.end
+        np.cos(states[:, :6].T, out=c)
+        np.sin(states[:, :6].T, out=s)
+
+        # shoulder: rot = [c2 c1, c2 s1, -s2], perp = [-s1, c1, 0]
+        np.multiply(c[1], c[0], out=rot[0])
+        np.multiply(c[1], s[0], out=rot[1])
+        np.negative(s[1], out=rot[2])
+        np.negative(s[0], out=perp[0])
+        perp[1] = c[0]
+        perp[2] = 0.
+        # end = [c1 (0.1 + 0.4 c2), s1 (0.1 + 0.4 c2) - 0.188, -0.4 s2]
+        np.multiply(c[1], 0.4, out=tmp)
+        tmp += 0.1
+        np.multiply(c[0], tmp, out=end[0])
+        np.multiply(s[0], tmp, out=end[1])
+        end[1] -= 0.188
+        np.multiply(s[1], -0.4, out=end[2])
+
+        for length, hinge, roll in self.LINKS:
+            self._cross(rot, perp, perp_all)
+            # new_rot = cos(hinge) rot + sin(hinge) sin(roll) perp - sin(hinge) cos(roll) perp_all
+            np.multiply(s[hinge], s[roll], out=tmp)
+            np.multiply(s[hinge], c[roll], out=tmp2)
+            np.multiply(rot, c[hinge], out=new_rot)
+            perp_all *= tmp2
+            new_rot -= perp_all
+            np.multiply(perp, tmp, out=perp_all)
+            new_rot += perp_all
+
+            self._cross(new_rot, rot, new_perp)
+            nsq = np.einsum('ij,ij->j', new_perp, new_perp, out=self.nsq)
+            degenerate = nsq < 1e-60
+            if degenerate.any():
+                # rotation axis did not move: keep the previous perpendicular axis
+                new_perp[:, degenerate] = perp[:, degenerate]
+                nsq[degenerate] = np.einsum('ij,ij->j', perp[:, degenerate], perp[:, degenerate])
+            np.sqrt(nsq, out=nsq)
+            new_perp /= nsq
+
+            np.multiply(new_rot, length, out=perp_all)
+            end += perp_all
+            rot, new_rot = new_rot, rot
+            perp, new_perp = new_perp, perp
+
+        return end.T
+
+    @staticmethod
+    def tf(states):
+        """Same end-effector positions as a tensorflow op, [batch, obs_dim] -> [batch, 3]."""
+        import tensorflow as tf
+        c, s = tf.cos(states[:, :6]), tf.sin(states[:, :6])
+        rot = tf.stack([c[:, 1] * c[:, 0], c[:, 1] * s[:, 0], -s[:, 1]], axis=1)
+        perp = tf.stack([-s[:, 0], c[:, 0], tf.zeros_like(s[:, 0])], axis=1)
+        end = tf.stack([c[:, 0] * (0.1 + 0.4 * c[:, 1]), s[:, 0] * (0.1 + 0.4 * c[:, 1]) - 0.188, -0.4 * s[:, 1]],
+                       axis=1)
+        for length, hinge, roll in ReacherKinematics.LINKS:
+            perp_all = tf.linalg.cross(rot, perp)
+            new_rot = (c[:, hinge:hinge + 1] * rot + (s[:, hinge:hinge + 1] * s[:, roll:roll + 1]) * perp -
+                       (s[:, hinge:hinge + 1] * c[:, roll:roll + 1]) * perp_all)
+            new_perp = tf.linalg.cross(new_rot, rot)
+            # rotation axis did not move: keep the previous perpendicular axis
+            degenerate = tf.tile(tf.reduce_sum(tf.square(new_perp), axis=1, keepdims=True) < 1e-60, [1, 3])
+            new_perp = tf.where(degenerate, perp, new_perp)
+            new_perp /= tf.norm(new_perp, axis=1, keepdims=True)
+            end += length * new_rot
+            rot, perp = new_rot, new_perp
+        return end
@@ -0,0 +1,83 @@
+# ground-truth dynamics behind the learned-model interfaces, for zero-model-error planning baselines
+import numpy as np
+
+from cartpole_continuous import VectorContinuousCartPoleEnv
+from pendulum_gym import VectorPendulumEnv
+from rewards import make_reward
+
+
+class OracleModel(object):
+    """Stand-in for neural_bays_dx_tf backed by the analytic CartPole / Pendulum dynamics.
+
+    predict(xu) takes [rows, obs_dim + action_dim] inputs like the learned model. A "dx" model
+    returns the true next states, and a "cost" model returns the oracle reward from rewards.py
+    as [rows, 1]. With noise=True the env's process noise (N(0, 0.01) per state dimension) is
+    added, otherwise predictions are exact. The data and posterior calls are no-ops, so the
+    drivers run unchanged. step() mirrors FakeEnv.step, which lets PETS_CEM plan with it as well.
+    """
+
+    def __init__(self, env_name, model_type='dx', noise=False, reward_fn=None, termination_fn=None):
+        self.env_name = env_name
+        self.model_type = model_type
+        self.noise = noise
+        self.reward_fn = reward_fn
+        self.termination_fn = termination_fn
+        if 'CartPole-continuous' in env_name or env_name == 'cartpole':
+            self.env = VectorContinuousCartPoleEnv()
+            self.obs_dim = 4
+        elif 'Pendulum-v0' in env_name or env_name == 'pendulum':
+            self.env = VectorPendulumEnv()
+            self.obs_dim = 3
+        else:
+            raise ValueError('no analytic dynamics for {}'.format(env_name))
+        self.reward = make_reward(env_name)
+
+    def next_states(self, obs, act, noise=False):
+        if isinstance(self.env, VectorContinuousCartPoleEnv):
+            n = np.random.normal(loc=0, scale=0.01, size=obs.shape) if noise else None
+            return self.env.dynamics(obs, self.env.force_mag * act[:, 0], n)
+        th = np.arctan2(obs[:, 1], obs[:, 0])
+        u = np.clip(act[:, 0], -self.env.max_torque, self.env.max_torque)
+        n = np.random.normal(loc=0, scale=0.01, size=[obs.shape[0], 2]) if noise else None
+        state = self.env.dynamics(np.stack([th, obs[:, 2]], axis=1), u, n)
+        return np.stack([np.cos(state[:, 0]), np.sin(state[:, 0]), state[:, 1]], axis=1)
+
+    def predict(self, x):
+        xu = np.asarray(x, dtype=np.float64)
+        single = xu.ndim == 1
+        xu = np.atleast_2d(xu)
+        obs, act = xu[:, :self.obs_dim], xu[:, self.obs_dim:]
+        if self.model_type == "dx":
+            out = self.next_states(obs, act, self.noise)
+        else:
+            out = self.reward(obs, act)[:, None].copy()
+        return out[0] if single else out
+
+    def step(self, obs, act, deterministic=False):
+        next_obs = self.next_states(obs, act, self.noise and not deterministic)
+        rewards = self.reward_fn(obs, act, next_obs) if self.reward_fn is not None else \
+            self.reward(next_obs, act)[:, None].copy()
+        if self.termination_fn is not None:
+            terminals = self.termination_fn(obs, act, next_obs)
+        else:
+            terminals = np.zeros((obs.shape[0], 1), dtype=np.float32)
+        return next_obs, rewards, terminals, {}
+
+    # the learned-model calls the drivers make between episodes
+    def add_data(self, new_x, new_y):
+        pass
+
+    def train(self, epochs=5):
+        pass
+
+    def sample(self, parallelize=False):
+        pass
+
+    def update_bays_reg(self):
+        pass
+
+    def state_dict(self):
+        return {}
+
+    def load_state_dict(self, state):
+        pass
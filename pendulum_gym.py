@@ -23,6 +23,7 @@ class PendulumEnv():
 
         self._seed()
         self.max_steps = 200
+        self.noise_rng = np.random  # transition and reward noise; a RandomState makes it independent of the global RNG
 
     def _seed(self, seed=None):
         self.np_random, seed = seeding.np_random(seed)
@@ -72,8 +73,8 @@ class PendulumEnv():
         self.last_u = u_scalar # for rendering
         costs = angle_normalize(th)**2 + .1*thdot**2 + .001*(u_scalar**2)
 
-        newthdot = thdot + (-3*g/(2*l) * np.sin(th + np.pi) + 3./(m*l**2)*u_scalar) * dt + np.random.normal(loc=0, scale=0.01, size=[1])
-        newth = th + newthdot*dt + np.random.normal(loc=0, scale=0.01, size=[1])
+        newthdot = thdot + (-3*g/(2*l) * np.sin(th + np.pi) + 3./(m*l**2)*u_scalar) * dt + self.noise_rng.normal(loc=0, scale=0.01, size=[1])
+        newth = th + newthdot*dt + self.noise_rng.normal(loc=0, scale=0.01, size=[1])
         newthdot = np.clip(newthdot, -self.max_speed, self.max_speed) #pylint: disable=E1111
 
         self.state = np.array([newth[0], newthdot[0]])
@@ -83,7 +84,7 @@ class PendulumEnv():
             self.cur_step += 1
         else:
             done = True
-        costs += np.random.normal(0,0.01)
+        costs += self.noise_rng.normal(0,0.01)
 
         return self._get_obs(), -costs, done, {}
 
@@ -134,5 +135,89 @@ class PendulumEnv():
 
         return self.viewer.render(return_rgb_array = mode=='rgb_array')
 
+class VectorPendulumEnv(PendulumEnv):
+    """num_envs independent pendulums stepped together as arrays.
+
+    Same dynamics, cost and noise as PendulumEnv. step takes [num_envs] or [num_envs, 1] torques
+    and returns ([num_envs, 3] obs, [num_envs] rewards, [num_envs] dones, {}). Each pendulum has
+    its own step counter and its own np.random.RandomState for the noise, so one instance's noise
+    stream does not depend on the others: seed(seeds) seeds all of them, and reset(indices, seeds)
+    restarts (and optionally reseeds) only the given ones.
+    """
+
+    def __init__(self, num_envs=1, seeds=None):
+        super(VectorPendulumEnv, self).__init__()
+        self.num_envs = num_envs
+        self.state = np.zeros((num_envs, 2))  # [theta, thetadot]
+        self.cur_step = np.zeros(num_envs, dtype=int)
+        self.last_u = None
+        self.seed(seeds)
+
+    def seed(self, seeds=None):
+        '''seeds is one seed per pendulum, a single seed from which num_envs per-pendulum seeds are drawn,
+        or None for fresh entropy; returns the per-pendulum seeds'''
+        if seeds is None:
+            seeds = [None] * self.num_envs
+        elif np.isscalar(seeds):
+            seeds = np.random.RandomState(seeds).randint(2**31, size=self.num_envs)
+        elif len(seeds) != self.num_envs:
+            raise ValueError('expected {} seeds, got {}'.format(self.num_envs, len(seeds)))
+        self.rngs = [np.random.RandomState(s) for s in seeds]
+        return list(seeds)
+
+    def dynamics(self, state, u, noise=None):
+        '''next [batch, 2] states for [batch] torques; noise is an optional [batch, 2] array (thetadot, theta)'''
+        g = 10.
+        m = 1.
+        l = 1.
+        dt = self.dt
+        th, thdot = state[:, 0], state[:, 1]
+        newthdot = thdot + (-3*g/(2*l) * np.sin(th + np.pi) + 3./(m*l**2)*u) * dt
+        if noise is not None:
+            newthdot = newthdot + noise[:, 0]
+        newth = th + newthdot*dt
+        if noise is not None:
+            newth = newth + noise[:, 1]
+        newthdot = np.clip(newthdot, -self.max_speed, self.max_speed)
+        return np.stack([newth, newthdot], axis=1)
+
+    def step(self, u):
+        u = np.clip(np.asarray(u, dtype=np.float64).reshape(self.num_envs), -self.max_torque, self.max_torque)
+        self.last_u = u
+        th, thdot = self.state[:, 0], self.state[:, 1]
+        noise = np.stack([rng.normal(loc=0, scale=0.01, size=3) for rng in self.rngs])
+        costs = angle_normalize(th)**2 + .1*thdot**2 + .001*(u**2) + noise[:, 2]
+
+        self.state = self.dynamics(self.state, u, noise)
+
+        done = self.cur_step > self.max_steps
+        self.cur_step[~done] += 1
+
+        return self._get_obs(), -costs, done, {}
+
+    def reset(self, indices=None, seeds=None):
+        '''reset all pendulums, or only the ones in indices, to hanging down, reseeding them with seeds (one per
+        index) if given; returns the [num_envs, 3] observation'''
+        indices = np.arange(self.num_envs) if indices is None else np.asarray(indices, dtype=int).reshape(-1)
+        if seeds is not None:
+            for i, seed in zip(indices, seeds):
+                self.rngs[i] = np.random.RandomState(seed)
+        self.state[indices] = [3.14159, -0.02816067]  # down
+        self.cur_step[indices] = 0
+        return self._get_obs()
+
+    def _get_obs(self):
+        theta, thetadot = self.state[:, 0], self.state[:, 1]
+        return np.stack([np.cos(theta), np.sin(theta), thetadot], axis=1)
+
+    def render(self, mode='human', close=False):
+        # renders pendulum 0 with the single-pendulum viewer
+        state, last_u = self.state, self.last_u
+        self.state, self.last_u = state[0], None if last_u is None else last_u[0]
+        try:
+            return super(VectorPendulumEnv, self).render(mode, close)
+        finally:
+            self.state, self.last_u = state, last_u
+
 def angle_normalize(x):
     return (((x+np.pi) % (2*np.pi)) - np.pi)
\ No newline at end of file
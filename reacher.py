@@ -8,6 +8,8 @@ import numpy as np
 from gym import utils
 from gym.envs.mujoco import mujoco_env
 
+from kinematics import ReacherKinematics
+
 
 class Reacher3DEnv(mujoco_env.MujocoEnv, utils.EzPickle):
     def __init__(self):
@@ -15,6 +17,7 @@ class Reacher3DEnv(mujoco_env.MujocoEnv, utils.EzPickle):
         utils.EzPickle.__init__(self)
         dir_path = os.path.dirname(os.path.realpath(__file__))
         self.goal = np.zeros(3)
+        self.kinematics = ReacherKinematics()
         mujoco_env.MujocoEnv.__init__(self, os.path.join(dir_path, 'assets/reacher3d.xml'), 2)
 
     def _step(self, a):
@@ -51,28 +54,4 @@ class Reacher3DEnv(mujoco_env.MujocoEnv, utils.EzPickle):
         ])
 
     def get_EE_pos(self, states):
-        theta1, theta2, theta3, theta4, theta5, theta6, theta7 = \
-            states[:, :1], states[:, 1:2], states[:, 2:3], states[:, 3:4], states[:, 4:5], states[:, 5:6], states[:, 6:]
-
-        rot_axis = np.concatenate([np.cos(theta2) * np.cos(theta1), np.cos(theta2) * np.sin(theta1), -np.sin(theta2)],
-                                  axis=1)
-        rot_perp_axis = np.concatenate([-np.sin(theta1), np.cos(theta1), np.zeros(theta1.shape)], axis=1)
-        cur_end = np.concatenate([
-            0.1 * np.cos(theta1) + 0.4 * np.cos(theta1) * np.cos(theta2),
-            0.1 * np.sin(theta1) + 0.4 * np.sin(theta1) * np.cos(theta2) - 0.188,
-            -0.4 * np.sin(theta2)
-        ], axis=1)
-
-        for length, hinge, roll in [(0.321, theta4, theta3), (0.16828, theta6, theta5)]:
-            perp_all_axis = np.cross(rot_axis, rot_perp_axis)
-            x = np.cos(hinge) * rot_axis
-            y = np.sin(hinge) * np.sin(roll) * rot_perp_axis
-            z = -np.sin(hinge) * np.cos(roll) * perp_all_axis
-            new_rot_axis = x + y + z
-            new_rot_perp_axis = np.cross(new_rot_axis, rot_axis)
-            new_rot_perp_axis[np.linalg.norm(new_rot_perp_axis, axis=1) < 1e-30] = \
-                rot_perp_axis[np.linalg.norm(new_rot_perp_axis, axis=1) < 1e-30]
-            new_rot_perp_axis /= np.linalg.norm(new_rot_perp_axis, axis=1, keepdims=True)
-            rot_axis, rot_perp_axis, cur_end = new_rot_axis, new_rot_perp_axis, cur_end + length * new_rot_axis
-
-        return cur_end
\ No newline at end of file
+        return self.kinematics.ee_pos(states).copy()
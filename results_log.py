@@ -0,0 +1,98 @@
+# append-only result logs: each row is written once, when it is produced, instead of np.savetxt
+# rewriting the whole history every episode
+import json
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b'RESULTS1'
+
+
+def _header(columns):
+    meta = json.dumps({'columns': list(columns), 'dtype': '<f8'}).encode()
+    meta += b' ' * (-(len(MAGIC) + 4 + len(meta)) % 8)  # rows start 8-byte aligned
+    return MAGIC + struct.pack('<I', len(meta)) + meta
+
+
+def read_results(path):
+    '''(columns, [rows, len(columns)] float64 array) of a binary log written by ResultsWriter'''
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a results log'.format(path))
+        meta_len, = struct.unpack('<I', f.read(4))
+        meta = json.loads(f.read(meta_len).decode())
+        rows = np.fromfile(f, dtype=meta['dtype'])
+    columns = meta['columns']
+    return columns, rows[:len(rows) - len(rows) % len(columns)].reshape(-1, len(columns))
+
+
+class ResultsWriter(object):
+    '''Appends float rows to <base>.f64 (binary: header, then float64 rows) and, with text=True,
+    to <base>.txt in the np.savetxt layout the plotting scripts read.
+
+    Rows are buffered in the OS and flushed + fsynced every sync_every rows and on close(), so the
+    cost per row stays constant however long the run gets. keep_rows=N reopens existing logs for a
+    resumed run, keeping their first N rows; keep_rows=0 starts fresh files.
+    '''
+
+    def __init__(self, path, columns, fmt='%.18e', text=True, sync_every=200, keep_rows=0):
+        base = os.path.splitext(path)[0]
+        self.bin_path = base + '.f64'
+        self.text_path = base + '.txt' if text else None
+        self.columns = list(columns)
+        self.fmt = ' '.join([fmt] * len(self.columns)) if fmt.count('%') == 1 else fmt
+        self.sync_every = sync_every
+        directory = os.path.dirname(self.bin_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        header = _header(self.columns)
+        if keep_rows and os.path.exists(self.bin_path):
+            _, kept = read_results(self.bin_path)
+            kept = kept[:keep_rows]
+        else:
+            kept = np.zeros((0, len(self.columns)))
+        self._bin = open(self.bin_path, 'wb')
+        self._bin.write(header)
+        self._bin.write(kept.astype('<f8').tobytes())
+        self._text = open(self.text_path, 'w') if self.text_path else None
+        if self._text:
+            self._text.writelines(self.fmt % tuple(row) + '\n' for row in kept)
+        self.rows = len(kept)
+        self._unsynced = 0
+        self.flush(sync=True)
+
+    def append(self, *row):
+        # item() also takes the size-1 arrays some envs return as rewards
+        row = [np.asarray(v, dtype=np.float64).item() for v in row]
+        self._bin.write(struct.pack('<%dd' % len(row), *row))
+        if self._text:
+            self._text.write(self.fmt % tuple(row) + '\n')
+        self.rows += 1
+        self._unsynced += 1
+        if self._unsynced >= self.sync_every:
+            self.flush(sync=True)
+
+    def flush(self, sync=False):
+        for f in (self._bin, self._text):
+            if f:
+                f.flush()
+                if sync:
+                    os.fsync(f.fileno())
+        if sync:
+            self._unsynced = 0
+
+    def close(self):
+        if self._bin.closed:
+            return
+        self.flush(sync=True)
+        self._bin.close()
+        if self._text:
+            self._text.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
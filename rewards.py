@@ -0,0 +1,189 @@
+# oracle reward kernels shared by the planners and baselines, keyed by env name
+import numpy as np
+
+from kinematics import ReacherKinematics
+
+
+class RewardFn(object):
+    """Batched oracle reward r(obs, act) -> [batch] in float64.
+
+    Kernels write into per-instance buffers that are only reallocated when the batch size
+    changes, so the returned array is overwritten by the next call: consume or copy it first.
+    Goal-conditioned kernels read their goal from the env in reset(), once per episode.
+    """
+
+    def __init__(self, env=None):
+        self.env = env
+        self.goal = None
+        self._bufs = {}
+
+    def reset(self):
+        pass
+
+    def _buf(self, name, shape):
+        buf = self._bufs.get(name)
+        if buf is None or buf.shape != shape:
+            buf = np.empty(shape)
+            self._bufs[name] = buf
+        return buf
+
+    def __call__(self, obs, act):
+        raise NotImplementedError
+
+    def tf(self, obs, act):
+        """Same reward as a tensorflow op, for in-graph rollouts."""
+        raise NotImplementedError
+
+    def fake_env_fn(self):
+        """reward_fn(obs, act, next_obs) -> [batch, 1] on the next state, as FakeEnv expects."""
+        return lambda obs, act, next_obs: self(next_obs, act)[:, None]
+
+
+class CartPoleReward(RewardFn):
+    # cos(theta) - 0.01 x^2 + 0.1 exp(-|theta|)
+    def __call__(self, obs, act):
+        n = obs.shape[0]
+        out, tmp = self._buf('out', (n,)), self._buf('tmp', (n,))
+        x, theta = obs[:, 0], obs[:, 2]
+        np.cos(theta, out=out)
+        np.abs(theta, out=tmp)
+        np.negative(tmp, out=tmp)
+        np.exp(tmp, out=tmp)
+        tmp *= 0.1
+        out += tmp
+        np.square(x, out=tmp)
+        tmp *= 0.01
+        out -= tmp
+        return out
+
+    def tf(self, obs, act):
+        import tensorflow as tf
+        x, theta = obs[:, 0], obs[:, 2]
+        return tf.cos(theta) - 0.01 * tf.square(x) + 0.1 * tf.exp(-tf.abs(theta))
+
+
+class CartPoleSurvivalReward(RewardFn):
+    # 1 for every step, the true env reward; pair with a termination_fn
+    def __call__(self, obs, act):
+        out = self._buf('out', (obs.shape[0],))
+        out.fill(1.)
+        return out
+
+    def tf(self, obs, act):
+        import tensorflow as tf
+        return tf.ones_like(obs[:, 0])
+
+
+class PendulumReward(RewardFn):
+    # -(theta^2 + 0.1 thetadot^2 + 0.001 u^2), obs = [cos(theta), sin(theta), thetadot]
+    def __call__(self, obs, act):
+        n = obs.shape[0]
+        out, tmp = self._buf('out', (n,)), self._buf('tmp', (n,))
+        # arctan2 already lies in [-pi, pi], so no angle normalization is needed
+        np.arctan2(obs[:, 1], obs[:, 0], out=out)
+        np.square(out, out=out)
+        np.square(obs[:, 2], out=tmp)
+        tmp *= 0.1
+        out += tmp
+        np.square(np.reshape(act, (n, -1))[:, 0], out=tmp)
+        tmp *= 0.001
+        out += tmp
+        np.negative(out, out=out)
+        return out
+
+    def tf(self, obs, act):
+        import tensorflow as tf
+        theta = tf.atan2(obs[:, 1], obs[:, 0])
+        return -(tf.square(theta) + 0.1 * tf.square(obs[:, 2]) + 0.001 * tf.square(act[:, 0]))
+
+
+class PusherReward(RewardFn):
+    # -(0.5 |tip - obj|_1 + 1.25 |goal - obj|_1 + 0.1 |u|^2)
+    def reset(self):
+        self.goal = np.asarray(self.env.ac_goal_pos, dtype=np.float64).reshape(1, 3)
+
+    def __call__(self, obs, act):
+        if self.goal is None:
+            self.reset()
+        n = obs.shape[0]
+        out, tmp = self._buf('out', (n,)), self._buf('tmp', (n,))
+        tmp3, tmpa = self._buf('tmp3', (n, 3)), self._buf('tmpa', act.shape)
+        tip_pos, obj_pos = obs[:, 14:17], obs[:, 17:20]
+        np.subtract(tip_pos, obj_pos, out=tmp3)
+        np.abs(tmp3, out=tmp3)
+        tmp3.sum(axis=1, out=out)
+        out *= 0.5
+        np.subtract(self.goal, obj_pos, out=tmp3)
+        np.abs(tmp3, out=tmp3)
+        tmp3.sum(axis=1, out=tmp)
+        tmp *= 1.25
+        out += tmp
+        np.square(act, out=tmpa)
+        tmpa.sum(axis=1, out=tmp)
+        tmp *= 0.1
+        out += tmp
+        np.negative(out, out=out)
+        return out
+
+    def tf(self, obs, act):
+        import tensorflow as tf
+        if self.goal is None:
+            self.reset()
+        tip_pos, obj_pos = obs[:, 14:17], obs[:, 17:20]
+        goal = tf.constant(self.goal, dtype=obs.dtype)
+        return -(0.5 * tf.reduce_sum(tf.abs(tip_pos - obj_pos), axis=1) +
+                 1.25 * tf.reduce_sum(tf.abs(goal - obj_pos), axis=1) +
+                 0.1 * tf.reduce_sum(tf.square(act), axis=1))
+
+
+class ReacherReward(RewardFn):
+    # -(|ee(obs) - goal|^2 + 0.01 |u|^2)
+    def __init__(self, env=None):
+        super(ReacherReward, self).__init__(env)
+        self.kinematics = ReacherKinematics()
+
+    def reset(self):
+        self.goal = np.asarray(self.env.goal, dtype=np.float64).reshape(1, 3)
+
+    def __call__(self, obs, act):
+        if self.goal is None:
+            self.reset()
+        n = obs.shape[0]
+        out, tmp = self._buf('out', (n,)), self._buf('tmp', (n,))
+        tmpa = self._buf('tmpa', act.shape)
+        dis = self.kinematics.ee_pos(obs)
+        dis -= self.goal
+        np.square(dis, out=dis)
+        dis.sum(axis=1, out=out)
+        np.square(act, out=tmpa)
+        tmpa.sum(axis=1, out=tmp)
+        tmp *= 0.01
+        out += tmp
+        np.negative(out, out=out)
+        return out
+
+    def tf(self, obs, act):
+        import tensorflow as tf
+        if self.goal is None:
+            self.reset()
+        goal = tf.constant(self.goal, dtype=obs.dtype)
+        return -(tf.reduce_sum(tf.square(ReacherKinematics.tf(obs) - goal), axis=1) +
+                 0.01 * tf.reduce_sum(tf.square(act), axis=1))
+
+
+REWARDS = {
+    'CartPole-continuous': CartPoleReward,
+    'CartPole-survival': CartPoleSurvivalReward,
+    'Pendulum-v0': PendulumReward,
+    'Pusher': PusherReward,
+    'Reacher': ReacherReward,
+}
+# short names used by the baselines
+REWARDS['cartpole'] = REWARDS['CartPole-continuous']
+REWARDS['pendulum'] = REWARDS['Pendulum-v0']
+
+
+def make_reward(env_name, env=None):
+    """Returns the oracle reward kernel registered for env_name, or None if there is none."""
+    cls = REWARDS.get(env_name)
+    return None if cls is None else cls(env)
@@ -0,0 +1,174 @@
+# Actor-learner PSRL: --num-workers processes run episodes with CEM on their own sample of the latest
+# posterior and stream transitions through shared memory; this process is the learner, which owns the
+# BNN/BLR training and publishes a new snapshot after every --train-every finished episodes.
+#
+# Usage:
+#   python run_actor_learner.py --env CartPole-continuous --with-reward True --num-workers 4
+#   python run_actor_learner.py --env Pendulum-v0 --with-reward False --num-workers 4 --num-episodes 30
+import argparse
+import multiprocessing as mp
+import os
+import queue
+import time
+
+import numpy as np
+import torch
+
+from actor_learner import TransitionRing, make_env, run_worker, snapshot_path
+from results_log import ResultsWriter
+from run_experiments import THREAD_VARS
+from NB_dx_tf import neural_bays_dx_tf
+from tf_models.constructor import construct_shallow_model, construct_shallow_cost_model
+
+os.environ["CUDA_VISIBLE_DEVICES"] = "0"
+
+# per-env defaults of run_cartpole.py / run_pendulum.py
+ENV_DEFAULTS = {
+    'CartPole-continuous': {'sigma': 1e-2, 'num_trajs': 500, 'num_elites': 50, 'alpha': 0.1, 'var': 1.0,
+                            'training_iter_cost': 100, 'cost_hidden_dim': 10, 'log_name': 'cartpole'},
+    'Pendulum-v0': {'sigma': 1e1, 'num_trajs': 100, 'num_elites': 5, 'alpha': 0., 'var': 3.0,
+                    'training_iter_cost': 150, 'cost_hidden_dim': 200, 'log_name': 'pendulum'},
+}
+
+
+if __name__ == '__main__':
+    os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
+    parser = argparse.ArgumentParser(description=None)
+    parser.add_argument('--env', default='CartPole-continuous', metavar='ENV',
+                        help='env :[Pendulum-v0, CartPole-continuous]')
+    parser.add_argument('--with-reward', type=lambda x: x.lower() == 'true', default=False, metavar='NS',
+                        help='predict with true rewards or not')
+    parser.add_argument('--seed', type=int, default=0, metavar='S', help='random seed for reproducibility')
+    parser.add_argument('--num-workers', type=int, default=4, metavar='N', help='data-collection processes')
+    parser.add_argument('--worker-threads', type=int, default=1, metavar='N', help='BLAS/torch threads per worker')
+    parser.add_argument('--num-episodes', type=int, default=15, metavar='N',
+                        help='episodes to collect, over all workers')
+    parser.add_argument('--episode-length', type=int, default=200, metavar='N')
+    parser.add_argument('--train-every', type=int, default=None, metavar='N',
+                        help='finished episodes between model updates (default: --num-workers)')
+    parser.add_argument('--ring-episodes', type=int, default=10, metavar='N',
+                        help='episodes of transitions each worker ring holds before unread rows are lost')
+    parser.add_argument('--snapshot-dir', default='snapshots', metavar='DIR',
+                        help='directory of the model snapshots the learner publishes to the workers')
+    parser.add_argument('--sigma', type=float, default=None, metavar='T', help='var for betas')
+    parser.add_argument('--sigma_n', type=float, default=1e-3, metavar='T', help='var for noise')
+    parser.add_argument('--training-iter-dx', type=int, default=100, metavar='NS')
+    parser.add_argument('--training-iter-cost', type=int, default=None, metavar='NS')
+    # CEM parameters
+    parser.add_argument('--num-trajs', type=int, default=None, metavar='NS',
+                        help='number of sampling from params distribution')
+    parser.add_argument('--num-elites', type=int, default=None, metavar='NS', help='number of choosing best params')
+    parser.add_argument('--alpha', type=float, default=None, metavar='T',
+                        help='Controls how much of the previous mean and variance is used for the next iteration.')
+    parser.add_argument('--plan-hor', type=int, default=30, metavar='NS', help='number of choosing best params')
+    parser.add_argument('--max-iters', type=int, default=5, metavar='NS', help='iteration of cem')
+    parser.add_argument('--epsilon', type=float, default=0.001, metavar='NS', help='threshold for cem iteration')
+    parser.add_argument('--var', type=float, default=None, metavar='T', help='var')
+    args = parser.parse_args()
+    defaults = ENV_DEFAULTS[args.env]
+    for key in ['sigma', 'num_trajs', 'num_elites', 'alpha', 'var', 'training_iter_cost']:
+        if getattr(args, key) is None:
+            setattr(args, key, defaults[key])
+    train_every = args.train_every or args.num_workers
+
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    env = make_env(args.env, args.seed)
+    obs_shape = env.observation_space.shape[0]
+    action_shape = env.action_space.shape[0]
+
+    # the learner owns the models; workers only get snapshots
+    dx_model = construct_shallow_model(obs_dim=obs_shape, act_dim=action_shape, hidden_dim=200, num_networks=1, num_elites=1)
+    my_dx = neural_bays_dx_tf(args, dx_model, "dx", obs_shape, sigma2=args.sigma**2, sigma_n2=args.sigma_n**2)
+    if not args.with_reward:
+        cost_model = construct_shallow_cost_model(obs_dim=obs_shape, act_dim=action_shape,
+                                                  hidden_dim=defaults['cost_hidden_dim'], num_networks=1, num_elites=1)
+        my_cost = neural_bays_dx_tf(args, cost_model, "cost", 1, sigma2=args.sigma**2, sigma_n2=args.sigma_n**2)
+    os.makedirs(args.snapshot_dir, exist_ok=True)
+
+    # spawn: the workers must not inherit the learner's TensorFlow session
+    ctx = mp.get_context('spawn')
+    rings = [TransitionRing(args.ring_episodes * args.episode_length, obs_shape, action_shape, ctx)
+             for _ in range(args.num_workers)]
+    param_version = ctx.Value('i', 0)
+    episode_queue = ctx.Queue()
+    stop = ctx.Event()
+    saved_env = {var: os.environ.get(var) for var in THREAD_VARS}
+    os.environ.update({var: str(args.worker_threads) for var in THREAD_VARS})
+    workers = [ctx.Process(target=run_worker, args=(w, args, rings[w], param_version, args.snapshot_dir,
+                                                     episode_queue, stop), daemon=True)
+               for w in range(args.num_workers)]
+    for p in workers:
+        p.start()
+    for var, value in saved_env.items():
+        if value is None:
+            os.environ.pop(var)
+        else:
+            os.environ[var] = value
+
+    oracle_suffix = '_with_oracle' if args.with_reward else '_without_oracle'
+    episode_log = ResultsWriter(os.path.join('seeds_data', defaults['log_name'] + '_actor_learner_log' + oracle_suffix +
+                                             '_seed' + str(args.seed) + '.txt'),
+                                ['episode', 'worker', 'param_version', 'reward'])
+    episodes, pending = 0, 0
+    start = time.time()
+    try:
+        while episodes < args.num_episodes:
+            try:
+                finished = [episode_queue.get(timeout=1.0)]
+            except queue.Empty:
+                finished = []
+            while True:
+                try:
+                    finished.append(episode_queue.get_nowait())
+                except queue.Empty:
+                    break
+            # an episode is reported after all its transitions are in the ring
+            for ring in rings:
+                states, actions, rewards, next_states = ring.read()
+                if len(states) == 0:
+                    continue
+                xu = np.concatenate((states, actions), axis=1)
+                my_dx.add_data(new_x=xu, new_y=next_states - states)
+                if not args.with_reward:
+                    my_cost.add_data(new_x=xu, new_y=rewards)
+            for worker_id, version, reward, _ in finished[:args.num_episodes - episodes]:
+                print(episodes, ': worker', worker_id, 'model version', version, 'cumulative rewards', round(reward, 2))
+                episode_log.append(episodes, worker_id, version, reward)
+                episodes += 1
+                pending += 1
+
+            if pending >= train_every and episodes < args.num_episodes:
+                pending = 0
+                train_start = time.time()
+                my_dx.train(epochs=args.training_iter_dx)
+                my_dx.update_bays_reg()
+                if not args.with_reward:
+                    my_cost.train(epochs=args.training_iter_cost)
+                    my_cost.update_bays_reg()
+                # publish: write the snapshot files, then the version the workers poll
+                version = param_version.value + 1
+                my_dx.save(args.snapshot_dir, version)
+                if not args.with_reward:
+                    my_cost.save(args.snapshot_dir, version)
+                param_version.value = version
+                for name in ['BNN', 'BNN_cost']:
+                    old = snapshot_path(args.snapshot_dir, name, version - 2)
+                    if os.path.exists(old):
+                        os.remove(old)
+                print('model version {} trained on {} transitions in {:.1f}s'.format(
+                    version, len(my_dx.train_x), time.time() - train_start))
+    finally:
+        stop.set()
+        for p in workers:
+            p.join(timeout=30)
+            if p.is_alive():
+                p.terminate()
+        episode_log.close()
+        dropped = sum(ring.dropped for ring in rings)
+        for ring in rings:
+            ring.close()
+
+    if dropped:
+        print('{} transitions were lost to full rings; raise --ring-episodes'.format(dropped))
+    print("\n{} episodes from {} workers in {:.1f}s".format(episodes, args.num_workers, time.time() - start))
@@ -0,0 +1,149 @@
+# Experiment runner: expands an env x method x oracle x seed grid and runs it on a pool of worker
+# processes, replacing the per-platform .ps1/.bat seed scripts.
+#
+# Usage:
+#   python run_experiments.py --envs cartpole pendulum --methods psrl pets mbpo --seeds 0 1 2 3 4
+#   python run_experiments.py --methods psrl --oracles with --num-episodes 2 --dry-run True
+#   python run_experiments.py --out-dir runs/sweep1 --resume True      # rerun only failed/missing runs
+#   python run_experiments.py --methods psrl -- --plan-budget-ms 50    # extra args after -- go to every run
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+SCRIPTS = {
+    ('psrl', 'cartpole'): 'run_cartpole.py',
+    ('psrl', 'pendulum'): 'run_pendulum.py',
+    ('pets', 'cartpole'): os.path.join('baselines', 'pets', 'run_pets_cartpole.py'),
+    ('pets', 'pendulum'): os.path.join('baselines', 'pets', 'run_pets_pendulum.py'),
+    ('mbpo', 'cartpole'): os.path.join('baselines', 'mbpo', 'run_mbpo_cartpole.py'),
+    ('mbpo', 'pendulum'): os.path.join('baselines', 'mbpo', 'run_mbpo_pendulum.py'),
+}
+
+# thread-count variables read by numpy's BLAS, torch and tensorflow
+THREAD_VARS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS',
+               'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS']
+
+
+def expand_grid(args):
+    '''one run dict per grid point; PETS and MBPO always plan with the oracle reward, so they ignore --oracles'''
+    runs = []
+    for env, method, seed in itertools.product(args.envs, args.methods, args.seeds):
+        oracles = args.oracles if method == 'psrl' else ['with']
+        for oracle in oracles:
+            name = '{}_{}_{}_oracle_seed{}'.format(method, env, oracle, seed)
+            cmd = [sys.executable, SCRIPTS[(method, env)], '--seed', str(seed), '--num-episodes', str(args.num_episodes)]
+            if method == 'psrl':
+                # the PSRL drivers write to seeds_data/ under the working directory
+                cmd += ['--with-reward', str(oracle == 'with')]
+                outputs = [os.path.join(ROOT, 'seeds_data', '{}_log_{}_oracle_seed{}.txt'.format(env, oracle, seed))]
+            else:
+                cmd += ['--output-dir', args.out_dir]
+                outputs = [os.path.join(args.out_dir, '{}_{}_log_seed{}.txt'.format(method, env, seed))]
+            runs.append({'name': name, 'env': env, 'method': method, 'oracle': oracle, 'seed': seed,
+                         'cmd': cmd + args.extra, 'outputs': outputs,
+                         'log': os.path.join(args.out_dir, 'logs', name + '.log')})
+    return runs
+
+
+def execute(run, threads, retries, timeout):
+    env = dict(os.environ)
+    for var in THREAD_VARS:
+        env[var] = str(threads)
+    env['PYTHONUNBUFFERED'] = '1'
+    start = time.time()
+    returncode = None
+    for attempt in range(1, retries + 2):
+        with open(run['log'], 'a') as log:
+            log.write('### attempt {} at {}: {}\n'.format(attempt, datetime.now().isoformat(), ' '.join(run['cmd'])))
+            log.flush()
+            try:
+                returncode = subprocess.call(run['cmd'], cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+                                             timeout=timeout)
+            except subprocess.TimeoutExpired:
+                log.write('### timed out after {} s\n'.format(timeout))
+                returncode = 'timeout'
+        if returncode == 0:
+            break
+    record = dict(run, returncode=returncode, attempts=attempt, elapsed_s=round(time.time() - start, 1),
+                  status='ok' if returncode == 0 else 'failed',
+                  outputs=[p for p in run['outputs'] if os.path.exists(p) and os.path.getmtime(p) >= start])
+    return record
+
+
+def write_manifest(path, records):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(sorted(records.values(), key=lambda r: r['name']), f, indent=2)
+    os.replace(tmp, path)
+
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    extra = argv[argv.index('--') + 1:] if '--' in argv else []
+    argv = argv[:argv.index('--')] if '--' in argv else argv
+
+    parser = argparse.ArgumentParser(description='run an experiment grid on a process pool')
+    parser.add_argument('--envs', nargs='+', default=['cartpole', 'pendulum'], choices=['cartpole', 'pendulum'])
+    parser.add_argument('--methods', nargs='+', default=['psrl'], choices=['psrl', 'pets', 'mbpo'])
+    parser.add_argument('--oracles', nargs='+', default=['with', 'without'], choices=['with', 'without'],
+                        help='PSRL with or without the oracle reward')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0, 1, 2, 3, 4])
+    parser.add_argument('--num-episodes', type=int, default=15)
+    parser.add_argument('--threads-per-run', type=int, default=1, help='BLAS/torch/TF threads per run')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='concurrent runs (default: available cores / threads per run)')
+    parser.add_argument('--retries', type=int, default=1, help='extra attempts for a failed run')
+    parser.add_argument('--timeout', type=float, default=None, help='per-attempt time limit in seconds')
+    parser.add_argument('--out-dir', default=None, help='logs, baseline results and manifest (default runs/<time>)')
+    parser.add_argument('--resume', type=lambda x: x.lower() == 'true', default=False,
+                        help='skip runs the manifest in --out-dir already records as ok')
+    parser.add_argument('--dry-run', type=lambda x: x.lower() == 'true', default=False)
+    args = parser.parse_args(argv)
+    args.extra = extra
+
+    if args.out_dir is None:
+        args.out_dir = os.path.join('runs', datetime.now().strftime('%Y%m%d_%H%M%S'))
+    args.out_dir = os.path.abspath(args.out_dir)
+    os.makedirs(os.path.join(args.out_dir, 'logs'), exist_ok=True)
+    manifest = os.path.join(args.out_dir, 'manifest.json')
+
+    runs = expand_grid(args)
+    records = {}
+    if args.resume and os.path.exists(manifest):
+        with open(manifest) as f:
+            records = {r['name']: r for r in json.load(f)}
+        runs = [r for r in runs if records.get(r['name'], {}).get('status') != 'ok']
+
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    workers = args.workers or max(1, cores // args.threads_per_run)
+    print('{} runs, {} workers x {} threads, output in {}'.format(len(runs), workers, args.threads_per_run, args.out_dir))
+    if args.dry_run:
+        for run in runs:
+            print(run['name'] + ': ' + ' '.join(run['cmd']))
+        sys.exit(0)
+
+    lock = threading.Lock()
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # each worker thread only waits on its run's subprocess, so runs execute as separate processes
+        futures = {pool.submit(execute, run, args.threads_per_run, args.retries, args.timeout): run for run in runs}
+        for i, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            with lock:
+                records[record['name']] = record
+                write_manifest(manifest, records)
+            print('[{}/{}] {} {} after {} attempt(s), {:.0f} s'.format(
+                i, len(runs), record['name'], record['status'], record['attempts'], record['elapsed_s']))
+
+    failed = [r['name'] for r in records.values() if r['status'] != 'ok']
+    print('done in {:.0f} s, {} failed{}'.format(time.time() - start, len(failed), ': ' + ', '.join(failed) if failed else ''))
+    sys.exit(1 if failed else 0)
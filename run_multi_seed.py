@@ -0,0 +1,188 @@
+# Runs several seeds of PSRL in one process: seed s is ensemble member s of a single BNN, with its
+# own dataset and BLR posterior, and the planning of all seeds is batched through the same graph.
+#
+# Usage:
+#   python run_multi_seed.py --env CartPole-continuous --with-reward True --seeds 0 1 2 3 4
+#   python run_multi_seed.py --env Pendulum-v0 --with-reward False --seeds 0 1 2 3 4
+import argparse
+import os
+
+import numpy as np
+import torch
+
+from cartpole_continuous import ContinuousCartPoleEnv
+from checkpoint import save_checkpoint, load_checkpoint, rng_state, set_rng_state
+from results_log import ResultsWriter
+from pendulum_gym import PendulumEnv
+from NB_dx_tf import multi_seed_bays_dx_tf
+from tf_models.constructor import construct_shallow_model, construct_shallow_cost_model
+
+os.environ["CUDA_VISIBLE_DEVICES"] = "0"
+
+# per-env defaults of run_cartpole.py / run_pendulum.py
+ENV_DEFAULTS = {
+    'CartPole-continuous': {'sigma': 1e-2, 'num_trajs': 500, 'num_elites': 50, 'alpha': 0.1, 'var': 1.0,
+                            'training_iter_cost': 100, 'cost_hidden_dim': 10, 'log_name': 'cartpole'},
+    'Pendulum-v0': {'sigma': 1e1, 'num_trajs': 100, 'num_elites': 5, 'alpha': 0., 'var': 3.0,
+                    'training_iter_cost': 150, 'cost_hidden_dim': 200, 'log_name': 'pendulum'},
+}
+
+
+def make_env(env_name, seed):
+    if 'CartPole-continuous' in env_name:
+        env = ContinuousCartPoleEnv()
+        env.seed(seed)
+    else:
+        env = PendulumEnv()
+        env._seed(seed)
+    return env
+
+
+if __name__ == '__main__':
+    os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
+    parser = argparse.ArgumentParser(description=None)
+    parser.add_argument('--env', default='CartPole-continuous', metavar='ENV',
+                        help='env :[Pendulum-v0, CartPole-continuous]')
+    parser.add_argument('--with-reward', type=lambda x: x.lower() == 'true', default=False, metavar='NS',
+                        help='predict with true rewards or not')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0, 1, 2, 3, 4], help='seeds run as ensemble members')
+    parser.add_argument('--num-episodes', type=int, default=15, metavar='N', help='number of episodes to run')
+    parser.add_argument('--sigma', type=float, default=None, metavar='T', help='var for betas')
+    parser.add_argument('--sigma_n', type=float, default=1e-3, metavar='T', help='var for noise')
+    parser.add_argument('--training-iter-dx', type=int, default=100, metavar='NS')
+    parser.add_argument('--training-iter-cost', type=int, default=None, metavar='NS')
+    # CEM parameters
+    parser.add_argument('--num-trajs', type=int, default=None, metavar='NS',
+                        help='number of sampling from params distribution')
+    parser.add_argument('--num-elites', type=int, default=None, metavar='NS', help='number of choosing best params')
+    parser.add_argument('--alpha', type=float, default=None, metavar='T',
+                        help='Controls how much of the previous mean and variance is used for the next iteration.')
+    parser.add_argument('--plan-hor', type=int, default=30, metavar='NS', help='number of choosing best params')
+    parser.add_argument('--max-iters', type=int, default=5, metavar='NS', help='iteration of cem')
+    parser.add_argument('--epsilon', type=float, default=0.001, metavar='NS', help='threshold for cem iteration')
+    parser.add_argument('--var', type=float, default=None, metavar='T', help='var')
+    parser.add_argument('--resume', type=lambda x: x.lower() == 'true', default=False, metavar='NS',
+                        help='continue from the last episode checkpoint in --checkpoint-dir')
+    parser.add_argument('--checkpoint-dir', default='checkpoints', metavar='DIR',
+                        help='directory of the per-episode checkpoints')
+    args = parser.parse_args()
+    defaults = ENV_DEFAULTS[args.env]
+    for key in ['sigma', 'num_trajs', 'num_elites', 'alpha', 'var', 'training_iter_cost']:
+        if getattr(args, key) is None:
+            setattr(args, key, defaults[key])
+
+    np.random.seed(args.seeds[0])
+    torch.manual_seed(args.seeds[0])
+    num_seeds = len(args.seeds)
+    envs = [make_env(args.env, seed) for seed in args.seeds]
+    # everything random about seed s -- its env noise, exploration actions, member's bootstrap and shuffles,
+    # BLR samples, model noise and CEM candidates -- comes from rngs[s], and its member's input scaler is fit
+    # on its own data only, so a seed's draws do not depend on which seeds run beside it
+    rngs = [np.random.RandomState(seed) for seed in args.seeds]
+    for e, rng in zip(envs, rngs):
+        e.noise_rng = rng
+    env = envs[0]
+    print('env', env, 'seeds', args.seeds)
+
+    obs_shape = env.observation_space.shape[0]
+    action_shape = env.action_space.shape[0]
+    # one ensemble member per seed; every member is an elite
+    dx_model = construct_shallow_model(obs_dim=obs_shape, act_dim=action_shape, hidden_dim=200,
+                                       num_networks=num_seeds, num_elites=num_seeds, independent_members=True)
+    my_dx = multi_seed_bays_dx_tf(args, dx_model, "dx", obs_shape, sigma2=args.sigma**2, sigma_n2=args.sigma_n**2,
+                                  rngs=rngs)
+    if args.with_reward:
+        from CEM_with import CEM
+        cem = CEM(env, args, my_dx, num_elites=args.num_elites, num_trajs=args.num_trajs, alpha=args.alpha)
+    else:
+        cost_model = construct_shallow_cost_model(obs_dim=obs_shape, act_dim=action_shape,
+                                                  hidden_dim=defaults['cost_hidden_dim'],
+                                                  num_networks=num_seeds, num_elites=num_seeds, independent_members=True)
+        my_cost = multi_seed_bays_dx_tf(args, cost_model, "cost", 1, sigma2=args.sigma**2, sigma_n2=args.sigma_n**2,
+                                        rngs=rngs)
+        from CEM_without import CEM
+        cem = CEM(env, args, my_dx, my_cost, num_elites=args.num_elites, num_trajs=args.num_trajs, alpha=args.alpha)
+
+    total_cumulative_reward = np.zeros(num_seeds)
+    total_timesteps = 0
+    oracle_suffix = '_with_oracle' if args.with_reward else '_without_oracle'
+    ckpt_path = os.path.join(args.checkpoint_dir, 'multi_seed_' + defaults['log_name'] + oracle_suffix + '_seeds' +
+                             '_'.join(str(seed) for seed in args.seeds) + '.ckpt')
+    start_episode = 0
+    ckpt = load_checkpoint(ckpt_path) if args.resume else None
+    if ckpt is not None:
+        my_dx.load_state_dict(ckpt['dx'])
+        if not args.with_reward:
+            my_cost.load_state_dict(ckpt['cost'])
+        cem.load_state_dict(ckpt['cem'])
+        set_rng_state(ckpt['rng'])
+        for rng, state in zip(rngs, ckpt['seed_rngs']):
+            rng.set_state(state)
+        for e, env_rng in zip(envs, ckpt['env_rngs']):
+            e.np_random = env_rng
+        total_cumulative_reward, total_timesteps = ckpt['total_cumulative_reward'], ckpt['total_timesteps']
+        start_episode = ckpt['episode'] + 1
+        print('resuming from', ckpt_path, 'at episode', start_episode)
+    # same layout as the run_cartpole.py / run_pendulum.py logs of each seed, but with a _multi_seed suffix
+    # so that a multi-seed run never overwrites a single-seed run; appended as rows are produced
+    log_rows = ckpt['log_rows'] if ckpt is not None else {}
+    prefix = os.path.join('seeds_data', defaults['log_name'])
+    suffix = oracle_suffix + '_multi_seed'
+    episode_logs = [ResultsWriter(prefix + '_log' + suffix + '_seed' + str(seed) + '.txt', ['episode', 'reward'],
+                                  keep_rows=log_rows.get('episode', 0)) for seed in args.seeds]
+    timestep_logs = [ResultsWriter(prefix + '_timestep_rewards' + suffix + '_seed' + str(seed) + '.txt',
+                                   ['timestep', 'cumulative_reward'], keep_rows=log_rows.get('timestep', 0))
+                     for seed in args.seeds]
+    for episode in range(start_episode, args.num_episodes):
+        states = np.stack([np.asarray(e.reset(), dtype=np.float64).ravel() for e in envs])
+        cem.reset()
+        my_dx.sample()
+        if not args.with_reward:
+            my_cost.sample()
+        cum_reward = np.zeros(num_seeds)
+        for _ in range(200):
+            if episode == 0:
+                actions = np.stack([rng.uniform(e.action_space.low, e.action_space.high) for rng, e in zip(rngs, envs)])
+            else:
+                # one batched plan for all seeds, instance s through ensemble member s
+                actions = cem.hori_planning_batch(states, rngs)
+
+            new_states = np.zeros_like(states)
+            for s, e in enumerate(envs):
+                a = actions[s]
+                new_state, r, done, _ = e.step(a[0] if 'CartPole-continuous' in args.env else a)
+                new_states[s] = np.asarray(new_state, dtype=np.float64).ravel()
+                r = float(np.asarray(r).ravel()[0])
+                xu = np.concatenate((states[s], a))
+                my_dx.add_data(s, new_x=xu, new_y=new_states[s] - states[s])
+                if not args.with_reward:
+                    my_cost.add_data(s, new_x=xu, new_y=r)
+                cum_reward[s] += r
+                total_cumulative_reward[s] += r
+            total_timesteps += 1
+            for s in range(num_seeds):
+                timestep_logs[s].append(total_timesteps, total_cumulative_reward[s])
+            states = new_states
+
+        print(episode, ': cumulative rewards', dict(zip(args.seeds, np.round(cum_reward, 2))))
+        my_dx.train(epochs=args.training_iter_dx)
+        my_dx.update_bays_reg()
+        if not args.with_reward:
+            my_cost.train(epochs=args.training_iter_cost)
+            my_cost.update_bays_reg()
+
+        for s in range(num_seeds):
+            episode_logs[s].append(episode, cum_reward[s])
+        for log in episode_logs + timestep_logs:
+            log.flush(sync=True)
+        save_checkpoint(ckpt_path, {
+            'episode': episode, 'dx': my_dx.state_dict(), 'cost': None if args.with_reward else my_cost.state_dict(),
+            'cem': cem.state_dict(), 'rng': rng_state(), 'env_rngs': [e.np_random for e in envs],
+            'seed_rngs': [rng.get_state() for rng in rngs],
+            'log_rows': {'episode': episode_logs[0].rows, 'timestep': timestep_logs[0].rows},
+            'total_cumulative_reward': total_cumulative_reward, 'total_timesteps': total_timesteps})
+    for log in episode_logs + timestep_logs:
+        log.close()
+
+    print("\nTotal timesteps per seed: {}, Final cumulative rewards: {}".format(
+        total_timesteps, dict(zip(args.seeds, np.round(total_cumulative_reward, 2)))))
@@ -10,6 +10,13 @@ import torch
 from CEM_without import CEM
 import scipy.stats as stats
 from NB_dx_tf import neural_bays_dx_tf
+from async_mpc import AsyncPlanner
+from async_train import BackgroundTrainer
+from distill import DistilledPlanner
+from terminal_value import TerminalValue
+from oracle_model import OracleModel
+from checkpoint import save_checkpoint, load_checkpoint, rng_state, set_rng_state
+from results_log import ResultsWriter
 
 from tf_models.constructor import construct_shallow_model, construct_shallow_cost_model, construct_model, construct_cost_model
 
@@ -44,10 +51,53 @@ if __name__ == '__main__':
                         help='random seed for reproducibility')
     parser.add_argument('--training-iter-cost', type=int, default=150, metavar='NS')
     parser.add_argument('--var', type=float, default=3.0, metavar='T', help='var')
+    parser.add_argument('--plan-budget-ms', type=float, default=None, metavar='T',
+                        help='wall-clock planning budget per control step in ms (anytime CEM)')
+    parser.add_argument('--async-plan', type=lambda x: x.lower() == 'true', default=False, metavar='NS',
+                        help='plan for the predicted next state while the env steps')
+    parser.add_argument('--async-tol', type=float, default=0.05, metavar='T',
+                        help='max abs state error at which a speculative plan is accepted')
     parser.add_argument('--predict_with_bias', type=bool, default = True, metavar='NS',
                         help='predict y with bias')
+    parser.add_argument('--warm-start', default='zeros', metavar='WS',
+                        help='planner warm start at episode start: [zeros, mean, nearest]')
+    parser.add_argument('--oracle-model', type=lambda x: x.lower() == 'true', default=False, metavar='NS',
+                        help='plan with the true dynamics (and true reward) instead of the learned models')
+    parser.add_argument('--oracle-noise', type=lambda x: x.lower() == 'true', default=False, metavar='NS',
+                        help='add the env process noise to oracle model predictions')
 
+    parser.add_argument('--distill', type=lambda x: x.lower() == 'true', default=False, metavar='NS',
+                        help='train a policy to imitate CEM and act with it, replanning only when it is unsure')
+    parser.add_argument('--distill-epochs', type=int, default=50, metavar='NS',
+                        help='policy training epochs per episode on the recorded CEM actions')
+    parser.add_argument('--distill-check-hor', type=int, default=10, metavar='NS',
+                        help='horizon of the model rollouts comparing policy and CEM plan')
+    parser.add_argument('--distill-return-tol', type=float, default=0.05, metavar='T',
+                        help='replan when the policy return is this fraction below the CEM plan return')
+    parser.add_argument('--distill-std-tol', type=float, default=None, metavar='T',
+                        help='replan when the model predictive std at the policy action exceeds this')
+    parser.add_argument('--distill-min-data', type=int, default=400, metavar='NS',
+                        help='recorded CEM actions needed before the policy acts')
+    parser.add_argument('--distill-max-policy-steps', type=int, default=10, metavar='NS',
+                        help='policy actions in a row after which CEM replans anyway')
+    parser.add_argument('--terminal-value', type=lambda x: x.lower() == 'true', default=False, metavar='NS',
+                        help='add a learned value of the final state to every CEM candidate (allows a shorter --plan-hor)')
+    parser.add_argument('--value-updates', type=int, default=200, metavar='NS',
+                        help='actor-critic updates per episode for the terminal value')
+    parser.add_argument('--value-gamma', type=float, default=0.99, metavar='T', help='discount of the terminal value')
+    parser.add_argument('--async-train', type=lambda x: x.lower() == 'true', default=False, metavar='NS',
+                        help='train the models in the background during the next episode; episode k then plans with the '
+                             'posterior trained through episode k-2, one episode staler than the synchronous loop '
+                             '(results get an _async_train suffix)')
+    parser.add_argument('--resume', type=lambda x: x.lower() == 'true', default=False, metavar='NS',
+                        help='continue from the last episode checkpoint in --checkpoint-dir')
+    parser.add_argument('--checkpoint-dir', default='checkpoints', metavar='DIR',
+                        help='directory of the per-episode checkpoints')
     args = parser.parse_args()
+    if args.distill and args.async_plan:
+        parser.error('--distill and --async-plan cannot be combined')
+    if args.async_train and args.oracle_model:
+        parser.error('--async-train has nothing to train with --oracle-model')
     
     # Set random seeds for reproducibility
     np.random.seed(args.seed)
@@ -74,44 +124,118 @@ if __name__ == '__main__':
     obs_shape = env.observation_space.shape[0]
     action_shape = len([env.action_space.sample()])
 
-    dx_model = construct_shallow_model(obs_dim=obs_shape, act_dim=action_shape, hidden_dim=200, num_networks=1, num_elites=1)
-    if not args.with_reward:
-        cost_model = construct_shallow_cost_model(obs_dim=obs_shape, act_dim=action_shape, hidden_dim=200, num_networks=1, num_elites=1)
-
-    my_dx = neural_bays_dx_tf(args, dx_model, "dx", obs_shape, sigma_n2=args.sigma_n**2,sigma2=args.sigma**2)
-    if not args.with_reward:
-        my_cost = neural_bays_dx_tf(args, cost_model, "cost", 1, sigma_n2 = args.sigma_n**2,sigma2 = args.sigma**2)
+    if args.oracle_model:
+        # zero-model-error baseline: same planner, true dynamics
+        my_dx = OracleModel(args.env, "dx", noise=args.oracle_noise)
+        if not args.with_reward:
+            my_cost = OracleModel(args.env, "cost")
+    else:
+        dx_model = construct_shallow_model(obs_dim=obs_shape, act_dim=action_shape, hidden_dim=200, num_networks=1, num_elites=1)
+        if not args.with_reward:
+            cost_model = construct_shallow_cost_model(obs_dim=obs_shape, act_dim=action_shape, hidden_dim=200, num_networks=1, num_elites=1)
 
+        my_dx = neural_bays_dx_tf(args, dx_model, "dx", obs_shape, sigma_n2=args.sigma_n**2,sigma2=args.sigma**2)
+        if not args.with_reward:
+            my_cost = neural_bays_dx_tf(args, cost_model, "cost", 1, sigma_n2 = args.sigma_n**2,sigma2 = args.sigma**2)
 
 
     cum_rewards = []
-    cumulative_rewards_over_time = []  # Track cumulative rewards at each time step
     total_timesteps = 0
     total_cumulative_reward = 0.0
     
     num_episode = args.num_episodes
-    for episode in range(num_episode):
-        if args.with_reward:
-            from CEM_with import CEM
-            cem = CEM(env, args, my_dx, num_elites=args.num_elites, num_trajs=args.num_trajs, alpha=args.alpha)
-        else:
-            from CEM_without import CEM
-            cem = CEM(env, args, my_dx, my_cost, num_elites=args.num_elites, num_trajs=args.num_trajs, alpha=args.alpha)
+    # planner objects live for the whole run; reset() starts each episode
+    if args.with_reward:
+        from CEM_with import CEM
+        cem = CEM(env, args, my_dx, num_elites=args.num_elites, num_trajs=args.num_trajs, alpha=args.alpha)
+    else:
+        from CEM_without import CEM
+        cem = CEM(env, args, my_dx, my_cost, num_elites=args.num_elites, num_trajs=args.num_trajs, alpha=args.alpha)
+    planner = AsyncPlanner(cem, tol=args.async_tol) if args.async_plan else None
+    distiller = DistilledPlanner(cem, obs_shape, action_shape, env.action_space.low, env.action_space.high,
+                                 check_hor=args.distill_check_hor, return_tol=args.distill_return_tol,
+                                 std_tol=args.distill_std_tol, min_data=args.distill_min_data,
+                                 max_policy_steps=args.distill_max_policy_steps) if args.distill else None
+    trainer = None
+    if args.async_train:
+        trainer = BackgroundTrainer(cem, [(my_dx, args.training_iter_dx)] if args.with_reward else
+                                    [(my_dx, args.training_iter_dx), (my_cost, args.training_iter_cost)])
+    value = None
+    if args.terminal_value:
+        value = TerminalValue(cem, obs_shape, action_shape, env.action_space.low, env.action_space.high, args.env,
+                              gamma=args.value_gamma)
+        cem.terminal_value = value
+    # descriptive run name including seed, shared by the logs and the checkpoint
+    oracle_suffix = '_with_oracle' if args.with_reward else '_without_oracle'
+    if args.oracle_model:
+        oracle_suffix += '_oracle_model'
+    if args.async_train:
+        # a different algorithm (one more episode of posterior lag), kept apart from synchronous results
+        oracle_suffix += '_async_train'
+    seed_suffix = '_seed' + str(args.seed)
+    ckpt_path = os.path.join(args.checkpoint_dir, 'pendulum' + oracle_suffix + seed_suffix + '.ckpt')
+    start_episode = 0
+    ckpt = load_checkpoint(ckpt_path) if args.resume else None
+    if ckpt is not None:
+        my_dx.load_state_dict(ckpt['dx'])
+        if not args.with_reward:
+            my_cost.load_state_dict(ckpt['cost'])
+        cem.load_state_dict(ckpt['cem'])
+        if distiller is not None:
+            distiller.load_state_dict(ckpt['distill'])
+        if value is not None:
+            value.load_state_dict(ckpt['value'])
+        set_rng_state(ckpt['rng'], env)
+        cum_rewards = ckpt['cum_rewards']
+        total_timesteps, total_cumulative_reward = ckpt['total_timesteps'], ckpt['total_cumulative_reward']
+        start_episode = ckpt['episode'] + 1
+        print('resuming from', ckpt_path, 'at episode', start_episode)
+        if trainer is not None:
+            trainer.resume()
+    # logs are appended as rows are produced; a resumed run keeps the rows up to its checkpoint
+    log_rows = ckpt['log_rows'] if ckpt is not None else {}
+    output_dir = 'seeds_data'
+    episode_log = ResultsWriter(os.path.join(output_dir, 'pendulum_log' + oracle_suffix + seed_suffix + '.txt'),
+                                ['episode', 'reward'], keep_rows=log_rows.get('episode', 0))
+    # cumulative reward at each time step
+    timestep_log = ResultsWriter(os.path.join(output_dir, 'pendulum_timestep_rewards' + oracle_suffix + seed_suffix + '.txt'),
+                                 ['timestep', 'cumulative_reward'], keep_rows=log_rows.get('timestep', 0))
+    plan_log = ResultsWriter(os.path.join(output_dir, 'pendulum_plan_ms' + oracle_suffix + seed_suffix + '.txt'),
+                             ['timestep', 'plan_ms'], text=False, keep_rows=log_rows.get('plan', 0))
+    for episode in range(start_episode, num_episode):
         state = torch.tensor(env.reset())
         if 'Pendulum-v0' in args.env:
             state = state.squeeze()
+        cem.reset(warm_start=args.warm_start, init_state=state)
         time_step = 0
         done = False
-        my_dx.sample()
-        if not args.with_reward:
-            my_cost.sample()
+        if trainer is not None:
+            trainer.sample()
+        else:
+            my_dx.sample()
+            if not args.with_reward:
+                my_cost.sample()
+        if value is not None and episode > 0:
+            # rollouts for the value go through this episode's posterior sample
+            value.update(episode, num_updates=args.value_updates)
         num_steps = 200
         cum_reward = 0
+        plan_latencies = []
         for _ in range(num_steps):
             if episode == 0:
                 best_action = env.action_space.sample()
             else:
-                best_action = cem.hori_planning(state)
+                if planner is not None:
+                    best_action = planner.act(state)
+                    plan_latencies.append(planner.wait_ms)
+                    # overlap planning for the predicted next state with env.step
+                    planner.speculate(state, best_action)
+                elif distiller is not None:
+                    best_action = distiller.act(state)
+                    plan_latencies.append(distiller.wait_ms)
+                else:
+                    best_action = cem.hori_planning(state)
+                    plan_latencies.append(cem.plan_info['elapsed_ms'])
 
             if 'Pendulum-v0' in args.env:
                 best_action = np.array([best_action])
@@ -127,35 +251,68 @@ if __name__ == '__main__':
                 r = r.squeeze(0)
 
             xu = torch.cat((state.double(), torch.tensor(best_action).double()))
-            my_dx.add_data(new_x=xu, new_y=new_state - state)
-            if not args.with_reward:
-                my_cost.add_data(new_x=xu, new_y=r)
+            if trainer is not None:
+                trainer.add_data(my_dx, new_x=xu, new_y=new_state - state)
+                if not args.with_reward:
+                    trainer.add_data(my_cost, new_x=xu, new_y=r)
+            else:
+                my_dx.add_data(new_x=xu, new_y=new_state - state)
+                if not args.with_reward:
+                    my_cost.add_data(new_x=xu, new_y=r)
+            if value is not None:
+                value.add_transition(state, best_action, r, new_state)
             cum_reward += r
             
             # Track cumulative reward at each time step
             total_timesteps += 1
             total_cumulative_reward += r.item()
-            cumulative_rewards_over_time.append([total_timesteps, total_cumulative_reward])
+            timestep_log.append(total_timesteps, total_cumulative_reward)
+            if episode > 0:
+                plan_log.append(total_timesteps, plan_latencies[-1])
 
             state = new_state
 
+        if planner is not None:
+            planner.drain()
+            print('speculative plans:', planner.stats)
+        if distiller is not None and episode > 0:
+            print('distilled policy actions:', distiller.stats)
         print(episode, ': cumulative rewards', cum_reward.item())
+        if plan_latencies:
+            print('planning latency ms: mean {:.1f}, max {:.1f}'.format(np.mean(plan_latencies), np.max(plan_latencies)))
 
         cum_rewards.append([episode, cum_reward.tolist()])
-        my_dx.train(args.training_iter_dx)
-        my_dx.update_bays_reg()
-        if not args.with_reward:
-            my_cost.train(args.training_iter_cost)
-            my_cost.update_bays_reg()
-        
-        # Save with descriptive filenames including seed
-        oracle_suffix = '_with_oracle' if args.with_reward else '_without_oracle'
-        seed_suffix = '_seed' + str(args.seed)
-        output_dir = 'seeds_data'
-        os.makedirs(output_dir, exist_ok=True)
+        if trainer is not None:
+            # the training started after the last episode ran alongside this one
+            trainer.finish_episode()
+            print('background training: {:.1f}s, waited {:.1f}s for it'.format(trainer.train_s, trainer.wait_s))
+        else:
+            my_dx.train(args.training_iter_dx)
+            my_dx.update_bays_reg()
+            if not args.with_reward:
+                my_cost.train(args.training_iter_cost)
+                my_cost.update_bays_reg()
+        if distiller is not None:
+            distiller.fit(epochs=args.distill_epochs)
         
-        np.savetxt(os.path.join(output_dir, 'pendulum_log' + oracle_suffix + seed_suffix + '.txt'), cum_rewards)
-        np.savetxt(os.path.join(output_dir, 'pendulum_timestep_rewards' + oracle_suffix + seed_suffix + '.txt'), cumulative_rewards_over_time)
+        episode_log.append(episode, cum_reward.item())
+        for log in (episode_log, timestep_log, plan_log):
+            log.flush(sync=True)
+        save_checkpoint(ckpt_path, {
+            'episode': episode, 'dx': my_dx.state_dict(), 'cost': None if args.with_reward else my_cost.state_dict(),
+            'cem': cem.state_dict(), 'distill': None if distiller is None else distiller.state_dict(),
+            'value': None if value is None else value.state_dict(),
+            'rng': rng_state(env), 'cum_rewards': cum_rewards,
+            'log_rows': {'episode': episode_log.rows, 'timestep': timestep_log.rows, 'plan': plan_log.rows},
+            'total_timesteps': total_timesteps, 'total_cumulative_reward': total_cumulative_reward})
+        if trainer is not None:
+            trainer.start()
 
+    for log in (episode_log, timestep_log, plan_log):
+        log.close()
+    if planner is not None:
+        planner.close()
+    if trainer is not None:
+        trainer.close()
     print(cum_rewards)
     print("\nTotal timesteps: {}, Final cumulative reward: {}".format(total_timesteps, total_cumulative_reward))
\ No newline at end of file
@@ -10,6 +10,8 @@ from pusher import PusherEnv
 from reacher import Reacher3DEnv
 import torch
 import scipy.stats as stats
+from checkpoint import save_checkpoint, load_checkpoint, rng_state, set_rng_state
+from results_log import ResultsWriter
 from NB_dx_tf import neural_bays_dx_tf
 from tf_models.constructor import construct_model, construct_cost_model
 from CEM_without import CEM
@@ -45,9 +47,15 @@ if __name__ == '__main__':
     parser.add_argument('--max-iters', type=int, default=5, metavar='NS', help='iteration of cem')
 
     parser.add_argument('--var', type=float, default=10.0, metavar='T', help='var')
+    parser.add_argument('--warm-start', default='zeros', metavar='WS',
+                        help='planner warm start at episode start: [zeros, mean, nearest]')
 
 
 
+    parser.add_argument('--resume', type=lambda x: x.lower() == 'true', default=False, metavar='NS',
+                        help='continue from the last episode checkpoint in --checkpoint-dir')
+    parser.add_argument('--checkpoint-dir', default='checkpoints', metavar='DIR',
+                        help='directory of the per-episode checkpoints')
     args = parser.parse_args()
     print("current dir:", os.getcwd())
     if 'CartPole-continuous' in args.env:
@@ -90,16 +98,32 @@ if __name__ == '__main__':
 
     cum_rewards = []
     num_episode = 30
-    for episode in range(num_episode):
-        if args.with_reward:
-            from CEM_with import CEM
-            cem = CEM(env, args, my_dx, num_elites=args.num_elites, num_trajs=args.num_trajs, alpha=args.alpha)
-        else:
-            from CEM_without import CEM
-            cem = CEM(env, args, my_dx, my_cost, num_elites=args.num_elites, num_trajs=args.num_trajs, alpha=args.alpha)
+    # planner objects live for the whole run; reset() starts each episode
+    if args.with_reward:
+        from CEM_with import CEM
+        cem = CEM(env, args, my_dx, num_elites=args.num_elites, num_trajs=args.num_trajs, alpha=args.alpha)
+    else:
+        from CEM_without import CEM
+        cem = CEM(env, args, my_dx, my_cost, num_elites=args.num_elites, num_trajs=args.num_trajs, alpha=args.alpha)
+    ckpt_path = os.path.join(args.checkpoint_dir, 'reacher.ckpt')
+    start_episode = 0
+    ckpt = load_checkpoint(ckpt_path) if args.resume else None
+    if ckpt is not None:
+        my_dx.load_state_dict(ckpt['dx'])
+        if not args.with_reward:
+            my_cost.load_state_dict(ckpt['cost'])
+        cem.load_state_dict(ckpt['cem'])
+        set_rng_state(ckpt['rng'], env)
+        cum_rewards = ckpt['cum_rewards']
+        start_episode = ckpt['episode'] + 1
+        print('resuming from', ckpt_path, 'at episode', start_episode)
+    episode_log = ResultsWriter('reacher_log.txt', ['episode', 'reward'],
+                                keep_rows=ckpt['log_rows'] if ckpt is not None else 0)
+    for episode in range(start_episode, num_episode):
         state = torch.tensor(env.reset())
         if 'Pendulum-v0' in args.env:
             state = state.squeeze()
+        cem.reset(warm_start=args.warm_start, init_state=state)
         time_step = 0
         done = False
         my_dx.sample()
@@ -142,7 +166,13 @@ if __name__ == '__main__':
         if not args.with_reward:
             my_cost.train(epochs=args.training_iter_cost)
             my_cost.update_bays_reg()
-        np.savetxt('reacher_log.txt', cum_rewards)
+        episode_log.append(episode, cum_reward.item())
+        episode_log.flush(sync=True)
+        save_checkpoint(ckpt_path, {
+            'episode': episode, 'dx': my_dx.state_dict(), 'cost': None if args.with_reward else my_cost.state_dict(),
+            'cem': cem.state_dict(), 'rng': rng_state(env), 'cum_rewards': cum_rewards,
+            'log_rows': episode_log.rows})
+    episode_log.close()
 
     print(cum_rewards)
 
@@ -0,0 +1,77 @@
+# learned terminal value for CEM: values the states reached at the end of the planning horizon
+import numpy as np
+import torch
+
+from baselines.mbpo.simple_mbpo import SimplifiedMBPO, ModelEnv
+
+
+class PlannerModelEnv(ModelEnv):
+    """Model env over the planner's own model and reward: next states from cem.my_dx and rewards
+    from cem.get_cost, so the value is learned on the same returns CEM sums over its horizon.
+    """
+
+    def __init__(self, cem, termination_fn=None, batch_size=None):
+        super(PlannerModelEnv, self).__init__(batch_size)
+        self.cem = cem
+        self.termination_fn = termination_fn
+
+    def _step(self, obs, act):
+        xu = np.concatenate([obs, act], axis=1).astype(np.float64)
+        next_obs = np.asarray(self.cem.my_dx.predict(xu)).reshape(obs.shape)
+        # copied: oracle reward kernels reuse their output
+        rewards = np.array(self.cem.get_cost(xu, obs, act), dtype=np.float64).reshape(-1)
+        if self.termination_fn is None:
+            dones = np.zeros(len(obs), dtype=bool)
+        else:
+            dones = np.asarray(self.termination_fn(obs, act, next_obs)).reshape(-1) > 0
+        return next_obs, rewards, dones
+
+
+class TerminalValue(object):
+    """V(s) = Q(s, pi(s)) of an MBPO actor-critic trained next to the planner.
+
+    The critic learns from the real transitions the planner executes (add_transition) and from
+    short rollouts of its actor through the planner's model (update, once per episode after the
+    posterior is sampled). Set as cem.terminal_value, it is added to the predicted return of every
+    candidate at the end of the horizon, so CEM can plan with a shorter --plan-hor. The critic's
+    return is counted from the end of the horizon, so the value is discounted by gamma**horizon,
+    as in the H-step return r_0 + ... + r_{H-1} + gamma**H V(s_H). Until the first update has
+    trained the critic, values are 0 and CEM plans as without it.
+    """
+
+    def __init__(self, cem, obs_dim, action_dim, action_low, action_high, env_name, gamma=0.99, hidden_dim=256):
+        self.agent = SimplifiedMBPO(obs_dim, action_dim, np.asarray(action_low, dtype=np.float32),
+                                    np.asarray(action_high, dtype=np.float32),
+                                    PlannerModelEnv(cem, termination_fn=cem.termination_fn),
+                                    hidden_dim=hidden_dim, gamma=gamma, env_name=env_name)
+        self.gamma = gamma
+        self.ready = False
+
+    def add_transition(self, state, action, reward, next_state):
+        # the drivers run fixed-length episodes, so real transitions never end the return
+        self.agent.add_real_transition(np.asarray(state), np.asarray(action), np.asarray(reward),
+                                       np.asarray(next_state), 0.)
+
+    def update(self, episode, num_updates=200):
+        """roll the actor out through the current posterior sample and train actor and critic"""
+        self.agent.new_model_version()
+        num_rollouts, rollout_length = self.agent.rollout_schedule(episode)
+        self.agent.generate_model_rollouts(num_rollouts=num_rollouts, rollout_length=rollout_length)
+        if self.agent.train_policy(num_updates=num_updates) is not None:
+            self.ready = True
+
+    def __call__(self, states, horizon):
+        """values of [rows, obs_dim] states reached after horizon steps, as a flat float64 array"""
+        if not self.ready:
+            return np.zeros(len(states))
+        with torch.no_grad():
+            s = torch.as_tensor(np.asarray(states), dtype=torch.float32)
+            q = self.agent.critic(s, self.agent.actor(s)).numpy().astype(np.float64).reshape(-1)
+        return self.gamma ** horizon * q
+
+    def state_dict(self):
+        return {'agent': self.agent.state_dict(), 'ready': self.ready}
+
+    def load_state_dict(self, state):
+        self.agent.load_state_dict(state['agent'])
+        self.ready = state['ready']
@@ -0,0 +1,61 @@
+# pytest checks of TransitionRing across a real worker process: lapping, dropped rows and torn rows
+import multiprocessing as mp
+
+import numpy as np
+
+from actor_learner import TransitionRing
+
+OBS_DIM, ACTION_DIM = 3, 1
+
+
+def write_rows(ring, start, count):
+    # row i holds i in every column, so a row mixing two writes is detectable
+    for i in range(start, start + count):
+        ring.append(np.full(OBS_DIM, i), np.full(ACTION_DIM, i), i, np.full(OBS_DIM, i))
+
+
+def check_rows(rows):
+    """every returned row is whole, and the rows are consecutive; returns their indices"""
+    stacked = np.concatenate(rows, axis=1)
+    ids = stacked[:, 0]
+    assert np.all(stacked == ids[:, None]), 'torn row'
+    assert np.all(np.diff(ids) == 1)
+    return ids
+
+
+def test_lapped_ring_keeps_the_newest_capacity_minus_one_rows():
+    ctx = mp.get_context('spawn')
+    ring = TransitionRing(8, OBS_DIM, ACTION_DIM, ctx)
+    write_rows(ring, 0, 3)
+    assert list(check_rows(ring.read())) == [0, 1, 2]
+
+    worker = ctx.Process(target=write_rows, args=(ring, 3, 20))
+    worker.start()
+    worker.join(60)
+    assert worker.exitcode == 0
+    # rows 3..22 written into 8 slots: rows 16..22 are intact, 3..15 are lost
+    assert list(check_rows(ring.read())) == list(range(16, 23))
+    assert ring.dropped == 13
+    assert ring.read()[0].shape == (0, OBS_DIM)
+    ring.close()
+
+
+def test_reading_while_the_worker_laps_never_returns_torn_rows():
+    ctx = mp.get_context('spawn')
+    ring = TransitionRing(16, OBS_DIM, ACTION_DIM, ctx)
+    total = 200000
+    worker = ctx.Process(target=write_rows, args=(ring, 0, total))
+    worker.start()
+    received = 0
+    last = -1
+    while worker.is_alive() or ring.written.value > ring.read_pos:
+        ids = check_rows(ring.read())
+        if len(ids):
+            assert ids[0] > last
+            last = ids[-1]
+        received += len(ids)
+    worker.join(60)
+    assert worker.exitcode == 0
+    assert last == total - 1
+    assert received + ring.dropped == total
+    ring.close()
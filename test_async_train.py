@@ -0,0 +1,149 @@
+# pytest checks of BackgroundTrainer's call ordering and planner model swap, on stub models (no TensorFlow)
+import threading
+
+import numpy as np
+import pytest
+
+import async_train
+from async_train import BackgroundTrainer
+
+
+class StubModel(object):
+    """the parts of neural_bays_dx_tf BackgroundTrainer uses; every call is appended to events"""
+
+    def __init__(self, name, events, output_shape=2):
+        self.name, self.events = name, events
+        self.model_type, self.output_shape, self.sigma_n2 = name, output_shape, 1e-6
+        self.train_x = None
+        self.release = None  # threading.Event that train() waits for, to hold training in flight
+
+    def rows(self):
+        return 0 if self.train_x is None else len(self.train_x)
+
+    def add_data(self, new_x, new_y):
+        self.train_x = new_x if self.train_x is None else np.vstack((self.train_x, new_x))
+        self.events.append(('add_data', self.name, self.rows()))
+
+    def train(self, epochs):
+        if self.release is not None:
+            self.release.wait(5)
+        self.events.append(('train', self.name, self.rows()))
+
+    def update_bays_reg(self):
+        self.events.append(('update_bays_reg', self.name, self.rows()))
+
+    def sample(self):
+        self.events.append(('sample', self.name, self.rows()))
+
+
+class StubFrozen(object):
+    """stands in for numpy_bays_dx: copy_from() records the rows the live model held"""
+
+    def __init__(self, model_type, output_shape, sigma_n2=0.1):
+        self.name, self.events = 'frozen ' + model_type, None
+        self.rows = None
+
+    def copy_from(self, bays):
+        self.events = bays.events
+        self.rows = bays.rows()
+        self.events.append(('copy', bays.name, self.rows))
+
+    def sample(self):
+        self.events.append(('sample', self.name, self.rows))
+
+
+class StubCEM(object):
+    def __init__(self, my_dx, cost=None):
+        self.my_dx, self.cost = my_dx, cost
+
+
+@pytest.fixture(autouse=True)
+def stub_frozen(monkeypatch):
+    monkeypatch.setattr(async_train, 'numpy_bays_dx', StubFrozen)
+
+
+def run_episode(trainer, models, steps=3):
+    trainer.sample()
+    for _ in range(steps):
+        for model in models:
+            trainer.add_data(model, np.ones(3), np.ones(model.output_shape))
+
+
+def make_trainer(with_cost=True):
+    events = []
+    dx = StubModel('dx', events)
+    models = [dx]
+    if with_cost:
+        models.append(StubModel('cost', events, output_shape=1))
+    cem = StubCEM(dx, models[1] if with_cost else None)
+    return BackgroundTrainer(cem, [(m, 5) for m in models]), cem, models, events
+
+
+def test_first_boundary_trains_before_freezing_and_swaps_planner_models():
+    trainer, cem, (dx, cost), events = make_trainer()
+    run_episode(trainer, [dx, cost])
+    assert dx.rows() == 0 and cost.rows() == 0  # buffered until the boundary
+    trainer.finish_episode()
+    assert events[2:] == [('add_data', 'dx', 3), ('add_data', 'cost', 3),
+                          ('train', 'dx', 3), ('update_bays_reg', 'dx', 3),
+                          ('train', 'cost', 3), ('update_bays_reg', 'cost', 3),
+                          ('copy', 'dx', 3), ('copy', 'cost', 3)]
+    assert cem.my_dx is trainer.frozen[0] and cem.cost is trainer.frozen[1]
+    assert cem.my_dx is not dx and cem.cost is not cost
+    trainer.close()
+
+
+def test_start_trains_in_background_and_finish_episode_waits_for_it():
+    trainer, cem, (dx, cost), events = make_trainer()
+    run_episode(trainer, [dx, cost])
+    trainer.finish_episode()
+    frozen = list(trainer.frozen)
+    run_episode(trainer, [dx, cost])
+    trainer.finish_episode()  # episode 1's data is added but not yet trained on
+    assert trainer.pending is None and trainer.stale
+    dx.release = threading.Event()
+    del events[:]
+    trainer.start()
+    assert trainer.pending is not None
+    # the next episode plans with the posterior frozen before training, while training runs
+    run_episode(trainer, [dx, cost])
+    assert ('sample', 'frozen dx', 6) in events and ('train', 'dx', 6) not in events
+    assert cem.my_dx is frozen[0] and cem.cost is frozen[1]
+    dx.release.set()
+    trainer.finish_episode()
+    # training on 6 rows finishes before episode 2's rows are added, and the copies are refreshed last
+    assert events[-8:] == [('train', 'dx', 6), ('update_bays_reg', 'dx', 6),
+                           ('train', 'cost', 6), ('update_bays_reg', 'cost', 6),
+                           ('add_data', 'dx', 9), ('add_data', 'cost', 9),
+                           ('copy', 'dx', 9), ('copy', 'cost', 9)]
+    assert trainer.frozen == frozen and cem.my_dx is frozen[0]
+    trainer.close()
+
+
+def test_start_without_new_data_does_not_train():
+    trainer, cem, (dx, cost), events = make_trainer()
+    run_episode(trainer, [dx, cost])
+    trainer.finish_episode()
+    trainer.start()
+    assert trainer.pending is None
+    trainer.close()
+
+
+def test_resume_freezes_loaded_models_then_retrains():
+    trainer, cem, (dx, cost), events = make_trainer()
+    dx.add_data(np.ones((4, 3)), np.ones((4, 2)))
+    cost.add_data(np.ones((4, 3)), np.ones((4, 1)))
+    del events[:]
+    trainer.resume()
+    trainer.close()
+    assert events[:2] == [('copy', 'dx', 4), ('copy', 'cost', 4)]
+    assert ('train', 'dx', 4) in events[2:] and ('train', 'cost', 4) in events[2:]
+    assert cem.my_dx is trainer.frozen[0] and cem.cost is trainer.frozen[1]
+
+
+def test_oracle_reward_run_leaves_cem_cost_alone():
+    trainer, cem, (dx,), events = make_trainer(with_cost=False)
+    run_episode(trainer, [dx])
+    trainer.finish_episode()
+    assert cem.my_dx is trainer.frozen[0] and cem.cost is None
+    trainer.close()
@@ -11,10 +11,10 @@ from collections import OrderedDict
 import tensorflow as tf
 import numpy as np
 from tqdm import trange
-from scipy.io import savemat, loadmat
 
 from tf_models.utils import get_required_argument, TensorStandardScaler
 from tf_models.fc import FC
+from tf_models.model_io import save_model_file, ModelFile
 
 from tf_models.tf_logging import Progress, Silent
 
@@ -38,8 +38,14 @@ class BNN:
                     saved by default. Defaults to None.
                 .load_model (bool): (optional) If True, model will be loaded from the model directory,
                     assuming that the files are generated by a model of the same name. Defaults to False.
+                .lazy_load (bool): (optional) If True, only the structure is read when the model is
+                    loaded and the variables are read from disk at finalize(). Defaults to False.
                 .sess (tf.Session/None): The session that this model will use.
                     If None, creates a session with its own associated graph. Defaults to None.
+                .independent_members (bool): (optional) If True, every network has its own input scaler,
+                    fit on its own data by train_members(), and its own log-variance bounds, so networks
+                    trained by train_members() do not interact. Read from the file if the model is loaded.
+                    Defaults to False.
         """
         self.name = get_required_argument(params, 'name', 'Must provide name.')
         self.model_dir = params.get('model_dir', None)
@@ -73,14 +79,18 @@ class BNN:
         if params.get('load_model', False):
             if self.model_dir is None:
                 raise ValueError("Cannot load model without providing model directory.")
+            self._model_file = ModelFile(os.path.join(self.model_dir, "%s.npz" % self.name),
+                                         lazy=params.get('lazy_load', False))
             self._load_structure()
             self.num_nets, self.model_loaded = self.layers[0].get_ensemble_size(), True
+            self.independent_members = self._model_file.variable(0).ndim == 3
             print("Model loaded from %s." % self.model_dir)
             self.num_elites = params['num_elites']
         else:
             self.num_nets = params.get('num_networks', 1)
             self.num_elites = params['num_elites'] #params.get('num_elites', 1)
             self.model_loaded = False
+            self.independent_members = params.get('independent_members', False)
 
         if self.num_nets == 1:
             print("Created a neural network with variance predictions.")
@@ -166,10 +176,14 @@ class BNN:
         # Construct all variables.
         with self.sess.as_default():
             with tf.variable_scope(self.name):
-                self.scaler = TensorStandardScaler(self.layers[0].get_input_dim())
-                self.max_logvar = tf.Variable(np.ones([1, self.layers[-1].get_output_dim() // 2])/2., dtype=tf.float32,
+                self.scaler = TensorStandardScaler(self.layers[0].get_input_dim(),
+                                                   self.num_nets if self.independent_members else None)
+                logvar_shape = [1, self.layers[-1].get_output_dim() // 2]
+                if self.independent_members:
+                    logvar_shape = [self.num_nets] + logvar_shape
+                self.max_logvar = tf.Variable(np.ones(logvar_shape)/2., dtype=tf.float32,
                                               name="max_log_var")
-                self.min_logvar = tf.Variable(-np.ones([1, self.layers[-1].get_output_dim() // 2])*10., dtype=tf.float32,
+                self.min_logvar = tf.Variable(-np.ones(logvar_shape)*10., dtype=tf.float32,
                                               name="min_log_var")
                 for i, layer in enumerate(self.layers):
                     with tf.variable_scope("Layer%i" % i):
@@ -218,14 +232,20 @@ class BNN:
                                                shape=[self.num_nets, None, self.layers[0].get_input_dim()],
                                                name="3D_training_inputs")
             self.sy_pred_layer = self.create_layer_tensors(self.sy_pred_in2d)
+            self.sy_pred_layer3d = self.create_layer_tensors(self.sy_pred_in3d)
 
         # Load model if needed
         if self.model_loaded:
             with self.sess.as_default():
-                params_dict = loadmat(os.path.join(self.model_dir, "%s.mat" % self.name))
                 all_vars = self.nonoptvars + self.optvars
                 for i, var in enumerate(all_vars):
-                    var.load(params_dict[str(i)])
+                    var.load(self._model_file.variable(i))
+                if self._model_file.model_inds is not None:
+                    self._model_inds = self._model_file.model_inds
+                if self._model_file.scaler_fitted:
+                    self.scaler.fitted = True
+                    self.scaler.cache()
+            self._model_file.close()
         self.finalized = True
 
     ##################
@@ -399,6 +419,47 @@ class BNN:
         # Select elite models based on losses
         self._end_train(holdout_losses)
 
+    def train_members(self, inputs, targets, batch_size=32, epochs=100, hide_progress=False, rngs=None):
+        """Trains each network of the ensemble on its own dataset, e.g. one seed's data per member.
+
+        Arguments:
+            inputs (list of np.ndarray): num_nets arrays of network inputs in rows, one per member.
+            targets (list of np.ndarray): num_nets arrays of targets matching inputs.
+            batch_size (int): The minibatch size of every member.
+            epochs (int): Number of epochs over the largest dataset.
+            hide_progress (bool): If True, hides the progress bar.
+            rngs (list/None): One np.random.RandomState per member for its bootstrap indices and
+                shuffles. Defaults to the global numpy RNG.
+
+        Members with less data draw bootstrap indices over their own rows so that all members
+        step through the same number of minibatches. With independent_members each member's scaler
+        is fit on its own data, otherwise the shared scaler is fit on the pooled data. Every member
+        is kept as an elite.
+
+        Returns: None
+        """
+        if len(inputs) != self.num_nets or len(targets) != self.num_nets:
+            raise ValueError("Need one dataset per ensemble member ({}), got {}".format(self.num_nets, len(inputs)))
+
+        with self.sess.as_default():
+            self.scaler.fit(list(inputs) if self.independent_members else np.concatenate(inputs, axis=0))
+
+        rngs = [np.random] * self.num_nets if rngs is None else rngs
+        num_rows = max(x.shape[0] for x in inputs)
+        idxs = [rng.randint(x.shape[0], size=num_rows) for rng, x in zip(rngs, inputs)]
+        epoch_range = range(epochs) if hide_progress else trange(epochs, unit="epoch(s)", desc="Network training")
+        for _ in epoch_range:
+            for batch_num in range(int(np.ceil(num_rows / batch_size))):
+                batch = slice(batch_num * batch_size, (batch_num + 1) * batch_size)
+                self.sess.run(
+                    self.train_op,
+                    feed_dict={self.sy_train_in: np.stack([x[i[batch]] for x, i in zip(inputs, idxs)]),
+                               self.sy_train_targ: np.stack([y[i[batch]] for y, i in zip(targets, idxs)])}
+                )
+            idxs = [rng.permutation(i) for rng, i in zip(rngs, idxs)]
+
+        self._model_inds = list(range(self.num_nets))
+
     def predict(self, inputs, factored=False, layer = False, *args, **kwargs):
         """Returns the distribution predicted by the model for each input vector in inputs.
         Behavior is affected by the dimensionality of inputs and factored as follows:
@@ -417,6 +478,9 @@ class BNN:
             [ensemble_size, batch_size, output_dim], where N(mean[i, j, :], diag([i, j, :])) is the
             predicted output distribution by the ith model in the ensemble on input vector [i, j].
 
+        layer=True: Returns the last hidden layer features instead, [ensemble_size, batch_size, hidden_dim],
+            of every model on every input (2D inputs) or of the ith model on input [i, j] (3D inputs).
+
         Arguments:
             inputs (np.ndarray): An array of input vectors in rows. See above for behavior.
             factored (bool): See above for behavior.
@@ -435,6 +499,8 @@ class BNN:
                     feed_dict={self.sy_pred_in2d: inputs}
                 )
         else:
+            if layer:
+                return self.sess.run(self.sy_pred_layer3d, feed_dict={self.sy_pred_in3d: inputs})
             return self.sess.run(
                 [self.sy_pred_mean3d_fac, self.sy_pred_var3d_fac],
                 feed_dict={self.sy_pred_in3d: inputs}
@@ -458,51 +524,59 @@ class BNN:
         output = self._compile_last_layer(inputs)
         return output
 
-    def save(self, savedir, timestep):
-        """Saves all information required to recreate this model in two files in savedir
-        (or self.model_dir if savedir is None), one containing the model structuure and the other
-        containing all variables in the network.
-
-        savedir (str): (Optional) Path to which files will be saved. If not provided, self.model_dir
+    def get_structure(self):
+        """Returns the FC constructor arguments of every layer, as they were passed to add()."""
+        structure = []
+        for i, layer in enumerate(self.layers):
+            output_dim, activation = layer.get_output_dim(), layer.get_activation(as_func=False)
+            if i == len(self.layers) - 1:
+                # finalize() doubled the last layer for the variance output and moved its activation
+                output_dim, activation = output_dim // 2, self.end_act_name
+            structure.append({'output_dim': output_dim, 'input_dim': layer.get_input_dim(),
+                              'activation': activation, 'weight_decay': layer.get_weight_decay(),
+                              'ensemble_size': layer.get_ensemble_size()})
+        return structure
+
+    def save(self, savedir, timestep, blr=None):
+        """Saves all information required to recreate this model in a single binary file
+        savedir/<name>_<timestep>.npz (see tf_models.model_io for the layout): the structure, all
+        variables in the network including the scaler, and the elite indices.
+
+        savedir (str): (Optional) Path to which the file will be saved. If not provided, self.model_dir
             (the directory provided at initialization) will be used.
+        blr (dict/None): (Optional) Bayesian linear regression posterior to store alongside the network.
         """
         if not self.finalized:
             raise RuntimeError()
         model_dir = self.model_dir if savedir is None else savedir
+        save_model_file(os.path.join(model_dir, '{}_{}.npz'.format(self.name, timestep)), self.get_structure(),
+                        self.sess.run(self.nonoptvars + self.optvars), self.scaler.fitted,
+                        model_inds=getattr(self, '_model_inds', None), blr=blr)
 
-        # Write structure to file
-        with open(os.path.join(model_dir, '{}_{}.nns'.format(self.name, timestep)), "w+") as f:
-            for layer in self.layers[:-1]:
-                f.write("%s\n" % repr(layer))
-            last_layer_copy = self.layers[-1].copy()
-            last_layer_copy.set_activation(self.end_act_name)
-            last_layer_copy.set_output_dim(last_layer_copy.get_output_dim() // 2)
-            f.write("%s\n" % repr(last_layer_copy))
-
-        # Save network parameters (including scalers) in a .mat file
-        var_vals = {}
-        for i, var_val in enumerate(self.sess.run(self.nonoptvars + self.optvars)):
-            var_vals[str(i)] = var_val
-        savemat(os.path.join(model_dir, '{}_{}.mat'.format(self.name, timestep)), var_vals)
+    def get_checkpoint_state(self):
+        """Returns the values of all variables (scaler, weights, log-variance bounds and optimizer
+        slots, in the order save() uses followed by the optimizer's) and the elite indices.
+        """
+        all_vars = self.nonoptvars + self.optvars + self.optimizer.variables()
+        return {'values': self.sess.run(all_vars), 'model_inds': getattr(self, '_model_inds', None),
+                'scaler_fitted': self.scaler.fitted}
+
+    def load_checkpoint_state(self, state):
+        """Restores variables and elite indices from get_checkpoint_state()."""
+        all_vars = self.nonoptvars + self.optvars + self.optimizer.variables()
+        for var, value in zip(all_vars, state['values']):
+            var.load(value, self.sess)
+        if state['model_inds'] is not None:
+            self._model_inds = state['model_inds']
+        self.scaler.fitted = state['scaler_fitted']
+        with self.sess.as_default():
+            self.scaler.cache()
 
     def _load_structure(self):
         """Uses the saved structure in self.model_dir with the name of this network to initialize
         the structure of this network.
         """
-        structure = []
-        with open(os.path.join(self.model_dir, "%s.nns" % self.name), "r") as f:
-            for line in f:
-                kwargs = {
-                    key: val for (key, val) in
-                    [argval.split("=") for argval in line[3:-2].split(", ")]
-                }
-                kwargs["input_dim"] = int(kwargs["input_dim"])
-                kwargs["output_dim"] = int(kwargs["output_dim"])
-                kwargs["weight_decay"] = None if kwargs["weight_decay"] == "None" else float(kwargs["weight_decay"])
-                kwargs["activation"] = None if kwargs["activation"] == "None" else kwargs["activation"][1:-1]
-                kwargs["ensemble_size"] = int(kwargs["ensemble_size"])
-                structure.append(FC(**kwargs))
-        self.layers = structure
+        self.layers = [FC(**kwargs) for kwargs in self._model_file.structure]
 
     #######################
     # Compilation methods #
@@ -30,9 +30,10 @@ def construct_cost_model(obs_dim, act_dim, hidden_dim=200, num_networks=1, num_e
 	model.finalize(tf.train.AdamOptimizer, {"learning_rate": 0.001})
 	return model
 
-def construct_shallow_model(obs_dim, act_dim, hidden_dim=200, num_networks=1, num_elites=1, session=None):
+def construct_shallow_model(obs_dim, act_dim, hidden_dim=200, num_networks=1, num_elites=1, session=None, independent_members=False):
 	print('[ BNN ] Observation dim {} | Action dim: {} | Hidden dim: {}'.format(obs_dim, act_dim, hidden_dim))
-	params = {'name': 'BNN', 'num_networks': num_networks, 'num_elites': num_elites, 'sess': session}
+	params = {'name': 'BNN', 'num_networks': num_networks, 'num_elites': num_elites, 'sess': session,
+			  'independent_members': independent_members}
 	model = BNN(params)
 
 	model.add(FC(hidden_dim, input_dim=obs_dim+act_dim, activation="swish", weight_decay=0.000025))
@@ -45,9 +46,10 @@ def construct_shallow_model(obs_dim, act_dim, hidden_dim=200, num_networks=1, nu
 	model.finalize(tf.train.AdamOptimizer, {"learning_rate": 0.001})
 	return model
 
-def construct_shallow_cost_model(obs_dim, act_dim, hidden_dim=200, num_networks=1, num_elites=1, session=None):
+def construct_shallow_cost_model(obs_dim, act_dim, hidden_dim=200, num_networks=1, num_elites=1, session=None, independent_members=False):
 	print('[ BNN ] Observation dim {} | Action dim: {} | Hidden dim: {}'.format(obs_dim, act_dim, hidden_dim))
-	params = {'name': 'BNN_cost', 'num_networks': num_networks, 'num_elites': num_elites, 'sess': session}
+	params = {'name': 'BNN_cost', 'num_networks': num_networks, 'num_elites': num_elites, 'sess': session,
+			  'independent_members': independent_members}
 	model = BNN(params)
 
 	model.add(FC(hidden_dim, input_dim=obs_dim+act_dim, activation="swish", weight_decay=0.000025))
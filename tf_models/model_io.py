@@ -0,0 +1,117 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import json
+import os
+
+import numpy as np
+
+# Bump when the layout below changes; readers refuse files newer than they understand.
+FORMAT_VERSION = 1
+
+
+def save_model_file(path, structure, variables, scaler_fitted, model_inds=None, blr=None):
+    """Writes a trained model to a single uncompressed .npz file.
+
+    Layout (format version 1):
+        format_version: int scalar.
+        structure: JSON string, one dict of FC constructor arguments per layer.
+        var0 ... varN: network variables, in BNN order (scaler mean and std, then the weights and
+            biases of every layer, then the max/min log-variance).
+        scaler_fitted: bool scalar.
+        model_inds: elite indices, if any.
+        blr_<key>: Bayesian linear regression posterior (mu_w, cov_w, ...), if given.
+
+    The file is written to a temporary name and renamed, so readers never see a partial model.
+    No array needs pickling, so the file loads with allow_pickle=False.
+
+    Arguments:
+        path (str): Destination path, normally ending in .npz.
+        structure (list): Layer constructor arguments, as returned by BNN.get_structure().
+        variables (list): Variable values as numpy arrays.
+        scaler_fitted (bool): Whether the input scaler has been fit.
+        model_inds (list/None): Elite indices of the ensemble.
+        blr (dict/None): Posterior arrays of the Bayesian linear regression head.
+
+    Returns: None.
+    """
+    arrays = {
+        'format_version': np.array(FORMAT_VERSION),
+        'structure': np.array(json.dumps(structure)),
+        'scaler_fitted': np.array(bool(scaler_fitted)),
+    }
+    for i, value in enumerate(variables):
+        arrays['var%d' % i] = np.asarray(value)
+    if model_inds is not None:
+        arrays['model_inds'] = np.asarray(model_inds)
+    for key, value in (blr or {}).items():
+        if value is not None:
+            arrays['blr_' + key] = np.asarray(value)
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, path)
+
+
+class ModelFile:
+    """Read access to a model written by save_model_file.
+
+    With lazy=False every array is read at construction and the file is closed. With lazy=True only
+    the header (version, structure) is read up front and each array is read from disk on first
+    access, which is enough to e.g. build the network structure or fetch the BLR posterior without
+    touching the weights.
+    """
+    def __init__(self, path, lazy=False):
+        self.path = path
+        self._npz = np.load(path, allow_pickle=False)
+        self.version = int(self._npz['format_version'])
+        if self.version > FORMAT_VERSION:
+            self._npz.close()
+            raise ValueError("%s has model format version %d, this code reads up to %d."
+                             % (path, self.version, FORMAT_VERSION))
+        self.structure = json.loads(str(self._npz['structure']))
+        self.keys = list(self._npz.files)
+        self.num_vars = sum(1 for key in self.keys if key.startswith('var'))
+        self._cache = {}
+        if not lazy:
+            for key in self.keys:
+                self._get(key)
+            self.close()
+
+    def _get(self, key):
+        if key not in self._cache:
+            if self._npz is None:
+                raise RuntimeError("%s is closed." % self.path)
+            self._cache[key] = self._npz[key]
+        return self._cache[key]
+
+    @property
+    def scaler_fitted(self):
+        return bool(self._get('scaler_fitted'))
+
+    @property
+    def model_inds(self):
+        return self._get('model_inds').tolist() if 'model_inds' in self.keys else None
+
+    def variable(self, i):
+        return self._get('var%d' % i)
+
+    def variables(self):
+        return [self.variable(i) for i in range(self.num_vars)]
+
+    def blr(self):
+        """Returns the BLR posterior arrays as a dict (empty if none were saved)."""
+        return {key[len('blr_'):]: self._get(key) for key in self.keys if key.startswith('blr_')}
+
+    def close(self):
+        if self._npz is not None:
+            self._npz.close()
+            self._npz = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
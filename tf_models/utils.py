@@ -14,22 +14,25 @@ def get_required_argument(dotmap, key, message, default=None):
 class TensorStandardScaler:
     """Helper class for automatically normalizing inputs into the network.
     """
-    def __init__(self, x_dim):
+    def __init__(self, x_dim, num_members=None):
         """Initializes a scaler.
 
         Arguments:
         x_dim (int): The dimensionality of the inputs into the scaler.
+        num_members (int/None): If given, every ensemble member has its own mean and standard
+            deviation ([num_members, 1, x_dim]), and 2D inputs are scaled into one slab per member.
 
         Returns: None.
         """
         self.fitted = False
+        self.shape = [1, x_dim] if num_members is None else [num_members, 1, x_dim]
         with tf.variable_scope("Scaler"):
             self.mu = tf.get_variable(
-                name="scaler_mu", shape=[1, x_dim], initializer=tf.constant_initializer(0.0),
+                name="scaler_mu", shape=self.shape, initializer=tf.constant_initializer(0.0),
                 trainable=False
             )
             self.sigma = tf.get_variable(
-                name="scaler_std", shape=[1, x_dim], initializer=tf.constant_initializer(1.0),
+                name="scaler_std", shape=self.shape, initializer=tf.constant_initializer(1.0),
                 trainable=False
             )
 
@@ -41,16 +44,21 @@ class TensorStandardScaler:
         This function must be called within a 'with <session>.as_default()' block.
 
         Arguments:
-        data (np.ndarray): A numpy array containing the input
+        data (np.ndarray/list): A numpy array containing the input, or, for a per-member scaler,
+            a list with one such array per member.
 
         Returns: None.
         """
-        mu = np.mean(data, axis=0, keepdims=True)
-        sigma = np.std(data, axis=0, keepdims=True)
+        if isinstance(data, (list, tuple)):
+            mu = np.stack([np.mean(x, axis=0, keepdims=True) for x in data])
+            sigma = np.stack([np.std(x, axis=0, keepdims=True) for x in data])
+        else:
+            mu = np.mean(data, axis=0, keepdims=True)
+            sigma = np.std(data, axis=0, keepdims=True)
         sigma[sigma < 1e-12] = 1.0
 
-        self.mu.load(mu)
-        self.sigma.load(sigma)
+        self.mu.load(np.broadcast_to(mu, self.shape))
+        self.sigma.load(np.broadcast_to(sigma, self.shape))
         self.fitted = True
         self.cache()
 